@@ -1,6 +1,6 @@
 from flask import Flask
 from config import Config
-from app.extensions import db, migrate, login_manager
+from app.extensions import db, migrate, login_manager, view_counter, fragment_cache, web_activity, metrics
 from flask import render_template
 import threading
 
@@ -12,6 +12,14 @@ def create_app(config_class=Config):
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    view_counter.init_app(app)
+    fragment_cache.init_app(app)
+    web_activity.init_app(app)
+    metrics.init_app(app)
+
+    # Per-request SQL statement counter (X-SQL-Queries header)
+    from app.querycount import init_query_counter
+    init_query_counter(app)
 
     # Register Blueprints
     from app.routes.auth import bp as auth_bp
@@ -21,9 +29,15 @@ def create_app(config_class=Config):
     app.register_blueprint(main_bp)
 
     # Register CLI commands
-    from app.commands import load_wallpapers_command, make_admin_command
+    from app.commands import load_wallpapers_command, make_admin_command, duplicates_command, rebuild_similar_command, generate_derivatives_command, migrate_storage_command, verify_storage_command, reconcile_command
     app.cli.add_command(load_wallpapers_command)
     app.cli.add_command(make_admin_command)
+    app.cli.add_command(duplicates_command)
+    app.cli.add_command(rebuild_similar_command)
+    app.cli.add_command(generate_derivatives_command)
+    app.cli.add_command(migrate_storage_command)
+    app.cli.add_command(verify_storage_command)
+    app.cli.add_command(reconcile_command)
 
     # Ensure upload directories exist
     import os
@@ -0,0 +1,27 @@
+from app.extensions import db
+from app.fragcache import mark_catalog_changed
+from app.models import Wallpaper
+from app.similar import forget_wallpaper
+
+# Write-path hooks for changes to the visible catalog. Every place that
+# activates, retags or deletes a wallpaper calls one of these (inside its
+# transaction, before the commit) so derived data can be kept up to date.
+# Each one also bumps the catalog version once the transaction commits, which
+# invalidates the cached feed pages (app/fragcache.py).
+
+
+def wallpaper_activated(wallpaper):
+    wallpaper.similar_stale = True
+    mark_catalog_changed(db.session)
+
+
+def wallpaper_retagged(wallpaper):
+    wallpaper.similar_stale = True
+    mark_catalog_changed(db.session)
+
+
+def wallpaper_deleted(wallpaper):
+    # Uploads flagged as near-duplicates of this one no longer point anywhere
+    Wallpaper.query.filter_by(duplicate_of_id=wallpaper.id).update({'duplicate_of_id': None})
+    forget_wallpaper(wallpaper.id)
+    mark_catalog_changed(db.session)
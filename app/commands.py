@@ -1,18 +1,23 @@
 import os
+import time
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 from app.extensions import db
-from app.models import Wallpaper, User, Tag
-from app.utils import allowed_file, generate_thumbnail
-from werkzeug.utils import secure_filename
-import shutil
+from app.models import Wallpaper, User
 
 @click.command('load-wallpapers')
 @click.argument('folder_path', type=click.Path(exists=True, file_okay=False, dir_okay=True))
 @click.option('--username', default='admin', help='Username of the uploader')
+@click.option('--workers', type=int, default=None, help='Pool size (defaults to QUARANTINE_WORKERS)')
+@click.option('--chunk-size', type=int, default=500, help='Rows inserted per commit')
+@click.option('--manifest', 'manifest_path', type=click.Path(dir_okay=False), default=None,
+              help='Resume manifest (defaults to FOLDER_PATH/.load-wallpapers.manifest)')
 @with_appcontext
-def load_wallpapers_command(folder_path, username):
+def load_wallpapers_command(folder_path, username, workers, chunk_size, manifest_path):
     """Recursively load wallpapers from a folder into the database."""
+    from app.importer import load_wallpapers
+
     user = User.query.filter_by(username=username).first()
     if not user:
         click.echo(f"User '{username}' not found. Please create it first.")
@@ -22,49 +27,199 @@ def load_wallpapers_command(folder_path, username):
     if not os.path.exists(upload_folder):
         os.makedirs(upload_folder)
 
+    started = time.monotonic()
+    count, failed = load_wallpapers(folder_path, user, upload_folder,
+                                    workers or current_app.config['QUARANTINE_WORKERS'],
+                                    derivative_widths=current_app.config['DERIVATIVE_WIDTHS'],
+                                    chunk_size=chunk_size, manifest_path=manifest_path, log=click.echo)
+    elapsed = time.monotonic() - started
+    click.echo(f"Successfully loaded {count} wallpapers ({failed} failed) in {elapsed:.1f}s.")
+
+@click.command('duplicates')
+@click.option('--distance', type=int, default=None, help='Max Hamming distance (defaults to DUPLICATE_DISTANCE)')
+@click.option('--backfill', is_flag=True, help='Hash active wallpapers that have no stored hash first')
+@with_appcontext
+def duplicates_command(distance, backfill):
+    """Report clusters of near-duplicate wallpapers across the catalog."""
+    from app.hashindex import load_catalog_index
+    from app.pipeline import get_executor
+    from app.utils import get_image_hash
+
+    if distance is None:
+        distance = current_app.config['DUPLICATE_DISTANCE']
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+
+    if backfill:
+        missing = Wallpaper.query.filter(Wallpaper.status == 'active', Wallpaper.image_hash.is_(None)).all()
+        executor = get_executor(current_app.config['QUARANTINE_WORKERS'])
+        hashes = executor.map(get_image_hash, [w.filename for w in missing], [upload_folder] * len(missing), chunksize=32)
+        for w, image_hash in zip(missing, hashes):
+            w.image_hash = image_hash
+        db.session.commit()
+        click.echo(f"Hashed {len(missing)} wallpapers.")
+
+    index = load_catalog_index()
+    clusters = index.clusters(distance)
+    for cluster in sorted(clusters, key=len, reverse=True):
+        rows = Wallpaper.query.filter(Wallpaper.id.in_(cluster)).order_by(Wallpaper.timestamp).all()
+        click.echo(f"Cluster of {len(rows)}:")
+        for w in rows:
+            click.echo(f"  #{w.id} {w.image_hash} {w.filename} ({w.title})")
+    click.echo(f"{len(clusters)} duplicate cluster(s) among {len(index)} hashed wallpapers (distance <= {distance}).")
+
+@click.command('rebuild-similar')
+@with_appcontext
+def rebuild_similar_command():
+    """Recompute the precomputed similar-wallpaper lists for the whole catalog."""
+    from app.similar import refresh_similar
+
+    Wallpaper.query.filter_by(status='active').update({'similar_stale': True})
+    db.session.commit()
+
     count = 0
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if allowed_file(file):
-                file_path = os.path.join(root, file)
-                filename = secure_filename(file)
-                
-                # Handle filename collisions
-                if Wallpaper.query.filter_by(filename=filename).first():
-                    import uuid
-                    filename = f"{uuid.uuid4().hex}_{filename}"
-                
-                dest_path = os.path.join(upload_folder, filename)
-                shutil.copy2(file_path, dest_path)
-                
-                # Generate thumbnail
-                thumb_filename = generate_thumbnail(filename)
-                
-                # Use subfolder name as tag
-                tag_name = os.path.basename(root).lower()
-                tag = None
-                if tag_name and tag_name != os.path.basename(folder_path).lower():
-                    tag = Tag.query.filter_by(name=tag_name).first()
-                    if not tag:
-                        tag = Tag(name=tag_name)
-                        db.session.add(tag)
-                
-                title = file.rsplit('.', 1)[0].replace('_', ' ').replace('-', ' ').title()
-                wallpaper = Wallpaper(
-                    title=title,
-                    filename=filename,
-                    thumbnail_filename=thumb_filename,
-                    uploader=user
-                )
-                if tag:
-                    wallpaper.tags.append(tag)
-                
-                db.session.add(wallpaper)
-                count += 1
-                click.echo(f"Added: {title}")
+    while True:
+        stale = Wallpaper.query.filter(Wallpaper.status == 'active', Wallpaper.similar_stale.is_(True)) \
+            .order_by(Wallpaper.id).limit(200).all()
+        if not stale:
+            break
+        for w in stale:
+            refresh_similar(w)
+        db.session.commit()
+        count += len(stale)
+        click.echo(f"Refreshed {count} wallpapers...")
+    click.echo(f"Rebuilt similar lists for {count} wallpapers.")
+
+@click.command('generate-derivatives')
+@click.option('--all', 'regenerate', is_flag=True, help='Regenerate for every active wallpaper, not just missing ones')
+@with_appcontext
+def generate_derivatives_command(regenerate):
+    """Generate the responsive WebP derivatives (DERIVATIVE_WIDTHS) for active wallpapers."""
+    from app.models import WallpaperVariant
+    from app.pipeline import get_executor
+    from app.utils import generate_derivatives
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    widths = current_app.config['DERIVATIVE_WIDTHS']
+    query = Wallpaper.query.filter(Wallpaper.status == 'active')
+    if not regenerate:
+        query = query.filter(~Wallpaper.variants.any())
+    wallpapers = query.order_by(Wallpaper.id).all()
 
+    executor = get_executor(current_app.config['QUARANTINE_WORKERS'])
+    results = executor.map(generate_derivatives, [w.filename for w in wallpapers],
+                           [widths] * len(wallpapers), [upload_folder] * len(wallpapers), chunksize=8)
+    count = 0
+    for w, derivatives in zip(wallpapers, results):
+        # Filenames are deterministic, so drop the old rows before inserting new ones
+        w.variants.clear()
+        db.session.flush()
+        w.variants = [WallpaperVariant(width=width, height=height, filename=filename)
+                      for width, height, filename in derivatives]
+        count += 1
+        if count % 100 == 0:
+            db.session.commit()
+            click.echo(f"Processed {count}/{len(wallpapers)}...")
     db.session.commit()
-    click.echo(f"Successfully loaded {count} wallpapers.")
+    click.echo(f"Generated derivatives for {count} wallpapers.")
+
+@click.command('migrate-storage')
+@click.option('--batch-size', type=int, default=200, help='Wallpapers moved per commit')
+@with_appcontext
+def migrate_storage_command(batch_size):
+    """Move flat-named uploads into the content-addressed, sharded layout (resumable)."""
+    from app.models import Blob
+    from app.pipeline import get_executor
+    from app.storage import migrate_file, add_ref
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    executor = get_executor(current_app.config['QUARANTINE_WORKERS'])
+    moved = missing = 0
+    last_id = 0
+    while True:
+        # Flat names have no shard directory
+        wallpapers = Wallpaper.query.filter(Wallpaper.status == 'active', Wallpaper.id > last_id,
+                                            ~Wallpaper.filename.contains('/')) \
+            .order_by(Wallpaper.id).limit(batch_size).all()
+        if not wallpapers:
+            break
+        last_id = wallpapers[-1].id
+        results = executor.map(migrate_file, [upload_folder] * len(wallpapers), [w.filename for w in wallpapers],
+                               [w.thumbnail_filename for w in wallpapers],
+                               [[(v.width, v.height, v.filename) for v in w.variants] for w in wallpapers])
+        old_files = []
+        for w, result in zip(wallpapers, results):
+            if result is None:
+                click.echo(f"Missing file for #{w.id}: {w.filename}")
+                missing += 1
+                continue
+            old_files += [w.filename, w.thumbnail_filename] + [v.filename for v in w.variants]
+            add_ref(result['sha256'], result['filename'], result['size'])
+            w.filename = result['filename']
+            w.thumbnail_filename = result['thumbnail']
+            for variant in list(w.variants):
+                new_name = result['variants'].get(variant.filename)
+                if new_name:
+                    variant.filename = new_name
+                else:
+                    w.variants.remove(variant)
+            moved += 1
+        db.session.commit()
+        # The new names are committed; now the old ones can go
+        for filename in old_files:
+            if filename and '/' not in filename and os.path.exists(os.path.join(upload_folder, filename)):
+                os.remove(os.path.join(upload_folder, filename))
+        click.echo(f"Moved {moved} wallpapers...")
+    click.echo(f"Migrated {moved} wallpapers into {Blob.query.count()} blobs ({missing} missing).")
+
+@click.command('verify-storage')
+@click.option('--fix', is_flag=True, help='Correct reference counts from the wallpaper table')
+@with_appcontext
+def verify_storage_command(fix):
+    """Re-hash every stored blob and check reference counts."""
+    from sqlalchemy import func
+    from app.models import Blob
+    from app.pipeline import get_executor
+    from app.storage import check_blob
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    blobs = Blob.query.order_by(Blob.hash).all()
+    executor = get_executor(current_app.config['QUARANTINE_WORKERS'])
+    states = executor.map(check_blob, [upload_folder] * len(blobs), [b.filename for b in blobs],
+                          [b.hash for b in blobs], chunksize=16)
+    problems = 0
+    for blob, state in zip(blobs, states):
+        if state != 'ok':
+            click.echo(f"{state.upper()}: {blob.filename}")
+            problems += 1
+
+    counts = dict(db.session.query(Wallpaper.filename, func.count(Wallpaper.id))
+                  .filter(Wallpaper.filename.in_(db.select(Blob.filename))).group_by(Wallpaper.filename))
+    for blob in blobs:
+        actual = counts.get(blob.filename, 0)
+        if blob.refcount != actual:
+            click.echo(f"REFCOUNT: {blob.filename} has {blob.refcount}, used by {actual}")
+            problems += 1
+            if fix:
+                blob.refcount = actual
+    if fix:
+        db.session.commit()
+    click.echo(f"Checked {len(blobs)} blobs: {problems} problem(s).")
+
+@click.command('reconcile')
+@click.option('--dry-run', is_flag=True, help='Only report what would be deleted')
+@click.option('--full', is_flag=True, help='Rescan every directory, not just the changed ones')
+@with_appcontext
+def reconcile_command(dry_run, full):
+    """Delete files in uploads/quarantine that no wallpaper references."""
+    from app.reconcile import reconcile
+
+    config = current_app.config
+    deleted = reconcile(config['UPLOAD_FOLDER'], config['QUARANTINE_FOLDER'], config['RECONCILE_GRACE'],
+                        config['RECONCILE_STATE_FILE'], config['RECONCILE_JOURNAL'],
+                        dry_run=dry_run, full=full, full_interval=config['RECONCILE_FULL_INTERVAL'],
+                        log=click.echo)
+    freed = sum(size for _, _, size in deleted)
+    click.echo(f"{freed / 1024 / 1024:.1f} MB {'reclaimable' if dry_run else 'freed'}.")
 
 @click.command('make-admin')
 @click.argument('username')
@@ -80,5 +235,3 @@ def make_admin_command(username):
     db.session.commit()
     click.echo(f"User '{username}' is now an admin.")
 
-
-from flask import current_app
@@ -1,8 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
+from app.viewcounter import ViewCounter
+from app.fragcache import FragmentCache
+from app.governor import WebActivity
+from app.metrics import Metrics
 
 db = SQLAlchemy()
 migrate = Migrate()
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
+view_counter = ViewCounter()
+fragment_cache = FragmentCache()
+web_activity = WebActivity()
+metrics = Metrics()
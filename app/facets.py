@@ -0,0 +1,105 @@
+from sqlalchemy import text
+from sqlalchemy.orm import selectinload
+from app.extensions import db
+from app.models import Tag, Wallpaper, wallpaper_tags
+from app.pagination import encode_cursor, decode_cursor
+
+# Faceted browsing: wallpapers carrying *all* of the selected tags.
+#
+# The intersection walks the posting list (wallpaper_tags by tag_id, in
+# wallpaper_id order) of the rarest selected tag and probes the others by
+# primary key, rarest first; on SQLite CROSS JOIN pins that order. Pages are
+# newest-id first with the last id as cursor, so a page stops reading as soon
+# as it is full. Tag sizes come from tag.active_count, which triggers keep
+# current (see the a9d4e2f17c83 migration); other databases count on the fly.
+# The facet list counts the tags co-occurring with the selection.
+
+MAX_SELECTED = 8
+FACET_LIMIT = 40
+
+
+def _counts_maintained():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def selected_tags(names):
+    """
+    The Tag rows for names, rarest first. Returns None if any name is not a
+    tag (the selection can't match anything).
+    """
+    names = list(dict.fromkeys(names))
+    tags = Tag.query.filter(Tag.name.in_(names)).all()
+    if len(tags) != len(names):
+        return None
+    if not _counts_maintained():
+        counts = dict(_live_counts([t.id for t in tags]))
+        return sorted(tags, key=lambda t: (counts.get(t.id, 0), t.id))
+    return sorted(tags, key=lambda t: (t.active_count, t.id))
+
+
+def _live_counts(tag_ids=None):
+    query = db.session.query(wallpaper_tags.c.tag_id, db.func.count().label('n')) \
+        .join(Wallpaper, Wallpaper.id == wallpaper_tags.c.wallpaper_id) \
+        .filter(Wallpaper.status == 'active').group_by(wallpaper_tags.c.tag_id)
+    if tag_ids is not None:
+        query = query.filter(wallpaper_tags.c.tag_id.in_(tag_ids))
+    return query
+
+
+def _matches_sql(tags):
+    """SELECT of the ids of active wallpapers carrying every tag, plus its bind params."""
+    join = 'CROSS JOIN' if _counts_maintained() else 'JOIN'
+    sql = "SELECT wt0.wallpaper_id AS id FROM wallpaper_tags wt0"
+    params = {'t0': tags[0].id}
+    for i, tag in enumerate(tags[1:], start=1):
+        sql += (f" {join} wallpaper_tags wt{i}"
+                f" ON wt{i}.wallpaper_id = wt0.wallpaper_id AND wt{i}.tag_id = :t{i}")
+        params[f't{i}'] = tag.id
+    sql += f" {join} wallpaper w ON w.id = wt0.wallpaper_id AND w.status = 'active' WHERE wt0.tag_id = :t0"
+    return sql, params
+
+
+def browse_page(tags, cursor=None, per_page=24):
+    """One page of wallpapers carrying all tags (rarest first). Returns (wallpapers, next_cursor)."""
+    sql, params = _matches_sql(tags)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 1 or not isinstance(values[0], int):
+            raise ValueError("Bad cursor")
+        sql += " AND wt0.wallpaper_id < :after"
+        params['after'] = values[0]
+    sql += " ORDER BY wt0.wallpaper_id DESC LIMIT :limit"
+    params['limit'] = per_page + 1
+
+    ids = [row[0] for row in db.session.execute(text(sql), params)]
+    next_cursor = encode_cursor(ids[per_page - 1]) if len(ids) > per_page else None
+    ids = ids[:per_page]
+
+    by_id = {w.id: w for w in Wallpaper.query.filter(Wallpaper.id.in_(ids)).options(selectinload(Wallpaper.tags))}
+    return [by_id[i] for i in ids if i in by_id], next_cursor
+
+
+def cooccurring(tags, limit=FACET_LIMIT):
+    """[(name, count)] of the other tags on the wallpapers matching the selection, most common first."""
+    sql, params = _matches_sql(tags)
+    excluded = ', '.join(f':t{i}' for i in range(len(tags)))
+    rows = db.session.execute(text(
+        f"SELECT t.name, count(*) AS n FROM ({sql}) m"
+        " JOIN wallpaper_tags wt ON wt.wallpaper_id = m.id"
+        " JOIN tag t ON t.id = wt.tag_id"
+        f" WHERE wt.tag_id NOT IN ({excluded})"
+        " GROUP BY wt.tag_id ORDER BY n DESC, t.name LIMIT :limit"
+    ), dict(params, limit=limit))
+    return [(name, count) for name, count in rows]
+
+
+def tag_cloud(limit=FACET_LIMIT):
+    """[(name, count)] of the tags on the most active wallpapers."""
+    if _counts_maintained():
+        rows = db.session.query(Tag.name, Tag.active_count).filter(Tag.active_count > 0) \
+            .order_by(Tag.active_count.desc(), Tag.name).limit(limit)
+        return [(name, count) for name, count in rows]
+    counts = _live_counts().subquery()
+    rows = db.session.query(Tag.name, counts.c.n).join(counts, counts.c.tag_id == Tag.id) \
+        .order_by(counts.c.n.desc(), Tag.name).limit(limit)
+    return [(name, count) for name, count in rows]
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Rendered-fragment cache for the feed pages.
+#
+# Holds rendered grid chunks (the cards of one feed page plus its next URL) in
+# a per-process LRU bounded by FRAGMENT_CACHE_MAX_BYTES. Entries are only valid
+# for the catalog version they were rendered at. The version is the mtime of a
+# small shared file (CATALOG_VERSION_FILE), so every gunicorn worker and the
+# maintenance process see a bump with one stat() and no DB access. The
+# app/catalog.py hooks flag the session; the bump happens after the commit so
+# nobody can re-cache the old state between the bump and the commit.
+
+
+def read_catalog_version(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump_catalog_version(path):
+    """Moves the version forward (strictly, even within one mtime tick)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    version = max(time.time_ns(), read_catalog_version(path) + 1)
+    with open(path, 'a'):
+        pass
+    os.utime(path, ns=(version, version))
+    return version
+
+
+def mark_catalog_changed(session):
+    session.info['catalog_changed'] = True
+
+
+class FragmentCache:
+    def __init__(self, app=None):
+        self.max_bytes = 32 * 1024 * 1024
+        self.version_file = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('FRAGMENT_CACHE_MAX_BYTES', self.max_bytes)
+        self.version_file = app.config['CATALOG_VERSION_FILE']
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def _after_commit(self, session):
+        if session.info.pop('catalog_changed', False):
+            bump_catalog_version(self.version_file)
+
+    def _after_rollback(self, session):
+        session.info.pop('catalog_changed', None)
+
+    def get_or_render(self, key, render):
+        """
+        Returns the cached value for key at the current catalog version, or
+        calls render() -> (html, extra) and caches the result.
+        """
+        version = read_catalog_version(self.version_file)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._bytes = 0
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+
+        value = render()
+        html, extra = value
+        size = len(html) + len(extra or '') + len(repr(key))
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            # Don't store a page rendered from data older than the current version
+            if self._version != version:
+                return value
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from flask import g
+
+# Adaptive concurrency for background work (quarantine pool, similar lists,
+# tagging, cleanup).
+#
+# Every sample compares the container's CPU against its cgroup quota rather
+# than the host: cgroup v2 cpu.max / cpu.stat, or v1 cpu.cfs_quota_us /
+# cpuacct.usage, plus PSI (cpu.pressure or /proc/pressure/cpu) when the kernel
+# has it. The limit follows AIMD: halve it when runnable tasks stall on the CPU
+# (PSI), when the quota throttles us, or when web requests in this process get
+# slower than WEB_LATENCY_TARGET; add one when there is headroom; jump straight
+# to the maximum when the container is idle, so backfill uses spare cores.
+# A limit of 0 pauses background work. Without cgroup or PSI files the load
+# average per available core stands in.
+#
+# Pool processes also run at a lower nice level (app/pipeline.py), so the
+# scheduler favours web workers between two samples.
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+SAMPLE_INTERVAL = 2.0        # Seconds between two samples
+IDLE_UTILIZATION = 0.25      # Below this share of the quota (and no web traffic) go straight to the max
+HEADROOM_UTILIZATION = 0.75  # Below this, add a worker
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def load_average():
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def cpu_capacity(root=CGROUP_ROOT):
+    """CPUs this container may use: the cgroup quota if there is one, else the affinity mask."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    cpu_max = _read(os.path.join(root, 'cpu.max'))  # v2: "<quota|max> <period>"
+    if cpu_max:
+        quota, period = cpu_max.split()
+        if quota != 'max':
+            return min(cores, int(quota) / int(period))
+        return cores
+
+    quota = _read(os.path.join(root, 'cpu', 'cpu.cfs_quota_us'))  # v1
+    period = _read(os.path.join(root, 'cpu', 'cpu.cfs_period_us'))
+    if quota and period and int(quota) > 0:
+        return min(cores, int(quota) / int(period))
+    return cores
+
+
+def cpu_stat(root=CGROUP_ROOT):
+    """
+    Cumulative (cpu_seconds, throttled_seconds) of the cgroup, or None when
+    the cgroup files are not readable.
+    """
+    stat = _read(os.path.join(root, 'cpu.stat'))
+    if stat and 'usage_usec' in stat:  # v2
+        fields = dict(line.split() for line in stat.splitlines() if line.strip())
+        return int(fields['usage_usec']) / 1e6, int(fields.get('throttled_usec', 0)) / 1e6
+
+    usage = _read(os.path.join(root, 'cpuacct', 'cpuacct.usage'))  # v1, nanoseconds
+    if usage:
+        throttled = 0
+        v1_stat = _read(os.path.join(root, 'cpu', 'cpu.stat'))
+        if v1_stat:
+            fields = dict(line.split() for line in v1_stat.splitlines() if line.strip())
+            throttled = int(fields.get('throttled_time', 0)) / 1e9
+        return int(usage) / 1e9, throttled
+    return None
+
+
+def cpu_pressure(root=CGROUP_ROOT):
+    """PSI "some avg10" for the CPU (percent of time something waited for a core), or None."""
+    for path in (os.path.join(root, 'cpu.pressure'), '/proc/pressure/cpu'):
+        text = _read(path)
+        if not text:
+            continue
+        for line in text.splitlines():
+            if line.startswith('some'):
+                fields = dict(item.split('=') for item in line.split()[1:])
+                return float(fields['avg10'])
+    return None
+
+
+class WebActivity:
+    """In-flight request count and a moving average of request latency for this process."""
+
+    def __init__(self, app=None):
+        self.in_flight = 0
+        self.latency = 0.0
+        self.last_request = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        @app.before_request
+        def start_request():
+            g.request_started = time.monotonic()
+            with self._lock:
+                self.in_flight += 1
+
+        @app.teardown_request
+        def end_request(exc=None):
+            started = g.pop('request_started', None)
+            if started is None:
+                return
+            now = time.monotonic()
+            with self._lock:
+                self.in_flight -= 1
+                self.latency = 0.8 * self.latency + 0.2 * (now - started)
+                self.last_request = now
+
+    def busy(self, window=SAMPLE_INTERVAL):
+        return self.in_flight > 0 or time.monotonic() - self.last_request < window
+
+
+class Governor:
+    """
+    AIMD limit on background concurrency, between 0 and max_workers. Call
+    update() before each unit of background work; it samples at most every
+    SAMPLE_INTERVAL seconds and returns the current limit.
+    """
+
+    def __init__(self, max_workers, pressure_limit=10.0, latency_target=0.5, web_activity=None,
+                 root=CGROUP_ROOT, log=None):
+        self.max_workers = max_workers
+        self.pressure_limit = pressure_limit
+        self.latency_target = latency_target
+        self.web_activity = web_activity
+        self.root = root
+        self.log = log
+        self.limit = max(1, max_workers // 2)
+        self.capacity = cpu_capacity(root)
+        self._last_time = None
+        self._last_stat = None
+
+    def sample(self):
+        """(utilization of the quota, share of the interval spent throttled, PSI avg10) since the last sample."""
+        now = time.monotonic()
+        stat = cpu_stat(self.root)
+        utilization = throttled = None
+        if stat and self._last_stat and now > self._last_time:
+            elapsed = now - self._last_time
+            utilization = (stat[0] - self._last_stat[0]) / (elapsed * self.capacity)
+            throttled = (stat[1] - self._last_stat[1]) / elapsed
+        elif stat is None:
+            utilization = load_average() / self.capacity
+        self._last_time, self._last_stat = now, stat
+        return utilization, throttled, cpu_pressure(self.root)
+
+    def web_slow(self):
+        web = self.web_activity
+        return web is not None and web.busy() and web.latency > self.latency_target
+
+    def update(self):
+        if self._last_time is not None and time.monotonic() - self._last_time < SAMPLE_INTERVAL:
+            return self.limit
+        utilization, throttled, pressure = self.sample()
+        if utilization is None:
+            return self.limit  # First sample: no deltas yet
+
+        previous = self.limit
+        if (self.web_slow()
+                or (pressure is not None and pressure > self.pressure_limit)
+                or (throttled is not None and throttled > 0.05)
+                or utilization > 1.0):
+            self.limit //= 2
+        elif utilization < IDLE_UTILIZATION and not (self.web_activity and self.web_activity.busy()):
+            self.limit = self.max_workers
+        elif utilization < HEADROOM_UTILIZATION:
+            self.limit = min(self.max_workers, self.limit + 1)
+
+        if self.log and self.limit != previous:
+            self.log(f"Background concurrency {previous} -> {self.limit} "
+                     f"(cpu {utilization:.0%} of {self.capacity:g}, psi {pressure}, throttled {throttled})")
+        return self.limit
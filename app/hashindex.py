@@ -0,0 +1,134 @@
+import time
+from itertools import combinations
+from app.extensions import db
+from app.models import Wallpaper
+
+# Near-duplicate lookup over 64-bit average hashes (see utils.get_image_hash).
+#
+# Multi-index hashing: each hash is split into four 16-bit chunks and every
+# chunk gets its own exact-match table. If two hashes are within distance r,
+# by pigeonhole at least one chunk differs in at most r // 4 bits, so a query
+# only has to probe the few chunk values within that radius and verify the
+# (small) candidate set with a popcount. At 100k+ hashes a radius-4 query is
+# 68 dict lookups instead of a full scan.
+
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def hash_to_int(image_hash):
+    """Stored hashes are 16-char hex strings."""
+    return int(image_hash, 16)
+
+
+def _chunks(value):
+    return [(value >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+def _neighbours(chunk, radius):
+    """All chunk values within `radius` bit flips of `chunk`."""
+    yield chunk
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            yield flipped
+
+
+class HashIndex:
+    def __init__(self):
+        self.hashes = {}
+        self.tables = [dict() for _ in range(CHUNKS)]
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, item_id, value):
+        if item_id in self.hashes:
+            self.remove(item_id)
+        self.hashes[item_id] = value
+        for table, chunk in zip(self.tables, _chunks(value)):
+            table.setdefault(chunk, set()).add(item_id)
+
+    def remove(self, item_id):
+        value = self.hashes.pop(item_id, None)
+        if value is None:
+            return
+        for table, chunk in zip(self.tables, _chunks(value)):
+            bucket = table.get(chunk)
+            if bucket:
+                bucket.discard(item_id)
+                if not bucket:
+                    del table[chunk]
+
+    def search(self, value, radius):
+        """Returns [(item_id, distance)] within `radius`, closest first."""
+        chunk_radius = radius // CHUNKS
+        seen = set()
+        matches = []
+        for table, chunk in zip(self.tables, _chunks(value)):
+            for probe in _neighbours(chunk, chunk_radius):
+                for item_id in table.get(probe, ()):
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+                    distance = hamming(value, self.hashes[item_id])
+                    if distance <= radius:
+                        matches.append((item_id, distance))
+        matches.sort(key=lambda m: m[1])
+        return matches
+
+    def clusters(self, radius):
+        """Groups of ids whose hashes are transitively within `radius` (union-find)."""
+        parent = {item_id: item_id for item_id in self.hashes}
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for item_id, value in self.hashes.items():
+            for other_id, _ in self.search(value, radius):
+                if other_id != item_id:
+                    root_a, root_b = find(item_id), find(other_id)
+                    if root_a != root_b:
+                        parent[root_b] = root_a
+
+        groups = {}
+        for item_id in self.hashes:
+            groups.setdefault(find(item_id), []).append(item_id)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+
+# Process-wide index of active wallpapers, used by the quarantine stage.
+# Activations in this process are added directly; the whole index is rebuilt
+# from the DB periodically to pick up deletions and other writers.
+INDEX_MAX_AGE = 600
+
+_catalog_index = None
+_catalog_loaded_at = 0
+
+
+def load_catalog_index():
+    index = HashIndex()
+    rows = db.session.query(Wallpaper.id, Wallpaper.image_hash) \
+        .filter(Wallpaper.status == 'active', Wallpaper.image_hash.isnot(None)) \
+        .execution_options(yield_per=5000)
+    for item_id, image_hash in rows:
+        index.add(item_id, hash_to_int(image_hash))
+    return index
+
+
+def get_catalog_index():
+    global _catalog_index, _catalog_loaded_at
+    if _catalog_index is None or time.time() - _catalog_loaded_at > INDEX_MAX_AGE:
+        _catalog_index = load_catalog_index()
+        _catalog_loaded_at = time.time()
+    return _catalog_index
@@ -0,0 +1,169 @@
+import json
+import os
+import time
+from concurrent.futures import as_completed
+from PIL import Image
+from app.extensions import db
+from app.models import Wallpaper, WallpaperVariant
+from app.utils import allowed_file, generate_slug
+from app.catalog import wallpaper_activated
+from app.pipeline import get_executor, derive_files
+from app.storage import store_file, add_ref
+from app.tags import tag_ids, link_tags
+
+# Bulk import behind `flask load-wallpapers`.
+#
+# The folder is walked once up front and subfolder tags are resolved in one
+# batch (app/tags.py). The file work (copy into the content-addressed store, thumbnail, hash,
+# derivatives) runs in the shared process pool; identical files end up as one
+# stored blob. Rows are inserted and committed one chunk at a time. After every
+# commit the imported source paths are appended to a manifest, so re-running
+# the same command after an interruption skips what is already in the DB. A
+# chunk that committed but never reached the manifest is imported again, but
+# files whose stored name and original name this user already has are only
+# written to the manifest, not inserted twice.
+# Files copied for a chunk that never committed are picked up by the cleanup
+# job as orphans.
+
+
+def import_file(source_path, upload_folder, derivative_widths=()):
+    """
+    Copies one source image into the content-addressed store and generates its
+    thumbnail, hash and derivatives. Runs inside a pool process (no app
+    context, no DB).
+    """
+    with Image.open(source_path) as img:
+        img.verify()
+    filename, sha256, size, _ = store_file(source_path, upload_folder, source_path.rsplit('.', 1)[1])
+    return dict(filename=filename, sha256=sha256, size=size,
+                **derive_files(filename, upload_folder, derivative_widths))
+
+
+def read_manifest(path):
+    """Source paths (relative to the import folder) already imported."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['src'])
+            except (ValueError, KeyError):
+                # A line cut short by the interruption
+                continue
+    return done
+
+
+def append_manifest(path, entries):
+    with open(path, 'a') as f:
+        for src, filename in entries:
+            f.write(json.dumps({'src': src, 'filename': filename}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def scan_folder(folder_path, done=()):
+    """Returns [(relative_path, tag_name or None)] for every importable file not in done."""
+    root_name = os.path.basename(os.path.normpath(folder_path)).lower()
+    files = []
+    for root, dirs, names in os.walk(folder_path):
+        dirs.sort()
+        # Use subfolder name as tag
+        tag_name = os.path.basename(root).lower()
+        if not tag_name or tag_name == root_name:
+            tag_name = None
+        for name in sorted(names):
+            if not allowed_file(name):
+                continue
+            rel = os.path.relpath(os.path.join(root, name), folder_path)
+            if rel not in done:
+                files.append((rel, tag_name))
+    return files
+
+
+def title_from_filename(name):
+    return name.rsplit('.', 1)[0].replace('_', ' ').replace('-', ' ').title()
+
+
+def load_wallpapers(folder_path, user, upload_folder, workers, derivative_widths=(),
+                    chunk_size=500, manifest_path=None, log=print):
+    """
+    Imports every image under folder_path as an active wallpaper owned by user.
+    Returns (imported, failed).
+    """
+    manifest_path = manifest_path or os.path.join(folder_path, '.load-wallpapers.manifest')
+    done = read_manifest(manifest_path)
+    files = scan_folder(folder_path, done)
+    if done:
+        log(f"Resuming: {len(done)} files already imported, {len(files)} to go.")
+    else:
+        log(f"Found {len(files)} files to import.")
+    if not files:
+        return 0, 0
+
+    tags = tag_ids(tag_name for _, tag_name in files if tag_name)
+    db.session.commit()
+
+    executor = get_executor(workers)
+    imported = failed = 0
+    started = time.monotonic()
+
+    for start in range(0, len(files), chunk_size):
+        chunk = files[start:start + chunk_size]
+        futures = {}
+        for rel, tag_name in chunk:
+            future = executor.submit(import_file, os.path.join(folder_path, rel), upload_folder, derivative_widths)
+            futures[future] = (rel, os.path.basename(rel), tag_name)
+
+        results = []
+        for future in as_completed(futures):
+            rel, name, tag_name = futures[future]
+            try:
+                results.append((rel, name, tag_name, future.result()))
+            except Exception as e:
+                log(f"Failed: {rel}: {e}")
+                failed += 1
+
+        # A crash between a chunk's commit and its manifest line leaves rows
+        # the manifest doesn't know about; the resumed run must not add them twice
+        existing = set(db.session.query(Wallpaper.filename, Wallpaper.original_filename).filter(
+            Wallpaper.user_id == user.id, Wallpaper.filename.in_({r['filename'] for _, _, _, r in results})))
+
+        entries = []
+        tagged = []
+        for rel, name, tag_name, result in results:
+            if (result['filename'], name) in existing:
+                entries.append((rel, result['filename']))
+                continue
+
+            add_ref(result['sha256'], result['filename'], result['size'])
+            wallpaper = Wallpaper(
+                title=title_from_filename(name),
+                filename=result['filename'],
+                slug=generate_slug(),
+                thumbnail_filename=result['thumbnail'],
+                original_filename=name,
+                image_hash=result['image_hash'],
+                status='active',
+                uploader=user,
+            )
+            if tag_name:
+                tagged.append((wallpaper, tags[tag_name]))
+                wallpaper.tagging_status = 'done'  # The folder already tagged it; AI tagging is for the rest
+            for width, height, variant in result['derivatives']:
+                wallpaper.variants.append(WallpaperVariant(width=width, height=height, filename=variant))
+            db.session.add(wallpaper)
+            wallpaper_activated(wallpaper)
+            entries.append((rel, result['filename']))
+
+        db.session.flush()
+        link_tags([(wallpaper.id, tag_id) for wallpaper, tag_id in tagged])
+        db.session.commit()
+        append_manifest(manifest_path, entries)
+        imported += len(entries)
+
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed if elapsed else 0
+        log(f"Imported {imported}/{len(files)} ({failed} failed), {rate:.1f} files/s")
+
+    return imported, failed
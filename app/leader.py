@@ -0,0 +1,62 @@
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process considers itself the runner
+    fcntl = None
+
+# Maintenance runner election.
+#
+# create_app starts a maintenance thread in every web worker and the daemon
+# may run as well; only the holder of an exclusive flock on
+# MAINTENANCE_LOCK_FILE does background work. The others retry now and then,
+# and since the kernel drops the lock when its process exits (crash, worker
+# recycled by gunicorn), one of them takes over without any heartbeat. The
+# lock file holds the runner's pid for humans.
+
+
+class LeaderLock:
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def try_acquire(self):
+        """Takes the lock if nobody holds it. Returns True if this process is the runner."""
+        if self.f is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        f = open(self.path, 'a+')
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+        f.truncate(0)
+        f.write(f"{os.getpid()}\n")
+        f.flush()
+        self.f = f
+        return True
+
+    def wait(self, retry_interval, on_standby=None):
+        """Blocks until this process is the runner; on_standby is called once if it has to wait."""
+        if self.try_acquire():
+            return
+        if on_standby:
+            on_standby(self.holder())
+        while not self.try_acquire():
+            time.sleep(retry_interval)
+
+    def holder(self):
+        try:
+            with open(self.path) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def release(self):
+        if self.f is not None:
+            # Closing the file releases the lock
+            self.f.close()
+            self.f = None
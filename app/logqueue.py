@@ -0,0 +1,189 @@
+import atexit
+import inspect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: rotation is not coordinated between processes
+    fcntl = None
+
+# Queue-backed logging for the maintenance loops.
+#
+# log_message() used to print and then open, append to and close the log file
+# for every line, from whichever thread was logging (inside a web worker when
+# run_maintenance_loop runs there). Now a call only puts the record on a
+# queue; one QueueListener thread per process writes it as a JSON line to the
+# log file and as the familiar "[timestamp] message" line to stdout. Extra
+# keyword arguments become fields of the JSON line (wallpaper_id, per-stage
+# seconds...). Records below LOG_LEVEL are dropped before they are queued.
+#
+# Web workers and the daemon append to the same file, so the stdlib rotating
+# handlers (each renaming the file on its own) can't be used. Every process
+# appends in O_APPEND mode and reopens the file when it has been moved
+# (WatchedFileHandler); the process that first sees it over LOG_MAX_BYTES
+# rotates it under a flock, after checking the size again. LOG_MAX_BYTES = 0
+# leaves rotation to an external logrotate.
+
+CONSOLE_FORMAT = '[%(asctime)s] %(message)s'
+CONSOLE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, pid, thread, message and any extra fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'pid': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ForkSafeQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that (re)starts its listener in the process that logs: the
+    writer thread does not survive a fork, and a queue without one would only
+    grow.
+    """
+
+    def __init__(self, make_handlers):
+        super().__init__(queue.SimpleQueue())
+        self._make_handlers = make_handlers
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().enqueue(record)
+
+    def prepare(self, record):
+        # The queue is in-process: keep exc_info and the extra fields for the listener's formatters
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(self.queue, *self._make_handlers(),
+                                                            respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        """Drains the queue and stops the writer thread (registered with atexit)."""
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                for handler in self._listener.handlers:
+                    handler.close()
+            self._listener = None
+            self._pid = None
+
+
+class SharedRotatingFileHandler(logging.handlers.WatchedFileHandler):
+    """Appends to a log file shared by several processes, rotating it by size under a flock."""
+
+    def __init__(self, path, max_bytes, backup_count):
+        super().__init__(path, encoding='utf-8', delay=True)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+    def emit(self, record):
+        if self.max_bytes and self._size() >= self.max_bytes:
+            self._rotate()
+        super().emit(record)  # Reopens the file first if it was rotated
+
+    def _size(self):
+        try:
+            return os.stat(self.baseFilename).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _rotate(self):
+        with open(self.baseFilename + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            if self._size() < self.max_bytes:
+                return  # Another process rotated it while we waited
+            for i in range(self.backup_count - 1, 0, -1):
+                older = f"{self.baseFilename}.{i}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.baseFilename}.{i + 1}")
+            if self.backup_count:
+                os.replace(self.baseFilename, f"{self.baseFilename}.1")
+            else:
+                os.remove(self.baseFilename)
+
+
+def get_logger(name, path, level='INFO', max_bytes=10 * 1024 * 1024, backup_count=5):
+    """
+    The logger `name`, writing JSON lines to `path` and plain lines to stdout
+    through a background thread. Configured on first use; later calls return
+    the same logger.
+    """
+    logger = logging.getLogger(name)
+    if any(isinstance(h, ForkSafeQueueHandler) for h in logger.handlers):
+        return logger
+
+    def make_handlers():
+        file_handler = SharedRotatingFileHandler(path, max_bytes, backup_count)
+        file_handler.setFormatter(JsonLinesFormatter())
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(logging.Formatter(CONSOLE_FORMAT, CONSOLE_DATE_FORMAT))
+        return file_handler, console
+
+    handler = ForkSafeQueueHandler(make_handlers)
+    logger.addHandler(handler)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    atexit.register(handler.stop)
+    return logger
+
+
+def config_logger(name, path):
+    """get_logger() with level and rotation from the LOG_* settings in config.py."""
+    from config import Config
+    return get_logger(name, path, Config.LOG_LEVEL, Config.LOG_MAX_BYTES, Config.LOG_BACKUP_COUNT)
+
+
+def log_with(logger, message, level='info', **fields):
+    """Logs message at `level` ('debug', 'info', ...) with fields as extra JSON keys."""
+    level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra=fields)
+
+
+def structured(log):
+    """
+    log as a (message, level='info', **fields) callable. Callables that take
+    no keyword fields (print, lambda m: ...) get just the message.
+    """
+    try:
+        params = inspect.signature(log).parameters.values()
+    except (TypeError, ValueError):
+        params = ()
+    if any(p.kind is inspect.Parameter.VAR_KEYWORD for p in params):
+        return log
+    return lambda message, level='info', **fields: log(message)
@@ -0,0 +1,276 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, request
+from sqlalchemy import event
+
+try:
+    import fcntl
+except ImportError:  # Windows: scrapes are not serialized against each other
+    fcntl = None
+
+# Prometheus metrics, served as text by /metrics.
+#
+# Each process (every gunicorn worker, the maintenance daemon) keeps its
+# counters and histograms in memory: recording is a dict update under a lock.
+# A daemon thread writes the process's totals to METRICS_FOLDER/<pid>.json
+# every METRICS_FLUSH_INTERVAL seconds, and a scrape adds up all those files,
+# so the numbers cover every worker whichever one answers. Files of processes
+# that have exited are folded into archive.json, which keeps the counters
+# monotonic across worker restarts. Gauges (queue depth and age) are read from
+# the database at scrape time.
+#
+# Pool processes don't record anything themselves: the pipeline returns stage
+# timings with each result and the parent records them.
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+WAIT_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'wally_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.', None),
+    'wally_http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint and method.', HTTP_BUCKETS),
+    'wally_sql_query_duration_seconds': ('histogram', 'SQL statement execution time.', SQL_BUCKETS),
+    'wally_pipeline_stage_duration_seconds': ('histogram', 'Duration of one maintenance pipeline stage for one image.', STAGE_BUCKETS),
+    'wally_quarantine_wait_seconds': ('histogram', 'Time from upload to activation.', WAIT_BUCKETS),
+    'wally_queue_depth': ('gauge', 'Wallpapers waiting in or being worked on by a pipeline queue.', None),
+    'wally_queue_oldest_age_seconds': ('gauge', 'Age of the oldest wallpaper waiting in a queue.', None),
+}
+ARCHIVE = 'archive'
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.folder = None
+        self.interval = 10
+        self._counters = {}
+        self._histograms = {}  # key -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = app.config.get('METRICS_FOLDER')
+        self.interval = app.config.get('METRICS_FLUSH_INTERVAL', 10)
+        atexit.register(self.flush)
+        self._init_request_timing(app)
+        self._init_sql_timing(app)
+
+    def _init_request_timing(self, app):
+        @app.before_request
+        def start_timer():
+            g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            started = g.pop('metrics_started', None)
+            if started is not None and request.blueprint in ('main', 'auth'):
+                labels = {'endpoint': request.endpoint, 'method': request.method}
+                self.observe('wally_http_request_duration_seconds', time.perf_counter() - started, **labels)
+                self.inc('wally_http_requests_total', status=str(response.status_code), **labels)
+            return response
+
+    def _init_sql_timing(self, app):
+        from app.extensions import db
+
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+        def after(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info.get('metrics_started')
+            if started:
+                self.observe('wally_sql_query_duration_seconds', time.perf_counter() - started.pop())
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', before)
+            event.listen(db.engine, 'after_cursor_execute', after)
+
+    def inc(self, name, amount=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._ensure_flusher()
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = _key(name, labels)
+        with self._lock:
+            self._ensure_flusher()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def _ensure_flusher(self):
+        # Called with the lock held; same fork handling as the view counter
+        if self.folder is None:
+            return
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        if self._pid is not None and self._pid != pid:
+            self._counters = {}
+            self._histograms = {}
+        self._pid = pid
+        self._thread = threading.Thread(target=self._run, daemon=True, name='metrics')
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(h)] for (name, labels), h in self._histograms.items()],
+            }
+
+    def flush(self):
+        """Writes this process's totals to its file in the metrics folder."""
+        if self.folder is None or self._pid != os.getpid():
+            return
+        path = os.path.join(self.folder, f"{self._pid}.json")
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self._snapshot(), f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Metrics flush failed: {e}")
+
+    def collect(self):
+        """Totals across all processes: ({key: value}, {key: histogram})."""
+        self.flush()
+        counters, histograms = {}, {}
+        if self.folder is None or not os.path.isdir(self.folder):
+            return counters, histograms
+
+        with open(os.path.join(self.folder, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            dead = []
+            for entry in os.scandir(self.folder):
+                stem, ext = os.path.splitext(entry.name)
+                if ext != '.json':
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                _merge(counters, histograms, data)
+                if stem != ARCHIVE and stem.isdigit() and not _process_alive(int(stem)):
+                    dead.append((entry.path, data))
+
+            if dead:
+                archive_path = os.path.join(self.folder, f"{ARCHIVE}.json")
+                old_counters, old_histograms = {}, {}
+                if os.path.exists(archive_path):
+                    with open(archive_path) as f:
+                        _merge(old_counters, old_histograms, json.load(f))
+                for _, data in dead:
+                    _merge(old_counters, old_histograms, data)
+                archive = {
+                    'counters': [[name, labels, value] for (name, labels), value in old_counters.items()],
+                    'histograms': [[name, labels, h] for (name, labels), h in old_histograms.items()],
+                }
+                with open(archive_path + '.tmp', 'w') as f:
+                    json.dump(archive, f)
+                os.replace(archive_path + '.tmp', archive_path)
+                for path, _ in dead:
+                    os.remove(path)
+        return counters, histograms
+
+    def render(self, gauges=()):
+        """
+        The Prometheus text exposition of everything collected, plus gauges
+        given as [(name, labels, value)].
+        """
+        counters, histograms = self.collect()
+        lines = []
+        by_name = {}
+        for (name, labels), value in counters.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), histogram in histograms.items():
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name, labels, value in gauges:
+            by_name.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+
+        for name, (kind, help_text, buckets) in METRICS.items():
+            series = by_name.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series, key=lambda s: s[0]):
+                if kind != 'histogram':
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(counters, histograms, data):
+    for name, labels, value in data.get('counters', ()):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, histogram in data.get('histograms', ()):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if name not in METRICS or len(histogram) != len(METRICS[name][2]) + 2:
+            continue  # Recorded with other buckets by an older version
+        total = histograms.get(key)
+        if total is None:
+            histograms[key] = list(histogram)
+        else:
+            for i, value in enumerate(histogram):
+                total[i] += value
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
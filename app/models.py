@@ -10,7 +10,9 @@ def load_user(id):
 # Association table for wallpapers and tags
 wallpaper_tags = db.Table('wallpaper_tags',
     db.Column('wallpaper_id', db.Integer, db.ForeignKey('wallpaper.id'), primary_key=True),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    # Posting lists for faceted browsing (app/facets.py)
+    db.Index('ix_wallpaper_tags_tag_id_wallpaper_id', 'tag_id', 'wallpaper_id'),
 )
 
 class User(UserMixin, db.Model):
@@ -38,28 +40,72 @@ class Wallpaper(db.Model):
     __tablename__ = 'wallpaper'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(140), nullable=False)
-    filename = db.Column(db.String(140), unique=True, nullable=False)
-    thumbnail_filename = db.Column(db.String(140), unique=True, nullable=True)
+    filename = db.Column(db.String(140), index=True, nullable=False) # ab/cd/<sha256>.<ext>, shared by identical files (app/storage.py)
+    slug = db.Column(db.String(140), unique=True, index=True, nullable=True) # set on activation
+    thumbnail_filename = db.Column(db.String(140), index=True, nullable=True)
     status = db.Column(db.String(20), default='pending') # pending, active, malicious
     original_filename = db.Column(db.String(140), nullable=True)
+    processing_attempts = db.Column(db.Integer, default=0) # worker pool crashes while in a quarantine batch
+    tagging_status = db.Column(db.String(20), default='pending', index=True) # pending, tagging, done, failed
+    tagging_attempts = db.Column(db.Integer, default=0)
+    claimed_at = db.Column(db.DateTime, nullable=True) # start of the current processing/tagging lease (app/pipeline.py)
+    image_hash = db.Column(db.String(16), nullable=True, index=True) # 64-bit average hash, hex
+    content_hash = db.Column(db.String(64), nullable=True, index=True) # SHA-256 of the uploaded bytes
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('wallpaper.id'), nullable=True)
+    similar_stale = db.Column(db.Boolean, default=True, index=True) # needs its "similar" list recomputed
     tags = db.relationship('Tag', secondary=wallpaper_tags, backref=db.backref('wallpapers', lazy='dynamic'))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    variants = db.relationship('WallpaperVariant', backref='wallpaper', order_by='WallpaperVariant.width', cascade='all, delete-orphan')
+
+    # Keyset pagination of the feeds (app/pagination.py): newest-first range scans
+    __table_args__ = (
+        db.Index('ix_wallpaper_status_timestamp_id', 'status', 'timestamp', 'id'),
+        db.Index('ix_wallpaper_user_status_timestamp_id', 'user_id', 'status', 'timestamp', 'id'),
+    )
 
     def __repr__(self):
         return f'<Wallpaper {self.title}>'
 
-    @property
-    def slug(self):
-        """Returns the UUID part of the filename (without extension)."""
-        if '.' in self.filename:
-            return self.filename.rsplit('.', 1)[0]
-        return self.filename
+class WallpaperVariant(db.Model):
+    """A downscaled WebP derivative of a wallpaper, used for srcset."""
+    __tablename__ = 'wallpaper_variant'
+    id = db.Column(db.Integer, primary_key=True)
+    wallpaper_id = db.Column(db.Integer, db.ForeignKey('wallpaper.id'), nullable=False, index=True)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(140), index=True, nullable=False)
+
+    def __repr__(self):
+        return f'<WallpaperVariant {self.filename}>'
+
+class Blob(db.Model):
+    """A stored original in the content-addressed layout, with its reference count."""
+    __tablename__ = 'blob'
+    hash = db.Column(db.String(64), primary_key=True) # SHA-256 of the stored bytes
+    filename = db.Column(db.String(140), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Blob {self.filename} x{self.refcount}>'
+
+class SimilarWallpaper(db.Model):
+    """Precomputed top-K similar wallpapers (see app/similar.py)."""
+    __tablename__ = 'wallpaper_similar'
+    wallpaper_id = db.Column(db.Integer, db.ForeignKey('wallpaper.id'), primary_key=True)
+    similar_id = db.Column(db.Integer, db.ForeignKey('wallpaper.id'), primary_key=True, index=True)
+    score = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<SimilarWallpaper {self.wallpaper_id} -> {self.similar_id}>'
 
 class Tag(db.Model):
     __tablename__ = 'tag'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    active_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True) # active wallpapers with this tag, kept by triggers
 
     def __repr__(self):
         return f'<Tag {self.name}>'
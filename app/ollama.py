@@ -0,0 +1,147 @@
+import base64
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, has_app_context
+from app.extensions import metrics
+
+DEFAULT_URL = 'http://localhost:11434'
+DESCRIBE_MODEL = 'moondream'
+EXTRACT_MODEL = 'gemma3:1b'
+STOP_WORDS = {'a', 'an', 'the', 'and', 'with', 'stands', 'out', 'against', 'its', 'their', 'this', 'that', 'from', 'into', 'for', 'are', 'was', 'were'}
+
+
+class TransientError(Exception):
+    """A model call failed in a way that is worth retrying (connection drop, timeout, 5xx)."""
+
+
+def clean_tags(text):
+    """Turns the extractor's comma-separated reply into at most 10 sane, unique tags."""
+    tags = [t.strip().lower() for t in text.split(',') if t.strip()]
+    final_tags = []
+    for t in tags:
+        # Remove punctuation from tag
+        t = re.sub(r'[^\w\s]', '', t)
+        if len(t) > 2 and len(t) < 30 and not any(c.isdigit() for c in t) and t not in STOP_WORDS:
+            final_tags.append(t)
+    return list(dict.fromkeys(final_tags))[:10]
+
+
+class OllamaClient:
+    """
+    Two-step (describe -> extract) tagging client for Ollama.
+
+    All calls share one keep-alive connection pool and at most `max_in_flight`
+    requests are outstanding at a time. tag_many() runs each image's two calls
+    on a worker thread, so the describe call for one image overlaps with the
+    extract call for another and the model server never sits idle.
+    """
+
+    def __init__(self, base_url=DEFAULT_URL, max_in_flight=2, retries=3, backoff=1.0,
+                 describe_timeout=300, extract_timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.describe_timeout = describe_timeout
+        self.extract_timeout = extract_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+    def _generate(self, payload, timeout, stage):
+        """
+        POSTs to /api/generate, retrying transient failures with jittered
+        exponential backoff. Each attempt is timed as pipeline stage `stage`.
+        """
+        url = f"{self.base_url}/api/generate"
+        for attempt in range(self.retries + 1):
+            try:
+                with self._slots, metrics.timer('wally_pipeline_stage_duration_seconds', stage=stage):
+                    response = self.session.post(url, json=payload, timeout=timeout)
+                if response.status_code >= 500:
+                    raise TransientError(f"{payload['model']} returned HTTP {response.status_code}")
+                if response.status_code != 200:
+                    return None
+                return response.json().get('response', '')
+            except (requests.ConnectionError, requests.Timeout, TransientError):
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay / 2))
+
+    def describe(self, file_path):
+        with open(file_path, "rb") as image_file:
+            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+        return self._generate({
+            "model": DESCRIBE_MODEL,
+            "prompt": "Describe this image in detail.",
+            "images": [encoded_string],
+            "stream": False
+        }, self.describe_timeout, 'ollama_describe')
+
+    def extract_tags(self, description):
+        text = self._generate({
+            "model": EXTRACT_MODEL,
+            "prompt": f"Extract 5-10 descriptive, one-word tags from this description: \"{description}\". Reply ONLY with a comma-separated list of tags. No other text.",
+            "stream": False
+        }, self.extract_timeout, 'ollama_extract')
+        return clean_tags(text) if text else []
+
+    def tag_file(self, file_path):
+        """Describe + extract for one image. Returns [] on any failure."""
+        try:
+            description = self.describe(file_path)
+            if not description:
+                return []
+            return self.extract_tags(description)
+        except Exception as e:
+            print(f"Error in two-step AI tagging for {file_path}: {e}")
+            return []
+
+    def tag_many(self, items):
+        """
+        Tags many images concurrently. `items` are (key, file_path) pairs; yields
+        (key, tags) as each finishes. Keys tell apart entries that share one
+        stored file (identical uploads). Only max_in_flight images are read
+        into memory at any time. The batch can take minutes, so a caller
+        should not write to the database while iterating: gather the results
+        and apply them afterwards.
+        """
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='ollama') as executor:
+            futures = {}
+            for key, path in items:
+                futures[executor.submit(self.tag_file, path)] = key
+                if len(futures) >= self.max_in_flight:
+                    break
+            while futures:
+                done = next(as_completed(futures))
+                key = futures.pop(done)
+                next_item = next(items, None)
+                if next_item is not None:
+                    futures[executor.submit(self.tag_file, next_item[1])] = next_item[0]
+                yield key, done.result()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the process-wide client, configured from the app config when available."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            config = current_app.config if has_app_context() else {}
+            _client = OllamaClient(
+                base_url=config.get('OLLAMA_URL', DEFAULT_URL),
+                max_in_flight=config.get('TAGGING_WORKERS', 2),
+            )
+        return _client
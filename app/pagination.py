@@ -0,0 +1,62 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+from app.models import Wallpaper
+
+# Keyset ("cursor") pagination for the wallpaper feeds.
+#
+# A page is "the next per_page rows after this sort key" rather than
+# "rows OFFSET n", so page 50 is the same index range scan as page 1 and no
+# COUNT is needed: we fetch one extra row to know whether there is a next page.
+# Cursors are opaque URL-safe tokens; clients only pass them back.
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(token):
+    """Returns the list of values in a cursor token; raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def timestamp_cursor(wallpaper):
+    return encode_cursor(wallpaper.timestamp.isoformat(), wallpaper.id)
+
+
+def after_timestamp_cursor(query, token):
+    """Restricts a newest-first query to rows strictly after the cursor's (timestamp, id)."""
+    values = decode_cursor(token)
+    if len(values) != 2:
+        raise ValueError("Invalid cursor")
+    timestamp, wallpaper_id = datetime.fromisoformat(values[0]), int(values[1])
+    # The redundant `timestamp <= :ts` bound lets SQLite use it as the range
+    # scan start on the (…, timestamp, id) indexes
+    return query.filter(
+        Wallpaper.timestamp <= timestamp,
+        or_(Wallpaper.timestamp < timestamp,
+            and_(Wallpaper.timestamp == timestamp, Wallpaper.id < wallpaper_id))
+    )
+
+
+def newest_first_page(query, cursor=None, per_page=24):
+    """
+    One page of a Wallpaper query ordered newest first, keyed on (timestamp, id).
+    Returns (wallpapers, next_cursor); next_cursor is None on the last page.
+    """
+    if cursor:
+        query = after_timestamp_cursor(query, cursor)
+    wallpapers = query.order_by(Wallpaper.timestamp.desc(), Wallpaper.id.desc()).limit(per_page + 1).all()
+    if len(wallpapers) > per_page:
+        wallpapers = wallpapers[:per_page]
+        return wallpapers, timestamp_cursor(wallpapers[-1])
+    return wallpapers, None
@@ -0,0 +1,434 @@
+import os
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from sqlalchemy import update, or_, and_
+from app.extensions import db, metrics
+from app.models import Wallpaper, WallpaperVariant
+from app.utils import generate_thumbnail, generate_derivatives, generate_random_filename, get_image_hash, generate_slug
+from app.storage import store_file, derived_filename, add_ref, remove_unreferenced
+from app.hashindex import HashIndex, get_catalog_index, hash_to_int
+from app.catalog import wallpaper_activated, wallpaper_retagged
+from app.similar import refresh_similar
+from app.ollama import get_client
+from app.wakeup import tagging_wakeup
+from app.tags import attach_tags
+from app.logqueue import structured
+
+# Shared quarantine stage used by maintainance.py and maintainance_render.py.
+# Rows are claimed in batches (pending -> processing) with a single conditional
+# UPDATE, so two loops can never pick up the same wallpaper. A claim is a lease
+# (Wallpaper.claimed_at): rows left behind by a runner that died are claimed
+# again once CLAIM_LEASE has passed. The image work itself is CPU-bound, so it
+# runs in a process pool sized to the cores. When a worker dies the pool is
+# restarted and the batch requeued; its rows are then processed one at a time,
+# and a row that crashes the pool PROCESSING_MAX_CRASHES times is rejected.
+#
+# AI tagging is a separate stage with its own queue (Wallpaper.tagging_status)
+# and its own bounded Ollama client: activation never waits on the model server.
+# Idle stages wait on the events in app/wakeup.py rather than polling.
+#
+# `log` may be print; a log_message that takes (message, level, **fields) also
+# gets the wallpaper id and per-stage seconds for the JSON log (app/logqueue.py).
+
+TAGGING_MAX_ATTEMPTS = 3
+PROCESSING_MAX_CRASHES = 3  # Pool crashes before an upload is rejected as the cause
+POOL_NICENESS = 10
+
+_executor = None
+_executor_size = 0
+
+
+def _lower_priority():
+    # Background image work yields the CPU to web workers (app/governor.py)
+    try:
+        os.nice(POOL_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+
+def get_executor(max_workers):
+    """Returns the shared process pool, (re)creating it if the size changed."""
+    global _executor, _executor_size
+    if _executor is None or _executor_size != max_workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_lower_priority)
+        _executor_size = max_workers
+    return _executor
+
+
+def reset_executor():
+    global _executor, _executor_size
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _executor_size = 0
+
+
+def claimable(column, ready, claimed, lease):
+    """
+    Rows in state `ready`, or stuck in state `claimed` for longer than `lease`
+    seconds: the runner that claimed them died (or hung) before finishing.
+    """
+    expired = datetime.utcnow() - timedelta(seconds=lease)
+    return or_(column == ready,
+               and_(column == claimed, or_(Wallpaper.claimed_at.is_(None), Wallpaper.claimed_at < expired)))
+
+
+def claim_pending(limit, lease, crashed=False):
+    """
+    Atomically moves up to `limit` pending wallpapers (or expired claims) to
+    'processing'. With crashed=True only rows that were in a batch that
+    crashed the worker pool are claimed, otherwise only the others. Returns
+    the claimed ids.
+    """
+    condition = claimable(Wallpaper.status, 'pending', 'processing', lease)
+    if crashed:
+        condition = and_(condition, Wallpaper.processing_attempts > 0)
+    else:
+        condition = and_(condition, or_(Wallpaper.processing_attempts.is_(None), Wallpaper.processing_attempts == 0))
+    candidates = db.session.query(Wallpaper.id).filter(condition) \
+        .order_by(Wallpaper.id).limit(limit).subquery()
+    result = db.session.execute(
+        update(Wallpaper)
+        .where(Wallpaper.id.in_(db.select(candidates.c.id)), condition)
+        .values(status='processing', claimed_at=datetime.utcnow())
+        .returning(Wallpaper.id)
+    )
+    ids = [row[0] for row in result]
+    db.session.commit()
+    return ids
+
+
+def verify_and_encode(quarantine_path, upload_folder, original_filename, derivative_widths=()):
+    """
+    Verifies, re-encodes, thumbnails, hashes and derives one quarantined upload.
+    Runs inside a pool process, so it must not touch the app context or the DB.
+    The re-encoded file goes into the content-addressed store (app/storage.py);
+    if identical bytes are already stored, their thumbnail and derivatives are
+    reused. Returns a dict with the stored filename, its SHA-256 and size, the
+    thumbnail filename, image hash, derivatives [(width, height, filename)]
+    and the seconds spent in each stage (timings).
+    """
+    timings = {}
+    started = time.perf_counter()
+    with Image.open(quarantine_path) as img:
+        img.verify()
+    timings['verify'] = time.perf_counter() - started
+
+    ext = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'jpg'
+    tmp_path = os.path.join(upload_folder, f".tmp_{generate_random_filename(original_filename)}")
+
+    started = time.perf_counter()
+    with Image.open(quarantine_path) as img:
+        if img.mode in ("RGBA", "P"):
+            img = img.convert("RGB")
+
+        format_map = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF'}
+        img.save(tmp_path, format_map.get(ext, 'JPEG'))
+    timings['reencode'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    filename, sha256, size, _ = store_file(tmp_path, upload_folder, ext, move=True)
+    timings['store'] = time.perf_counter() - started
+
+    derived = derive_files(filename, upload_folder, derivative_widths)
+    timings.update(derived.pop('timings'))
+    return dict(filename=filename, sha256=sha256, size=size, timings=timings, **derived)
+
+
+def derive_files(filename, upload_folder, derivative_widths=()):
+    """Thumbnail, image hash and derivatives of a stored original, reusing files that already exist."""
+    timings = {}
+    started = time.perf_counter()
+    thumbnail = derived_filename(filename, 'thumb_')
+    if os.path.exists(os.path.join(upload_folder, thumbnail)):
+        os.utime(os.path.join(upload_folder, thumbnail))  # Inside the reconciler's grace period until committed
+    else:
+        thumbnail = generate_thumbnail(filename, upload_folder=upload_folder)
+    timings['thumbnail'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    derivatives = []
+    missing = False
+    if derivative_widths:
+        with Image.open(os.path.join(upload_folder, filename)) as img:
+            width, height = img.size
+        for w in sorted(derivative_widths):
+            if w >= width:
+                continue
+            variant = derived_filename(filename, f"w{w}_")
+            if not os.path.exists(os.path.join(upload_folder, variant)):
+                missing = True
+                break
+            os.utime(os.path.join(upload_folder, variant))
+            derivatives.append((w, round(height * w / width), variant))
+    if missing:
+        derivatives = generate_derivatives(filename, derivative_widths, upload_folder=upload_folder)
+    timings['derivatives'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    image_hash = get_image_hash(filename, upload_folder=upload_folder)
+    timings['image_hash'] = time.perf_counter() - started
+
+    return {
+        'thumbnail': thumbnail,
+        'image_hash': image_hash,
+        'derivatives': derivatives,
+        'timings': timings,
+    }
+
+
+def find_duplicate(image_hash, max_distance, batch=None):
+    """
+    Returns the id of the closest active wallpaper within max_distance, or
+    None. `batch` (a HashIndex) holds the wallpapers activated by the current,
+    uncommitted batch, which only join the catalog index after the commit.
+    """
+    value = hash_to_int(image_hash)
+    index = get_catalog_index()
+    for item_id, _ in index.search(value, max_distance):
+        # The index can lag behind deletions made by other processes
+        if db.session.get(Wallpaper, item_id) is not None:
+            return item_id
+        index.remove(item_id)
+    if batch is not None:
+        for item_id, _ in batch.search(value, max_distance):
+            return item_id
+    return None
+
+
+def process_quarantine_batch(app, log=print, limit=None):
+    """
+    Claims a batch of pending wallpapers and processes them in the pool.
+    `limit` caps how many run at once (the load governor's current limit);
+    the pool keeps its size so changing it costs nothing.
+    Returns the number of rows handled (0 when there was no work).
+    """
+    log = structured(log)
+    with app.app_context():
+        workers = app.config['QUARANTINE_WORKERS']
+        batch_size = app.config['QUARANTINE_BATCH_SIZE']
+        if limit is not None and limit < workers:
+            batch_size = max(1, limit)
+        # A crash takes the whole batch down, so rows that were in one run
+        # alone until they succeed: a poison image only counts against itself
+        ids = claim_pending(1, app.config['CLAIM_LEASE'], crashed=True) or \
+            claim_pending(batch_size, app.config['CLAIM_LEASE'])
+        if not ids:
+            return 0
+
+        quarantine_folder = app.config['QUARANTINE_FOLDER']
+        upload_folder = app.config['UPLOAD_FOLDER']
+        max_distance = app.config['DUPLICATE_DISTANCE']
+        duplicate_action = app.config['DUPLICATE_ACTION']
+        wallpapers = Wallpaper.query.filter(Wallpaper.id.in_(ids)).all()
+
+        futures = {}
+        executor = get_executor(workers)
+        for wallpaper in wallpapers:
+            quarantine_path = os.path.join(quarantine_folder, wallpaper.filename)
+            if not os.path.exists(quarantine_path):
+                db.session.delete(wallpaper)
+                continue
+            log(f"Atomic Task: Security scanning {wallpaper.original_filename}", 'debug', wallpaper_id=wallpaper.id)
+            future = executor.submit(verify_and_encode, quarantine_path, upload_folder,
+                                     wallpaper.original_filename, app.config['DERIVATIVE_WIDTHS'])
+            futures[future] = (wallpaper, quarantine_path)
+
+        processed = []
+        rejected = []
+        activated = HashIndex()
+        crashed = False
+        for future in as_completed(futures):
+            wallpaper, quarantine_path = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # A worker died (OOM, decompression bomb...) and every unfinished
+                # future of the batch fails with it
+                if not crashed:
+                    log("Worker pool crashed; restarting it.", 'error')
+                    reset_executor()
+                    crashed = True
+                wallpaper.processing_attempts = (wallpaper.processing_attempts or 0) + 1
+                if wallpaper.processing_attempts >= PROCESSING_MAX_CRASHES:
+                    log(f"Rejected {wallpaper.original_filename}: crashed the worker pool "
+                        f"{wallpaper.processing_attempts} times.", 'error', wallpaper_id=wallpaper.id)
+                    db.session.delete(wallpaper)
+                    processed.append(quarantine_path)
+                    continue
+                log(f"Requeueing {wallpaper.original_filename} after the worker pool crashed.", 'warning',
+                    wallpaper_id=wallpaper.id)
+                wallpaper.status = 'pending'
+                continue
+            except Exception as e:
+                log(f"Error processing {wallpaper.original_filename}: {e}", 'error', wallpaper_id=wallpaper.id)
+                db.session.delete(wallpaper)
+                processed.append(quarantine_path)
+                continue
+
+            processed.append(quarantine_path)
+            for stage, seconds in result['timings'].items():
+                metrics.observe('wally_pipeline_stage_duration_seconds', seconds, stage=stage)
+            image_hash = result['image_hash']
+            duplicate_id = find_duplicate(image_hash, max_distance, activated) if image_hash else None
+            if duplicate_id and duplicate_action == 'reject':
+                log(f"Rejected {wallpaper.original_filename}: near-duplicate of wallpaper {duplicate_id}.", 'info',
+                    wallpaper_id=wallpaper.id, duplicate_of=duplicate_id)
+                # The files may be shared with other wallpapers (or about to be)
+                rejected.append((result['filename'], [result['thumbnail']] +
+                                 [variant for _, _, variant in result['derivatives']]))
+                db.session.delete(wallpaper)
+                continue
+
+            add_ref(result['sha256'], result['filename'], result['size'])
+            wallpaper.filename = result['filename']
+            wallpaper.slug = generate_slug()
+            wallpaper.status = 'active'
+            wallpaper.image_hash = image_hash
+            wallpaper.duplicate_of_id = duplicate_id
+            if result['thumbnail']:
+                wallpaper.thumbnail_filename = result['thumbnail']
+            for width, height, variant in result['derivatives']:
+                wallpaper.variants.append(WallpaperVariant(width=width, height=height, filename=variant))
+            wallpaper_activated(wallpaper)
+            if wallpaper.timestamp:
+                metrics.observe('wally_quarantine_wait_seconds',
+                                (datetime.utcnow() - wallpaper.timestamp).total_seconds())
+            if image_hash:
+                activated.add(wallpaper.id, hash_to_int(image_hash))
+            if duplicate_id:
+                log(f"Flagged {wallpaper.original_filename} as near-duplicate of wallpaper {duplicate_id}.", 'info',
+                    wallpaper_id=wallpaper.id, duplicate_of=duplicate_id)
+            log(f"Success: {wallpaper.original_filename} processed and moved.", 'info', wallpaper_id=wallpaper.id,
+                seconds=round(sum(result['timings'].values()), 4),
+                **{f"{stage}_seconds": round(t, 4) for stage, t in result['timings'].items()})
+
+        db.session.commit()
+        # Only committed activations may turn later uploads into duplicates
+        index = get_catalog_index()
+        for item_id, value in activated.hashes.items():
+            index.add(item_id, value)
+        if processed:
+            tagging_wakeup.notify()  # New active wallpapers to tag (same process)
+        for filename, derived in rejected:
+            remove_unreferenced(upload_folder, filename, [name for name in derived if name],
+                                app.config['RECONCILE_GRACE'])
+
+        for quarantine_path in processed:
+            if os.path.exists(quarantine_path):
+                os.remove(quarantine_path)
+
+        return len(ids)
+
+
+def queue_gauges():
+    """
+    Depth of the quarantine and tagging queues and the age of the oldest
+    pending upload, as [(metric, labels, value)] for /metrics.
+    """
+    gauges = []
+    counts = dict(db.session.query(Wallpaper.status, db.func.count())
+                  .filter(Wallpaper.status.in_(('pending', 'processing'))).group_by(Wallpaper.status))
+    for state in ('pending', 'processing'):
+        gauges.append(('wally_queue_depth', {'queue': 'quarantine', 'state': state}, counts.get(state, 0)))
+    counts = dict(db.session.query(Wallpaper.tagging_status, db.func.count())
+                  .filter(Wallpaper.status == 'active', Wallpaper.tagging_status.in_(('pending', 'tagging')))
+                  .group_by(Wallpaper.tagging_status))
+    for state in ('pending', 'tagging'):
+        gauges.append(('wally_queue_depth', {'queue': 'tagging', 'state': state}, counts.get(state, 0)))
+
+    oldest = db.session.query(db.func.min(Wallpaper.timestamp)).filter(Wallpaper.status == 'pending').scalar()
+    age = (datetime.utcnow() - oldest).total_seconds() if oldest else 0
+    gauges.append(('wally_queue_oldest_age_seconds', {'queue': 'quarantine'}, max(0.0, age)))
+    return gauges
+
+
+def claim_untagged(limit, lease):
+    """Atomically moves up to `limit` active, untagged wallpapers (or expired claims) to 'tagging'."""
+    condition = claimable(Wallpaper.tagging_status, 'pending', 'tagging', lease)
+    candidates = db.session.query(Wallpaper.id) \
+        .filter(Wallpaper.status == 'active', condition) \
+        .order_by(Wallpaper.id).limit(limit).subquery()
+    result = db.session.execute(
+        update(Wallpaper)
+        .where(Wallpaper.id.in_(db.select(candidates.c.id)), condition)
+        .values(tagging_status='tagging', claimed_at=datetime.utcnow())
+        .returning(Wallpaper.id)
+    )
+    ids = [row[0] for row in result]
+    db.session.commit()
+    return ids
+
+
+def process_tagging_batch(app, log=print):
+    """
+    Claims a batch of active wallpapers that still need AI tags and tags them
+    through the pooled Ollama client (TAGGING_WORKERS concurrent model calls).
+    Returns (handled, tagged). handled > 0 with tagged == 0 usually means the
+    model backend is down, which callers use to back off.
+    """
+    log = structured(log)
+    with app.app_context():
+        client = get_client()
+        ids = claim_untagged(client.max_in_flight * 2, app.config['CLAIM_LEASE'])
+        if not ids:
+            return 0, 0
+
+        upload_folder = app.config['UPLOAD_FOLDER']
+        wallpapers = Wallpaper.query.filter(Wallpaper.id.in_(ids)).all()
+
+        # Keyed by id: identical uploads share one stored file
+        by_id = {}
+        jobs = []
+        for w in wallpapers:
+            file_path = os.path.join(upload_folder, w.filename)
+            if not os.path.exists(file_path):
+                log(f"Missing file for tagging: {w.filename}. Skipping.", 'warning', wallpaper_id=w.id)
+                w.tagging_status = 'failed'
+                continue
+            log(f"Atomic Task: AI tagging {w.filename}", 'debug', wallpaper_id=w.id)
+            by_id[w.id] = w
+            jobs.append((w.id, file_path))
+
+        # Every model call finishes before anything is flushed: the first write
+        # opens the transaction, and SQLite would keep its write lock (blocking
+        # uploads, activations and view flushes) until the commit below
+        results = list(client.tag_many(jobs))
+
+        tagged = 0
+        for wallpaper_id, ai_tags in results:
+            w = by_id[wallpaper_id]
+            if ai_tags:
+                attach_tags(w, ai_tags)
+                wallpaper_retagged(w)
+                w.tagging_status = 'done'
+                tagged += 1
+                continue
+            # Empty result: either the image has nothing to say or the backend is down.
+            # Retry a few times before giving up on this image.
+            w.tagging_attempts = (w.tagging_attempts or 0) + 1
+            w.tagging_status = 'failed' if w.tagging_attempts >= TAGGING_MAX_ATTEMPTS else 'pending'
+
+        db.session.commit()
+        return len(ids), tagged
+
+
+def process_similar_batch(app, limit=50, log=print):
+    """
+    Recomputes the precomputed similar lists of up to `limit` stale wallpapers.
+    Returns the number refreshed.
+    """
+    with app.app_context():
+        stale = Wallpaper.query.filter(Wallpaper.status == 'active', Wallpaper.similar_stale.is_(True)) \
+            .order_by(Wallpaper.id).limit(limit).all()
+        for wallpaper in stale:
+            refresh_similar(wallpaper)
+        db.session.commit()
+        if stale:
+            log(f"Refreshed similar wallpapers for {len(stale)} image(s).")
+        return len(stale)
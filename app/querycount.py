@@ -0,0 +1,56 @@
+import threading
+from contextlib import contextmanager
+from flask import g, has_request_context
+from sqlalchemy import event
+from app.extensions import db
+
+# Counts SQL statements per request (and inside count_queries() blocks).
+#
+# With SQL_QUERY_COUNT_HEADER enabled (always on in debug) every response
+# carries X-SQL-Queries, which makes N+1 regressions on the grid pages easy to
+# spot: the count must not change with the number of cards rendered.
+
+_local = threading.local()
+
+
+class QueryCount:
+    def __init__(self):
+        self.count = 0
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+    for counter in getattr(_local, 'counters', ()):
+        counter.count += 1
+
+
+@contextmanager
+def count_queries():
+    """
+    Counts the statements issued inside the block on this thread:
+
+        with count_queries() as queries:
+            client.get('/')
+        assert queries.count <= 4
+    """
+    counter = QueryCount()
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _local.counters = []
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def init_query_counter(app):
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _on_execute)
+
+    @app.after_request
+    def add_query_count_header(response):
+        if app.config.get('SQL_QUERY_COUNT_HEADER') or app.debug:
+            response.headers['X-SQL-Queries'] = str(g.get('sql_queries', 0))
+        return response
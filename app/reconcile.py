@@ -0,0 +1,187 @@
+import json
+import os
+import time
+from contextlib import nullcontext
+from app.extensions import db
+from app.models import Wallpaper, WallpaperVariant
+from app.storage import blob_lock
+
+# Orphan file reconciliation for UPLOAD_FOLDER and QUARANTINE_FOLDER.
+#
+# A file is kept if some row references it: wallpaper.filename (originals, and
+# quarantined files of pending rows), wallpaper.thumbnail_filename or
+# wallpaper_variant.filename. Each directory is read with os.scandir in sorted
+# batches and every batch is checked with indexed IN queries, so memory stays
+# bounded by the batch size.
+#
+# Upload directories whose mtime is unchanged since their last clean pass are
+# skipped (adding or removing a file changes the mtime of its directory); the
+# state file also remembers their subdirectories, so an idle pass only stats
+# the shard directories. The quarantine folder only holds in-flight work and is
+# always read. Files younger than RECONCILE_GRACE are never touched, and a
+# directory holding one is checked again next time. Every deletion is appended
+# to RECONCILE_JOURNAL as a JSON line.
+#
+# Orphans can also appear without any directory changing: deleting a row, or a
+# blob whose files were left for later (app/storage.py). So every
+# RECONCILE_FULL_INTERVAL seconds a pass ignores the mtimes and reads every
+# directory.
+
+BATCH_SIZE = 500
+
+
+def load_state(path):
+    """{'dirs': {rel: [mtime_ns, subdirs]}, 'last_full': time of the last full pass}."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        state = {}
+    if 'dirs' not in state:
+        state = {'dirs': {}, 'last_full': 0}  # Missing, or written before full passes were scheduled
+    return state
+
+
+def save_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def referenced(names):
+    """The subset of names (relative paths) referenced by any row."""
+    if not names:
+        return set()
+    found = {row[0] for row in db.session.query(Wallpaper.filename).filter(Wallpaper.filename.in_(names))}
+    found.update(row[0] for row in db.session.query(Wallpaper.thumbnail_filename)
+                 .filter(Wallpaper.thumbnail_filename.in_(names)))
+    found.update(row[0] for row in db.session.query(WallpaperVariant.filename)
+                 .filter(WallpaperVariant.filename.in_(names)))
+    return found
+
+
+def _is_candidate(name, quarantine):
+    if name.startswith('.tmp_') or name.endswith('.tmp'):
+        return True  # Leftovers of interrupted writes
+    if name.startswith('.'):
+        return False
+    if quarantine and name.startswith('upload_'):
+        return False  # Resumable upload sessions expire on their own (app/uploads.py)
+    return True
+
+
+class Reconciler:
+    def __init__(self, grace, journal_path=None, dry_run=False, log=print):
+        self.grace = grace
+        self.journal_path = journal_path
+        self.dry_run = dry_run
+        self.log = log
+        self.now = time.time()
+        self.deleted = []
+        self.scanned_dirs = 0
+        self.scanned_files = 0
+
+    def scan_dir(self, folder, rel, quarantine=False):
+        """
+        Checks the files of one directory. Returns (subdirectories, complete);
+        complete is False when a file was spared only because of the grace period.
+        """
+        path = os.path.join(folder, rel) if rel else folder
+        subdirs = []
+        files = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False) and _is_candidate(entry.name, quarantine):
+                    files.append(entry.name)
+        self.scanned_dirs += 1
+        self.scanned_files += len(files)
+
+        complete = True
+        files.sort()
+        for start in range(0, len(files), BATCH_SIZE):
+            batch = files[start:start + BATCH_SIZE]
+            names = [f"{rel}/{name}" if rel else name for name in batch]
+            keep = referenced(names)
+            for name, full_name in zip(batch, names):
+                if full_name in keep:
+                    continue
+                # Stat and delete under the blob lock, so a pool worker reusing the
+                # file (store_file touches it) either sees it gone or saves it
+                with nullcontext() if quarantine else blob_lock(folder):
+                    file_path = os.path.join(path, name)
+                    try:
+                        st = os.stat(file_path)
+                    except FileNotFoundError:
+                        continue
+                    # ctime too: a hard link (bulk import) keeps the source's mtime
+                    if self.now - max(st.st_mtime, st.st_ctime) < self.grace:
+                        complete = False
+                        continue
+                    self.delete(folder, full_name, file_path, st.st_size)
+        return sorted(subdirs), complete
+
+    def delete(self, folder, name, file_path, size):
+        self.deleted.append((folder, name, size))
+        if self.dry_run:
+            self.log(f"Would delete {os.path.join(folder, name)} ({size} bytes)")
+            return
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            return
+        if self.journal_path:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            with open(self.journal_path, 'a') as f:
+                f.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'folder': folder,
+                                    'file': name, 'size': size}) + '\n')
+
+    def scan_tree(self, folder, state, full=False):
+        """Walks folder, scanning only directories changed since the state was recorded."""
+        new_state = {}
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(folder, rel) if rel else folder
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            known = state.get(rel)
+            if not full and known and known[0] == mtime:
+                subdirs, complete = known[1], True
+            else:
+                subdirs, complete = self.scan_dir(folder, rel)
+                if not self.dry_run:
+                    mtime = os.stat(path).st_mtime_ns  # Our own deletions changed it
+            if complete:
+                new_state[rel] = [mtime, subdirs]
+            stack.extend(f"{rel}/{name}" if rel else name for name in subdirs)
+        return new_state
+
+
+def reconcile(upload_folder, quarantine_folder, grace, state_path, journal_path=None,
+              dry_run=False, full=False, full_interval=None, log=print):
+    """
+    One reconciliation pass over both folders. The pass is full (every
+    directory read) when asked for, or when the last full pass is more than
+    full_interval seconds ago. Returns the list of deleted (or, with dry_run,
+    deletable) files as (folder, name, size).
+    """
+    reconciler = Reconciler(grace, journal_path, dry_run, log)
+    state = load_state(state_path)
+    if full_interval is not None and reconciler.now - state['last_full'] >= full_interval:
+        full = True
+
+    dirs = reconciler.scan_tree(upload_folder, state['dirs'], full)
+    if os.path.isdir(quarantine_folder):
+        reconciler.scan_dir(quarantine_folder, '', quarantine=True)
+
+    if not dry_run:
+        save_state(state_path, {'dirs': dirs, 'last_full': reconciler.now if full else state['last_full']})
+    log(f"Reconciled {reconciler.scanned_files} files in {reconciler.scanned_dirs} directories: "
+        f"{len(reconciler.deleted)} orphan(s){' found' if dry_run else ' deleted'}.")
+    return reconciler.deleted
@@ -0,0 +1,321 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from PIL import Image, ImageOps
+from flask import current_app
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+# On-demand resizes for /img/<slug>/<w>x<h>.<fmt>.
+#
+# Results live in RESIZE_CACHE_FOLDER as <slug[:2]>/<slug>/<w>x<h>-<fit>.<fmt>,
+# so a cache hit never touches the DB and deleting a wallpaper can drop all of
+# its renders at once. The cache is an LRU over file atimes (hits set it; the
+# mtime stays the render time, which the ETag is built from) bounded by
+# RESIZE_CACHE_MAX_BYTES. A render only adds its size to the
+# process's running estimate; when that goes over the bound (or is older than
+# RESCAN_INTERVAL) a background thread rescans the folder and evicts the
+# oldest files, so no request ever walks the cache.
+# Renders of the same key are single-flighted with a per-key lock file
+# (flock), which also covers other gunicorn workers; the holder deletes it
+# before unlocking, so lock files don't pile up and a miss never waits on an
+# unrelated key. Each process renders at most
+# RESIZE_MAX_RENDERS images at once; a miss beyond that gets RenderBusy (503
+# with Retry-After) instead of tying up another worker.
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+FITS = ('cover', 'contain')
+SLUG_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+LOCK_BUCKETS = 256
+RESCAN_INTERVAL = 60
+RETRY_AFTER = 2  # Seconds, sent with the 503 when every render slot is taken
+
+_key_locks = {}  # key -> [thread lock, users]
+_key_locks_guard = threading.Lock()
+_render_slots = None
+_render_slots_lock = threading.Lock()
+_state_lock = threading.Lock()
+_estimated_bytes = None
+_last_scan = 0
+_scan_wanted = threading.Event()
+_evictor = None
+_evictor_pid = None
+_evict_args = None  # (cache_folder, max_bytes) of the last render
+
+
+class RenderBusy(Exception):
+    """Every render slot of this process is taken."""
+
+
+def _slots():
+    global _render_slots
+    with _render_slots_lock:
+        if _render_slots is None:
+            _render_slots = threading.BoundedSemaphore(current_app.config['RESIZE_MAX_RENDERS'])
+        return _render_slots
+
+
+def cache_key(slug, width, height, fit, fmt):
+    return f"{slug}|{width}x{height}|{fit}|{fmt}"
+
+
+def etag_for(key):
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def file_etag(path):
+    """
+    Validator of one rendered file: its render time and size. The same key can
+    be rendered again from a different source (derivatives added or removed),
+    so the key alone does not identify the bytes.
+    """
+    st = os.stat(path)
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def cache_path(cache_folder, slug, width, height, fit, fmt):
+    return os.path.join(cache_folder, slug[:2], slug, f"{width}x{height}-{fit}.{fmt}")
+
+
+def pick_source(wallpaper, width, height, fit):
+    """
+    The smallest stored derivative that is still large enough for the
+    requested box, or the original. Derivatives share the original's aspect.
+    """
+    variants = list(wallpaper.variants)
+    if not variants:
+        return wallpaper.filename
+    largest = variants[-1]
+    aspect = largest.width / largest.height
+    if fit == 'cover':
+        needed = max(width, height * aspect)
+    else:
+        needed = min(width, height * aspect)
+    for variant in variants:
+        if variant.width >= needed:
+            return variant.filename
+    return wallpaper.filename
+
+
+def render(source_path, dest_path, width, height, fit, fmt):
+    pil_format = FORMATS[fmt][0]
+    with Image.open(source_path) as img:
+        # Let the JPEG decoder downscale by a power of two when it can
+        img.draft('RGB', (width, height))
+        img = ImageOps.exif_transpose(img)
+        if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        elif img.mode == 'P':
+            img = img.convert('RGBA')
+        if fit == 'cover':
+            img = ImageOps.fit(img, (width, height), Image.Resampling.LANCZOS)
+        else:
+            img = ImageOps.contain(img, (width, height), Image.Resampling.LANCZOS)
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, pil_format, quality=85)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class _KeyLock:
+    """
+    Thread lock + flock on a lock file of its own for one key. Falls back to
+    one of LOCK_BUCKETS shared lock files (never deleted) if the per-key file
+    can't be created.
+    """
+
+    def __init__(self, cache_folder, key):
+        self.key = key
+        digest = etag_for(key)
+        self.path = os.path.join(cache_folder, '.locks', f"{digest}.lock")
+        self.bucket_path = os.path.join(cache_folder, '.locks', f"{int(digest[:8], 16) % LOCK_BUCKETS:03d}.lock")
+        self.thread_lock = None
+        self.fd = None
+        self.owned = False
+
+    def __enter__(self):
+        with _key_locks_guard:
+            entry = _key_locks.setdefault(self.key, [threading.Lock(), 0])
+            entry[1] += 1
+        self.thread_lock = entry[0]
+        self.thread_lock.acquire()
+        if fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._lock_own_file()
+            except OSError:
+                self.fd = os.open(self.bucket_path, os.O_CREAT | os.O_RDWR)
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def _lock_own_file(self):
+        while True:
+            fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # The previous holder deletes the file before unlocking; if it
+            # did, lock the one the next request creates instead
+            try:
+                current = os.stat(self.path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                self.fd = fd
+                self.owned = True
+                return
+            os.close(fd)
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            if self.owned:
+                os.remove(self.path)
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+            self.owned = False
+        self.thread_lock.release()
+        with _key_locks_guard:
+            entry = _key_locks[self.key]
+            entry[1] -= 1
+            if not entry[1]:
+                del _key_locks[self.key]
+
+
+def lookup(cache_folder, slug, width, height, fit, fmt):
+    """Returns the cached path if present (and marks it recently used), else None."""
+    path = cache_path(cache_folder, slug, width, height, fit, fmt)
+    try:
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def get_or_render(cache_folder, slug, width, height, fit, fmt, load_source):
+    """
+    Returns the path of the cached render, producing it if needed.
+    `load_source()` returns the absolute source path (or None -> not found);
+    it is only called on a miss, inside the single-flight lock. Raises
+    RenderBusy if the render would go over RESIZE_MAX_RENDERS.
+    """
+    path = lookup(cache_folder, slug, width, height, fit, fmt)
+    if path:
+        return path
+
+    with _KeyLock(cache_folder, cache_key(slug, width, height, fit, fmt)):
+        # Someone else may have rendered it while we waited
+        path = lookup(cache_folder, slug, width, height, fit, fmt)
+        if path:
+            return path
+        source_path = load_source()
+        if source_path is None:
+            return None
+        path = cache_path(cache_folder, slug, width, height, fit, fmt)
+        slots = _slots()
+        if not slots.acquire(blocking=False):
+            raise RenderBusy()
+        try:
+            render(source_path, path, width, height, fit, fmt)
+        finally:
+            slots.release()
+
+    _account(cache_folder, os.path.getsize(path))
+    return path
+
+
+def purge(cache_folder, slug):
+    """Drops every cached render of one wallpaper."""
+    if SLUG_RE.match(slug or ''):
+        shutil.rmtree(os.path.join(cache_folder, slug[:2], slug), ignore_errors=True)
+
+
+def _account(cache_folder, added_bytes):
+    """Adds a new render to the size estimate; wakes the evictor when a rescan is due."""
+    global _estimated_bytes, _evict_args
+    max_bytes = current_app.config['RESIZE_CACHE_MAX_BYTES']
+    with _state_lock:
+        _evict_args = (cache_folder, max_bytes)
+        _ensure_evictor()
+        if _estimated_bytes is not None and time.time() - _last_scan <= RESCAN_INTERVAL:
+            _estimated_bytes += added_bytes
+            if _estimated_bytes <= max_bytes:
+                return
+    _scan_wanted.set()
+
+
+def _ensure_evictor():
+    # Called with _state_lock held; a forked worker starts its own thread
+    global _evictor, _evictor_pid
+    if _evictor_pid == os.getpid() and _evictor is not None and _evictor.is_alive():
+        return
+    _evictor_pid = os.getpid()
+    _evictor = threading.Thread(target=_run_evictor, daemon=True, name='resize-evictor')
+    _evictor.start()
+
+
+def _run_evictor():
+    global _estimated_bytes, _last_scan
+    while True:
+        _scan_wanted.wait()
+        _scan_wanted.clear()
+        with _state_lock:
+            cache_folder, max_bytes = _evict_args
+        try:
+            total = evict(cache_folder, max_bytes)
+        except OSError as e:
+            print(f"Resize cache eviction failed: {e}")
+            continue
+        with _state_lock:
+            _estimated_bytes = total
+            _last_scan = time.time()
+
+
+def evict(cache_folder, max_bytes):
+    """Deletes least recently used renders until the cache is under 90% of max_bytes. Returns the new size."""
+    entries = []
+    total = 0
+    for root, dirs, files in os.walk(cache_folder):
+        dirs[:] = [d for d in dirs if d != '.locks']
+        for name in files:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+            total += st.st_size
+
+    if total <= max_bytes:
+        return total
+
+    target = max_bytes * 0.9
+    entries.sort()
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+    return total
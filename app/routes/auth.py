@@ -5,6 +5,10 @@ from app.extensions import db
 
 bp = Blueprint('auth', __name__)
 
+# First path segments of app routes: a user with one of these names would have
+# a profile URL (/<username>) that can never be reached
+RESERVED_USERNAMES = {'auth', 'browse', 'img', 'metrics', 'search', 'static', 'upload', 'uploads', 'wallpaper'}
+
 @bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
@@ -25,6 +29,10 @@ def register():
             flash('Must include username, email and password')
             return redirect(url_for('auth.register'))
 
+        if username.lower() in RESERVED_USERNAMES:
+            flash('That username is reserved')
+            return redirect(url_for('auth.register'))
+
         if User.query.filter_by(username=username).first():
             flash('Username already exists')
             return redirect(url_for('auth.register'))
@@ -1,13 +1,27 @@
-from flask import Blueprint, request, jsonify, current_app, url_for, render_template, flash, redirect, abort
+from flask import Blueprint, request, jsonify, current_app, url_for, render_template, flash, redirect, abort, send_file, send_from_directory, Response, make_response
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
-from app.models import Wallpaper, User, Tag
-from app.extensions import db
-from app.utils import allowed_file, generate_thumbnail, generate_random_filename
-from sqlalchemy import or_
+from werkzeug.security import safe_join
+from app.models import Wallpaper, User
+from app.extensions import db, view_counter, fragment_cache, metrics
+from app.utils import allowed_file
+from app.search import search_wallpapers
+from app.pagination import newest_first_page
+from app.similar import get_similar
+from app.catalog import wallpaper_deleted
+from app import resizer
+from app.storage import release, remove_unreferenced
+from app.wakeup import notify_quarantine
+from app.tags import attach_tags, parse_tags
+from app.pipeline import queue_gauges
+from app.facets import MAX_SELECTED, selected_tags, browse_page, cooccurring, tag_cloud
+from app.uploads import (UploadError, HASH_RE, create_session, load_session, open_sessions, current_offset,
+                         append_chunk, finalizing, delete_session, part_path, save_stream)
+from sqlalchemy.orm import selectinload
 import os
 import uuid
-from PIL import Image
+import hashlib
+import hmac
+import mimetypes
 
 
 
@@ -16,13 +30,41 @@ bp = Blueprint('main', __name__)
 # allowed_file moved to app.utils
 
 
+def add_pending_wallpaper(quarantine_name, original_filename, title, tags_str, content_hash=None):
+    """Creates the pending row for a file sitting in quarantine (not committed)."""
+    wallpaper = Wallpaper(
+        title=title, 
+        filename=quarantine_name, # Temporary filename in quarantine
+        original_filename=original_filename,
+        content_hash=content_hash,
+        status='pending',
+        uploader=current_user
+    )
+    
+    db.session.add(wallpaper)
+
+    # Handle tags (stored even when pending); AI tagging is only for untagged uploads
+    if attach_tags(wallpaper, parse_tags(tags_str)):
+        wallpaper.tagging_status = 'done'
+    return wallpaper
+
+
+def title_from_filename(filename):
+    # Use original filename as default title, clean it up
+    return filename.rsplit('.', 1)[0].replace('_', ' ').replace('-', ' ').title()
+
+
+def is_duplicate_content(content_hash):
+    return db.session.query(Wallpaper.id).filter_by(content_hash=content_hash).first() is not None
+
+
 @bp.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload():
 
     # Manual size check for non-admins (300MB)
     if not current_user.is_admin:
-        max_size = 300 * 1024 * 1024
+        max_size = current_app.config['UPLOAD_MAX_BYTES']
         if request.content_length and request.content_length > max_size:
             flash('Total upload size exceeds 300MB limit')
             return redirect(request.url)
@@ -38,8 +80,9 @@ def upload():
             flash('No selected file')
             return redirect(request.url)
             
-        if len(files) > 10 and not current_user.is_admin:
-             flash('Maximum 10 files allowed per upload')
+        max_files = current_app.config['UPLOAD_MAX_FILES']
+        if len(files) > max_files and not current_user.is_admin:
+             flash(f'Maximum {max_files} files allowed per upload')
              return redirect(request.url)
 
 
@@ -48,42 +91,29 @@ def upload():
         
 
         uploaded_count = 0
+        duplicate_count = 0
         for file in files:
             if file and allowed_file(file.filename):
                 ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else 'jpg'
-                # Save to quarantine folder initially
+                # Save to quarantine folder initially, hashing as we copy
                 quarantine_name = f"pending_{uuid.uuid4().hex}.{ext}"
-                file.save(os.path.join(current_app.config['QUARANTINE_FOLDER'], quarantine_name))
+                quarantine_path = os.path.join(current_app.config['QUARANTINE_FOLDER'], quarantine_name)
+                content_hash = save_stream(file.stream, quarantine_path)
+                if is_duplicate_content(content_hash):
+                    os.remove(quarantine_path)
+                    duplicate_count += 1
+                    continue
                 
-                # Use original filename as default title, clean it up
-                original_title = file.filename.rsplit('.', 1)[0].replace('_', ' ').replace('-', ' ').title()
-                title = request.form.get('title') or original_title
-                tags_str = request.form.get('tags', '')
-
-                wallpaper = Wallpaper(
-                    title=title, 
-                    filename=quarantine_name, # Temporary filename in quarantine
-                    original_filename=file.filename,
-                    status='pending',
-                    uploader=current_user
-                )
-                
-                db.session.add(wallpaper)
-
-                # Handle tags (stored even when pending)
-                if tags_str:
-                    tag_names = [t.strip().lower() for t in tags_str.split(',') if t.strip()]
-                    for name in tag_names:
-                        tag = Tag.query.filter_by(name=name).first()
-                        if not tag:
-                            tag = Tag(name=name)
-                            db.session.add(tag)
-                        wallpaper.tags.append(tag)
-
+                title = request.form.get('title') or title_from_filename(file.filename)
+                add_pending_wallpaper(quarantine_name, file.filename, title, request.form.get('tags', ''), content_hash)
                 uploaded_count += 1
         
         db.session.commit()
+        if uploaded_count > 0:
+            notify_quarantine(current_app.config['QUARANTINE_FOLDER'])
         
+        if duplicate_count:
+            flash(f'{duplicate_count} file(s) skipped: already in the library.')
         if uploaded_count > 0:
             flash(f'{uploaded_count} wallpaper(s) uploaded and are being processed for security. They will appear soon.')
             return redirect(url_for('main.index'))
@@ -94,20 +124,162 @@ def upload():
     return render_template('upload.html')
 
 
+# Resumable uploads (app/uploads.py). A client creates a session, PATCHes the
+# bytes in chunks at explicit offsets (HEAD tells where to resume after a
+# dropped connection) and then finalizes it:
+#
+#   POST   /upload/sessions                 {"filename", "size", "sha256"?, "title"?, "tags"?}
+#   HEAD   /upload/sessions/<id>            -> Upload-Offset
+#   PATCH  /upload/sessions/<id>            Upload-Offset: n, body = next chunk
+#   POST   /upload/sessions/<id>/finalize   -> pending wallpaper
+#   DELETE /upload/sessions/<id>
+
+def upload_error(message, status, offset=None):
+    response = jsonify(error=message)
+    response.status_code = status
+    if offset is not None:
+        response.headers['Upload-Offset'] = str(offset)
+    return response
+
+
+def get_own_session(upload_id):
+    meta = load_session(current_app.config['QUARANTINE_FOLDER'], upload_id)
+    if meta is None or meta['user_id'] != current_user.id:
+        abort(404)
+    return meta
+
+
+@bp.route('/upload/sessions', methods=['POST'])
+@login_required
+def create_upload_session():
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or ''
+    size = data.get('size')
+    declared_hash = (data.get('sha256') or '').lower() or None
+
+    if not allowed_file(filename):
+        return upload_error('File type not allowed', 400)
+    if not isinstance(size, int) or size <= 0:
+        return upload_error('Missing or invalid size', 400)
+    if not current_user.is_admin:
+        # Open sessions count against the same limits as one multipart upload
+        sessions = open_sessions(current_app.config['QUARANTINE_FOLDER'], current_user.id)
+        if len(sessions) >= current_app.config['UPLOAD_MAX_SESSIONS']:
+            return upload_error('Too many unfinished uploads; finish or cancel some first', 429)
+        if size > current_app.config['UPLOAD_MAX_BYTES']:
+            return upload_error('File exceeds the 300MB limit', 413)
+        if size + sum(meta['size'] for meta in sessions) > current_app.config['UPLOAD_MAX_BYTES']:
+            return upload_error('Unfinished uploads would exceed the 300MB limit', 413)
+    if declared_hash and not HASH_RE.match(declared_hash):
+        return upload_error('Invalid sha256', 400)
+    # Exact duplicates are turned away before a single byte is sent
+    if declared_hash and is_duplicate_content(declared_hash):
+        return upload_error('This file is already in the library', 409)
+
+    upload_id = create_session(current_app.config['QUARANTINE_FOLDER'], {
+        'user_id': current_user.id,
+        'filename': filename,
+        'size': size,
+        'sha256': declared_hash,
+        'title': data.get('title') or title_from_filename(filename),
+        'tags': data.get('tags') or '',
+    })
+    response = jsonify(id=upload_id, offset=0, url=url_for('main.upload_session', upload_id=upload_id))
+    response.status_code = 201
+    response.headers['Location'] = url_for('main.upload_session', upload_id=upload_id)
+    return response
+
+
+@bp.route('/upload/sessions/<upload_id>', methods=['HEAD', 'PATCH', 'DELETE'])
+@login_required
+def upload_session(upload_id):
+    quarantine_folder = current_app.config['QUARANTINE_FOLDER']
+    meta = get_own_session(upload_id)
+
+    if request.method == 'DELETE':
+        delete_session(quarantine_folder, upload_id)
+        return '', 204
+
+    if request.method == 'PATCH':
+        offset = request.headers.get('Upload-Offset', type=int)
+        if offset is None:
+            return upload_error('Missing Upload-Offset', 400)
+        try:
+            new_offset = append_chunk(quarantine_folder, upload_id, meta, offset, request.stream)
+        except UploadError as e:
+            return upload_error(str(e), e.status, e.offset)
+    else:
+        new_offset = current_offset(quarantine_folder, upload_id)
+        if new_offset is None:
+            abort(404)
+
+    response = make_response('', 204 if request.method == 'PATCH' else 200)
+    response.headers['Upload-Offset'] = str(new_offset)
+    response.headers['Upload-Length'] = str(meta['size'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@bp.route('/upload/sessions/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(upload_id):
+    quarantine_folder = current_app.config['QUARANTINE_FOLDER']
+    meta = get_own_session(upload_id)
+
+    try:
+        # The session stays locked until its row is committed: a concurrent
+        # finalize gets 409, a later one 404
+        with finalizing(quarantine_folder, upload_id) as (offset, content_hash):
+            if offset != meta['size']:
+                return upload_error('Upload is incomplete', 409, offset)
+            if meta['sha256'] and meta['sha256'] != content_hash:
+                delete_session(quarantine_folder, upload_id)
+                return upload_error('Content does not match the declared sha256', 422)
+            if is_duplicate_content(content_hash):
+                delete_session(quarantine_folder, upload_id)
+                return upload_error('This file is already in the library', 409)
+
+            ext = meta['filename'].rsplit('.', 1)[1].lower()
+            quarantine_name = f"pending_{uuid.uuid4().hex}.{ext}"
+            os.replace(part_path(quarantine_folder, upload_id), os.path.join(quarantine_folder, quarantine_name))
+            wallpaper = add_pending_wallpaper(quarantine_name, meta['filename'], meta['title'], meta['tags'],
+                                              content_hash)
+            db.session.commit()
+            delete_session(quarantine_folder, upload_id)
+    except UploadError as e:
+        return upload_error(str(e), e.status)
+
+    notify_quarantine(quarantine_folder)
+
+    response = jsonify(id=wallpaper.id, status=wallpaper.status)
+    response.status_code = 201
+    return response
+
+
 @bp.route('/', methods=['GET'])
 def index():
-    page = request.args.get('page', 1, type=int)
-    # Use 24 as it is divisible by 2, 3, 4, 6, 8, 12 for better grid filling
-    pagination = Wallpaper.query.filter_by(status='active').order_by(Wallpaper.timestamp.desc()).paginate(page=page, per_page=24, error_out=False)
-    wallpapers = pagination.items
-    
-    if request.args.get('load_more'):
-        return render_template('partials/wallpaper_grid_items.html', wallpapers=wallpapers)
+    cursor = request.args.get('cursor')
 
-    next_url = url_for('main.index', page=pagination.next_num) if pagination.has_next else None
-    prev_url = url_for('main.index', page=pagination.prev_num) if pagination.has_prev else None
+    def render_page():
+        # Use 24 as it is divisible by 2, 3, 4, 6, 8, 12 for better grid filling
+        # Tags are batch-loaded (one extra SELECT) instead of lazily per card
+        # Keyset pagination on (timestamp, id): no COUNT, no OFFSET (app/pagination.py)
+        query = Wallpaper.query.filter_by(status='active').options(selectinload(Wallpaper.tags))
+        wallpapers, next_cursor = newest_first_page(query, cursor, per_page=24)
+        next_url = url_for('main.index', cursor=next_cursor) if next_cursor else None
+        return render_template('partials/wallpaper_grid_items.html', wallpapers=wallpapers), next_url
 
-    return render_template('index.html', title='Home', wallpapers=wallpapers, has_next=pagination.has_next, next_url=next_url, prev_url=prev_url)
+    # The cards are the same for every visitor; they are rendered once per
+    # catalog version and the page shell is rendered around them
+    try:
+        grid_html, next_url = fragment_cache.get_or_render(('index', cursor), render_page)
+    except ValueError:
+        abort(400)
+
+    if request.args.get('load_more'):
+        return grid_items_response(grid_html, next_url)
+
+    return render_template('index.html', title='Home', grid_html=grid_html, has_next=next_url is not None, next_url=next_url)
 
 @bp.route('/search', methods=['GET'])
 def search():
@@ -115,53 +287,180 @@ def search():
     if not query:
         return redirect(url_for('main.index'))
     
-    page = request.args.get('page', 1, type=int)
-    
-    # Search in title or tags with pagination
-    pagination = Wallpaper.query.filter(
-        Wallpaper.status == 'active',
-        or_(
-            Wallpaper.title.ilike(f'%{query}%'),
-            Wallpaper.tags.any(Tag.name.ilike(f'%{query}%'))
-        )
-    ).order_by(Wallpaper.timestamp.desc()).paginate(page=page, per_page=24, error_out=False)
+    cursor = request.args.get('cursor')
     
-    wallpapers = pagination.items
+    # Ranked full-text search over titles and tags (see app/search.py)
+    try:
+        wallpapers, next_cursor = search_wallpapers(query, cursor=cursor, per_page=24)
+    except ValueError:
+        abort(400)
+
+    next_url = url_for('main.search', q=query, cursor=next_cursor) if next_cursor else None
+
+    grid_html = render_template('partials/wallpaper_grid_items.html', wallpapers=wallpapers)
+    if request.args.get('load_more'):
+        return grid_items_response(grid_html, next_url)
+
+    return render_template('index.html', title=f'Search: {query}', grid_html=grid_html, has_next=next_url is not None, next_url=next_url)
+
+
+@bp.route('/browse')
+def browse():
+    # Wallpapers carrying all of the selected tags, plus the tags to narrow
+    # down further with their counts (app/facets.py)
+    selected = tuple(parse_tags(request.args.get('tags', '')))
+    if len(selected) > MAX_SELECTED:
+        abort(400)
+    cursor = request.args.get('cursor')
+    key = tuple(sorted(selected))
+
+    def render_page():
+        if not selected:
+            query = Wallpaper.query.filter_by(status='active').options(selectinload(Wallpaper.tags))
+            wallpapers, next_cursor = newest_first_page(query, cursor, per_page=24)
+        else:
+            tags = selected_tags(selected)
+            wallpapers, next_cursor = browse_page(tags, cursor, per_page=24) if tags else ([], None)
+        next_url = url_for('main.browse', tags=','.join(key), cursor=next_cursor) if next_cursor else None
+        return render_template('partials/wallpaper_grid_items.html', wallpapers=wallpapers), next_url
+
+    try:
+        grid_html, next_url = fragment_cache.get_or_render(('browse', key, cursor), render_page)
+    except ValueError:
+        abort(400)
 
     if request.args.get('load_more'):
-        return render_template('partials/wallpaper_grid_items.html', wallpapers=wallpapers)
+        return grid_items_response(grid_html, next_url)
+
+    def render_facets():
+        if selected:
+            tags = selected_tags(selected)
+            counts = cooccurring(tags) if tags else []
+        else:
+            counts = tag_cloud()
+        return render_template('partials/tag_facets.html', selected=selected, counts=counts), None
+
+    facets_html, _ = fragment_cache.get_or_render(('facets', selected), render_facets)
+    return render_template('browse.html', title='Browse', selected=selected, facets_html=facets_html,
+                           grid_html=grid_html, has_next=next_url is not None, next_url=next_url)
+
 
-    return render_template('index.html', title=f'Search: {query}', wallpapers=wallpapers, has_next=pagination.has_next)
+def grid_items_response(grid_html, next_url):
+    """Infinite-scroll chunk: the cards, with the URL of the following chunk in X-Next-Url."""
+    response = make_response(grid_html)
+    if next_url:
+        response.headers['X-Next-Url'] = next_url
+    return response
+
+def metrics_allowed():
+    """The scraper sent METRICS_TOKEN as a bearer token, or connects from METRICS_ALLOWED_IPS."""
+    token = current_app.config['METRICS_TOKEN']
+    auth = request.headers.get('Authorization', '')
+    if token and auth.startswith('Bearer ') and hmac.compare_digest(auth[len('Bearer '):], token):
+        return True
+    return request.remote_addr in current_app.config['METRICS_ALLOWED_IPS']
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition, summed over every worker process."""
+    if not metrics_allowed():
+        abort(404)
+    return Response(metrics.render(queue_gauges()), mimetype='text/plain; version=0.0.4')
 
 @bp.route('/wallpaper/<string:slug>')
 def wallpaper_detail(slug):
-    # Search for wallpaper where filename starts with slug (UUID part)
-    # We do a 'like' query to match slug + '.*'
-    wallpaper = Wallpaper.query.filter(Wallpaper.filename.like(f"{slug}.%")).first_or_404()
+    # Single equality probe on the unique slug index (set on activation)
+    wallpaper = Wallpaper.query.filter_by(slug=slug).first_or_404()
     
-    # Increment views
+    # Increment views (buffered, written in batches by view_counter)
     # Check if viewer is not uploader (optional, simple logic here)
     if not current_user.is_authenticated or current_user.id != wallpaper.user_id:
-        if hasattr(wallpaper.uploader, 'views'):
-            wallpaper.uploader.views = (wallpaper.uploader.views or 0) + 1
-            db.session.commit()
+        if wallpaper.user_id:
+            view_counter.increment(wallpaper.user_id)
 
-    # Find similar wallpapers
-    # Logic: Wallpapers sharing at least one tag, excluding current one
-    similar_wallpapers = []
-    if wallpaper.tags:
-        tag_ids = [t.id for t in wallpaper.tags]
-        similar_wallpapers = Wallpaper.query.filter(
-            Wallpaper.status == 'active',
-            Wallpaper.id != wallpaper.id,
-            Wallpaper.tags.any(Tag.id.in_(tag_ids))
-        ).order_by(Wallpaper.timestamp.desc()).limit(4).all()
-        
-    # If not enough, maybe fill with random or recent? For now, just tags.
+    # Similar wallpapers are precomputed by the maintenance loop (app/similar.py)
+    similar_wallpapers = get_similar(wallpaper, limit=4)
     
     return render_template('wallpaper.html', wallpaper=wallpaper, similar_wallpapers=similar_wallpapers)
 
 
+@bp.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    """
+    Originals, thumbnails and derivatives. Their names are random and a file
+    is never rewritten under the same name, so clients may cache it forever.
+    """
+    # Lock files and in-flight writes (app/storage.py) are not uploads, and
+    # their bytes can still change
+    if any(part.startswith('.') or part.endswith('.tmp') for part in filename.split('/')):
+        abort(404)
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    path = safe_join(upload_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    max_age = current_app.config['UPLOAD_MAX_AGE']
+    # The name identifies the content, so hashing it gives a strong ETag that
+    # is the same on every worker and host
+    etag = hashlib.sha1(filename.encode()).hexdigest()
+
+    backend = current_app.config.get('SENDFILE_BACKEND')
+    if backend == 'nginx':
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = current_app.config['SENDFILE_PREFIX'] + filename
+        response.set_etag(etag)
+        response.make_conditional(request)
+    elif backend == 'apache':
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Sendfile'] = path
+        response.set_etag(etag)
+        response.make_conditional(request)
+    else:
+        response = send_from_directory(upload_folder, filename, etag=etag, max_age=max_age, conditional=True)
+
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = True
+    return response
+
+
+@bp.route('/img/<string:slug>/<int:width>x<int:height>.<fmt>')
+def resized_image(slug, width, height, fmt):
+    """
+    Any size of an active wallpaper, e.g. /img/<slug>/2560x1440.webp.
+    ?fit=cover (default) crops to exactly width x height, ?fit=contain keeps the
+    whole image inside the box. Results are cached on disk (app/resizer.py).
+    """
+    fit = request.args.get('fit', 'cover')
+    max_dimension = current_app.config['RESIZE_MAX_DIMENSION']
+    if fmt not in resizer.FORMATS or fit not in resizer.FITS or not resizer.SLUG_RE.match(slug):
+        abort(404)
+    if not (0 < width <= max_dimension and 0 < height <= max_dimension):
+        abort(400)
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+
+    def load_source():
+        wallpaper = Wallpaper.query.filter_by(slug=slug, status='active').first()
+        if wallpaper is None:
+            return None
+        source_path = os.path.join(upload_folder, resizer.pick_source(wallpaper, width, height, fit))
+        return source_path if os.path.exists(source_path) else None
+
+    try:
+        path = resizer.get_or_render(current_app.config['RESIZE_CACHE_FOLDER'], slug, width, height, fit, fmt,
+                                     load_source)
+    except resizer.RenderBusy:
+        abort(503, retry_after=resizer.RETRY_AFTER)
+    if path is None:
+        abort(404)
+
+    response = send_file(path, mimetype=resizer.FORMATS[fmt][1], conditional=True,
+                         etag=resizer.file_etag(path), max_age=86400)
+    response.cache_control.public = True
+    return response
+
+
 @bp.route('/wallpaper/<int:wallpaper_id>/delete', methods=['POST'])
 @login_required
 def delete_wallpaper(wallpaper_id):
@@ -171,23 +470,30 @@ def delete_wallpaper(wallpaper_id):
     if wallpaper.user_id != current_user.id and not current_user.is_admin:
         abort(403)
         
-    # Delete files from filesystem
+    # Files are shared by wallpapers with identical content (app/storage.py):
+    # they are removed once the last wallpaper using them is gone
     upload_folder = current_app.config['UPLOAD_FOLDER']
-    
-    # Delete original
-    original_path = os.path.join(upload_folder, wallpaper.filename)
-    if os.path.exists(original_path):
-        os.remove(original_path)
-        
-    # Delete thumbnail if it exists
-    if wallpaper.thumbnail_filename:
-        thumb_path = os.path.join(upload_folder, wallpaper.thumbnail_filename)
-        if os.path.exists(thumb_path):
-            os.remove(thumb_path)
+    filename = wallpaper.filename
+    derived = []
+    unreferenced = release(filename)
+    if unreferenced:
+        if wallpaper.thumbnail_filename:
+            derived.append(wallpaper.thumbnail_filename)
+        derived.extend(variant.filename for variant in wallpaper.variants)
+
+    # Drop cached on-demand resizes
+    if wallpaper.slug:
+        resizer.purge(current_app.config['RESIZE_CACHE_FOLDER'], wallpaper.slug)
             
+    wallpaper_deleted(wallpaper)
+
     # Remove from database
     db.session.delete(wallpaper)
     db.session.commit()
+
+    # Delete files from filesystem (unless an upload has reused them meanwhile)
+    if unreferenced:
+        remove_unreferenced(upload_folder, filename, derived, current_app.config['RECONCILE_GRACE'])
     
     flash('Wallpaper deleted successfully.')
     return redirect(url_for('main.user_profile', username=current_user.username))
@@ -198,18 +504,23 @@ def delete_wallpaper(wallpaper_id):
 def user_profile(username):
     user = User.query.filter_by(username=username).first_or_404()
     
-    # Increment view count if the viewer is not the user
+    # Increment view count if the viewer is not the user (buffered, no write here)
     if not current_user.is_authenticated or current_user.id != user.id:
-        user.views = (user.views or 0) + 1
-        db.session.commit()
+        view_counter.increment(user.id)
     
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     is_own_profile = current_user.is_authenticated and current_user.id == user.id
     
-    pagination = user.wallpapers.filter_by(status='active').order_by(Wallpaper.timestamp.desc()).paginate(page=page, per_page=24, error_out=False)
-    wallpapers = pagination.items
+    query = user.wallpapers.filter_by(status='active').options(selectinload(Wallpaper.tags))
+    try:
+        wallpapers, next_cursor = newest_first_page(query, cursor, per_page=24)
+    except ValueError:
+        abort(400)
 
-    next_url = url_for('main.user_profile', username=username, page=pagination.next_num) if pagination.has_next else None
-    prev_url = url_for('main.user_profile', username=username, page=pagination.prev_num) if pagination.has_prev else None
+    next_url = url_for('main.user_profile', username=username, cursor=next_cursor) if next_cursor else None
+    # Cursors only walk forwards; "back" goes to the newest page
+    prev_url = url_for('main.user_profile', username=username) if cursor else None
     
-    return render_template('profile.html', user=user, wallpapers=wallpapers, next_url=next_url, prev_url=prev_url, is_own_profile=is_own_profile)
+    views = (user.views or 0) + view_counter.pending(user.id)
+
+    return render_template('profile.html', user=user, views=views, wallpapers=wallpapers, next_url=next_url, prev_url=prev_url, is_own_profile=is_own_profile)
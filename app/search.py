@@ -0,0 +1,94 @@
+import re
+from sqlalchemy import or_, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import selectinload
+from app.extensions import db
+from app.models import Wallpaper, Tag
+from app.pagination import encode_cursor, decode_cursor, newest_first_page
+
+# Full-text search over titles and tag names.
+#
+# On SQLite this queries the wallpaper_fts FTS5 table (created and kept in sync
+# by triggers, see migration 0cbbf0be4f9f). Every term is matched as a prefix
+# and all terms must match; results are ranked by bm25 with title hits
+# weighted above tag hits. Other databases, or a DB that was built with
+# create_all() instead of migrations, fall back to the old ILIKE scan.
+#
+# Pages are keyset-paginated: FTS cursors carry the (bm25 score, rowid) of the
+# last hit, fallback cursors the (timestamp, id) of the last row.
+
+TITLE_WEIGHT = 10.0
+TAGS_WEIGHT = 5.0
+
+
+def build_match_query(query):
+    """Turns free text into an FTS5 query: every word as a quoted prefix term."""
+    terms = re.findall(r'\w+', query.lower())
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _fts_hits(match, limit, after=None):
+    params = {'match': match, 'title_weight': TITLE_WEIGHT, 'tags_weight': TAGS_WEIGHT, 'limit': limit}
+    where = ''
+    if after is not None:
+        where = "AND (score > :score OR (score = :score AND rowid > :rowid)) "
+        params['score'], params['rowid'] = after
+    rows = db.session.execute(text(
+        "SELECT rowid, bm25(wallpaper_fts, :title_weight, :tags_weight) AS score "
+        "FROM wallpaper_fts WHERE wallpaper_fts MATCH :match " + where +
+        "ORDER BY score, rowid LIMIT :limit"
+    ), params)
+    return [(row[0], row[1]) for row in rows]
+
+
+def _ilike_query(query):
+    return Wallpaper.query.filter(
+        Wallpaper.status == 'active',
+        or_(
+            Wallpaper.title.ilike(f'%{query}%'),
+            Wallpaper.tags.any(Tag.name.ilike(f'%{query}%'))
+        )
+    ).options(selectinload(Wallpaper.tags))
+
+
+def search_wallpapers(query, cursor=None, per_page=24):
+    """
+    Returns (wallpapers, next_cursor) for one page of results, best match first.
+    Fetches one extra row instead of running a COUNT. Raises ValueError for a
+    malformed cursor.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return [], None
+
+    values = decode_cursor(cursor) if cursor else None
+
+    if db.engine.dialect.name == 'sqlite' and (values is None or values[0] == 'fts'):
+        after = None
+        if values is not None:
+            if len(values) != 3:
+                raise ValueError("Invalid cursor")
+            after = (float(values[1]), int(values[2]))
+        try:
+            hits = _fts_hits(match, per_page + 1, after)
+        except OperationalError:
+            db.session.rollback()
+            hits = None
+        if hits is not None:
+            next_cursor = None
+            if len(hits) > per_page:
+                hits = hits[:per_page]
+                next_cursor = encode_cursor('fts', hits[-1][1], hits[-1][0])
+            ids = [wallpaper_id for wallpaper_id, _ in hits]
+            by_id = {w.id: w for w in Wallpaper.query.filter(Wallpaper.id.in_(ids)).options(selectinload(Wallpaper.tags))}
+            return [by_id[i] for i in ids if i in by_id], next_cursor
+
+    inner = None
+    if values is not None:
+        if values[0] != 'ts' or len(values) != 2:
+            raise ValueError("Invalid cursor")
+        inner = values[1]
+    wallpapers, next_inner = newest_first_page(_ilike_query(query), inner, per_page)
+    return wallpapers, encode_cursor('ts', next_inner) if next_inner else None
@@ -0,0 +1,115 @@
+import heapq
+import math
+from collections import defaultdict
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from app.extensions import db
+from app.models import Wallpaper, SimilarWallpaper, wallpaper_tags
+from app.hashindex import get_catalog_index, hash_to_int
+
+# Precomputed "similar wallpapers".
+#
+# Score between two wallpapers = sum of the IDF of the tags they share (rare
+# tags count more than "nature") plus a bonus for close image hashes. Each
+# wallpaper keeps its top SIMILAR_K in wallpaper_similar. Rows are refreshed
+# by the maintenance loop for wallpapers flagged similar_stale (activation,
+# retagging); a refresh also pushes the wallpaper into its neighbours' lists,
+# so one image change touches O(candidates) rows, not the whole table.
+
+SIMILAR_K = 12
+MAX_TAG_DF = 5000        # Tags on more wallpapers than this carry no signal
+MAX_NEIGHBOURS = 500     # Candidates whose lists get the symmetric update
+HASH_RADIUS = 10
+HASH_WEIGHT = 2.0
+
+
+def score_candidates(wallpaper):
+    """Returns {other_id: score} for every wallpaper sharing a useful tag or a close hash."""
+    scores = defaultdict(float)
+    tag_ids = [t.id for t in wallpaper.tags]
+
+    if tag_ids:
+        total = db.session.query(func.count(Wallpaper.id)).filter(Wallpaper.status == 'active').scalar() or 1
+        df = db.session.query(wallpaper_tags.c.tag_id, func.count()) \
+            .filter(wallpaper_tags.c.tag_id.in_(tag_ids)) \
+            .group_by(wallpaper_tags.c.tag_id)
+        idf = {tag_id: math.log((total + 1) / (count + 1)) for tag_id, count in df if count <= MAX_TAG_DF}
+        if idf:
+            rows = db.session.query(wallpaper_tags.c.wallpaper_id, wallpaper_tags.c.tag_id) \
+                .filter(wallpaper_tags.c.tag_id.in_(list(idf)), wallpaper_tags.c.wallpaper_id != wallpaper.id)
+            for other_id, tag_id in rows:
+                scores[other_id] += idf[tag_id]
+
+    if wallpaper.image_hash:
+        for other_id, distance in get_catalog_index().search(hash_to_int(wallpaper.image_hash), HASH_RADIUS):
+            if other_id != wallpaper.id:
+                scores[other_id] += HASH_WEIGHT * (1 - distance / (HASH_RADIUS + 1))
+
+    return scores
+
+
+def _active_ids(ids):
+    if not ids:
+        return set()
+    return {row[0] for row in db.session.query(Wallpaper.id).filter(Wallpaper.id.in_(ids), Wallpaper.status == 'active')}
+
+
+def refresh_similar(wallpaper):
+    """Recomputes the similar list of one wallpaper and updates its neighbours' lists."""
+    scores = score_candidates(wallpaper)
+    ranked = heapq.nlargest(MAX_NEIGHBOURS, scores.items(), key=lambda item: item[1])
+    active = _active_ids([other_id for other_id, _ in ranked])
+    ranked = [(other_id, score) for other_id, score in ranked if other_id in active and score > 0]
+
+    # Own list
+    SimilarWallpaper.query.filter_by(wallpaper_id=wallpaper.id).delete()
+    for other_id, score in ranked[:SIMILAR_K]:
+        db.session.add(SimilarWallpaper(wallpaper_id=wallpaper.id, similar_id=other_id, score=score))
+
+    # Lists that currently include this wallpaper are rebuilt below; owners
+    # that end up without it have a free slot and get recomputed later.
+    previous_owners = {row[0] for row in db.session.query(SimilarWallpaper.wallpaper_id)
+                       .filter(SimilarWallpaper.similar_id == wallpaper.id)}
+    SimilarWallpaper.query.filter_by(similar_id=wallpaper.id).delete()
+
+    neighbour_ids = [other_id for other_id, _ in ranked]
+    lists = defaultdict(list)
+    if neighbour_ids:
+        for row in SimilarWallpaper.query.filter(SimilarWallpaper.wallpaper_id.in_(neighbour_ids)):
+            lists[row.wallpaper_id].append(row)
+
+    readded = set()
+    for other_id, score in ranked:
+        rows = lists[other_id]
+        if len(rows) >= SIMILAR_K:
+            weakest = min(rows, key=lambda row: row.score)
+            if weakest.score >= score:
+                continue
+            db.session.delete(weakest)
+        db.session.add(SimilarWallpaper(wallpaper_id=other_id, similar_id=wallpaper.id, score=score))
+        readded.add(other_id)
+
+    lost = previous_owners - readded
+    if lost:
+        Wallpaper.query.filter(Wallpaper.id.in_(lost)).update({'similar_stale': True}, synchronize_session=False)
+
+    wallpaper.similar_stale = False
+
+
+def forget_wallpaper(wallpaper_id):
+    """Drops a deleted wallpaper from every list; lists that lose an entry are recomputed later."""
+    owners = [row[0] for row in db.session.query(SimilarWallpaper.wallpaper_id)
+              .filter(SimilarWallpaper.similar_id == wallpaper_id)]
+    SimilarWallpaper.query.filter(
+        (SimilarWallpaper.wallpaper_id == wallpaper_id) | (SimilarWallpaper.similar_id == wallpaper_id)
+    ).delete(synchronize_session=False)
+    if owners:
+        Wallpaper.query.filter(Wallpaper.id.in_(owners)).update({'similar_stale': True}, synchronize_session=False)
+
+
+def get_similar(wallpaper, limit=4):
+    """The detail page's read path: K ids from the side table, best first."""
+    return Wallpaper.query.join(SimilarWallpaper, SimilarWallpaper.similar_id == Wallpaper.id) \
+        .filter(SimilarWallpaper.wallpaper_id == wallpaper.id, Wallpaper.status == 'active') \
+        .options(selectinload(Wallpaper.tags)) \
+        .order_by(SimilarWallpaper.score.desc()).limit(limit).all()
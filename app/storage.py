@@ -0,0 +1,211 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import Blob
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock around blob deletion
+    fcntl = None
+
+# Content-addressed upload storage.
+#
+# A stored original lives at UPLOAD_FOLDER/ab/cd/<sha256>.<ext>, where abcd are
+# the first hex digits of the SHA-256 of its bytes, so no directory grows past
+# a few entries and identical files are stored once. Its thumbnail and
+# derivatives sit next to it (ab/cd/thumb_<sha256>.webp, ab/cd/w960_...).
+# Wallpaper.filename is that relative path; a row in `blob` counts how many
+# wallpapers use it, and the files are only deleted when the count drops to 0.
+#
+# Wallpapers stored before this layout keep their flat filenames and have no
+# blob row; `flask migrate-storage` moves them over.
+#
+# A reference is only committed some time after a pool worker found the file
+# already stored (store_file touches it), so dropping the last reference does
+# not by itself make the file safe to unlink. remove_unreferenced() takes
+# BLOB_LOCK (also held by store_file while it reuses a file), re-checks the
+# blob row and leaves files that were reused within the grace period to the
+# reconciler (app/reconcile.py).
+
+BLOCK_SIZE = 1024 * 1024
+BLOB_LOCK = '.blobs.lock'
+
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def blob_filename(sha256, ext):
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}.{ext.lower()}"
+
+
+def derived_filename(filename, prefix, ext='webp'):
+    """Name of a file derived from a stored original: same directory, prefixed stem."""
+    directory, base = os.path.split(filename)
+    stem = base.rsplit('.', 1)[0]
+    name = f"{prefix}{stem}.{ext}"
+    return f"{directory}/{name}" if directory else name
+
+
+def store_file(source_path, upload_folder, ext, move=False):
+    """
+    Puts a file into the content-addressed layout (copy, or rename with move=True).
+    Safe to run in a pool worker. Returns (filename, sha256, size, created);
+    created is False when identical content was already stored.
+    """
+    sha256 = file_sha256(source_path)
+    filename = blob_filename(sha256, ext)
+    dest_path = os.path.join(upload_folder, filename)
+    size = os.path.getsize(source_path)
+
+    with blob_lock(upload_folder):
+        if os.path.exists(dest_path):
+            if move:
+                os.remove(source_path)
+            # Until the caller commits its reference the file may look orphaned;
+            # a fresh mtime keeps it inside the reconciler's grace period (and
+            # stops remove_unreferenced from deleting it)
+            os.utime(dest_path)
+            return filename, sha256, size, False
+
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    if move:
+        os.replace(source_path, dest_path)
+    else:
+        _copy_into_place(source_path, dest_path)
+    return filename, sha256, size, True
+
+
+@contextmanager
+def blob_lock(upload_folder):
+    """Exclusive lock (across processes) between reusing a stored file and deleting one."""
+    os.makedirs(upload_folder, exist_ok=True)
+    with open(os.path.join(upload_folder, BLOB_LOCK), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _copy_into_place(source_path, dest_path):
+    # A hard link when source and store share a filesystem, a copy otherwise;
+    # either way the final name only appears once the content is complete
+    tmp_path = os.path.join(os.path.dirname(dest_path), f".tmp_{uuid.uuid4().hex}")
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+
+
+def add_ref(sha256, filename, size):
+    """Counts one more wallpaper using the blob (creating its row on first use)."""
+    bumped = db.session.execute(
+        update(Blob).where(Blob.hash == sha256).values(refcount=Blob.refcount + 1)
+    ).rowcount
+    if bumped:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Blob(hash=sha256, filename=filename, size=size, refcount=1))
+    except IntegrityError:
+        # Another process created it in the meantime
+        db.session.execute(update(Blob).where(Blob.hash == sha256).values(refcount=Blob.refcount + 1))
+
+
+def release(filename):
+    """
+    Drops one reference to the blob stored at filename. Returns True when no
+    wallpaper uses the file any more, i.e. the caller should delete it (and
+    its thumbnail and derivatives) once the transaction has committed.
+    Legacy flat files have no blob row and always belong to one wallpaper.
+    """
+    blob = Blob.query.filter_by(filename=filename).first()
+    if blob is None:
+        return True
+    db.session.execute(update(Blob).where(Blob.hash == blob.hash).values(refcount=Blob.refcount - 1))
+    db.session.refresh(blob)
+    if blob.refcount <= 0:
+        db.session.delete(blob)
+        return True
+    return False
+
+
+def remove_unreferenced(upload_folder, filename, derived=(), grace=0):
+    """
+    Deletes a stored original and its derived files once the release of its
+    last reference has been committed. Nothing is deleted if the blob has been
+    referenced again in the meantime, or if the original was stored or reused
+    less than `grace` seconds ago (a reference may be about to be committed);
+    the reconciler removes those later if they stay orphaned.
+    Returns True if the files were deleted.
+    """
+    with blob_lock(upload_folder):
+        if Blob.query.filter_by(filename=filename).first() is not None:
+            return False
+        try:
+            stat = os.stat(os.path.join(upload_folder, filename))
+            if time.time() - max(stat.st_mtime, stat.st_ctime) < grace:
+                return False
+        except FileNotFoundError:
+            pass
+        for name in (filename, *derived):
+            path = os.path.join(upload_folder, name)
+            if os.path.exists(path):
+                os.remove(path)
+    return True
+
+
+def _place_derived(upload_folder, old, new):
+    """Gives a derived file its content-addressed name (unless that already exists)."""
+    new_path = os.path.join(upload_folder, new)
+    if os.path.exists(new_path):
+        return new
+    old_path = os.path.join(upload_folder, old)
+    if not os.path.exists(old_path):
+        return None
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    _copy_into_place(old_path, new_path)
+    return new
+
+
+def migrate_file(upload_folder, filename, thumbnail, variants):
+    """
+    Links one legacy flat file and its thumbnail/derivatives [(width, height,
+    filename)] into the content-addressed layout. The old names are left in
+    place for the caller to delete after its commit. Runs in a pool worker.
+    Returns None if the original is missing.
+    """
+    path = os.path.join(upload_folder, filename)
+    if not os.path.exists(path):
+        return None
+    ext = filename.rsplit('.', 1)[1] if '.' in filename else 'jpg'
+    new_filename, sha256, size, _ = store_file(path, upload_folder, ext)
+    return {
+        'filename': new_filename,
+        'sha256': sha256,
+        'size': size,
+        'thumbnail': _place_derived(upload_folder, thumbnail, derived_filename(new_filename, 'thumb_')) if thumbnail else None,
+        'variants': {old: _place_derived(upload_folder, old, derived_filename(new_filename, f"w{width}_"))
+                     for width, _, old in variants},
+    }
+
+
+def check_blob(upload_folder, filename, sha256):
+    """'ok', 'missing' or 'corrupt' for one stored blob. Runs in a pool worker."""
+    path = os.path.join(upload_folder, filename)
+    if not os.path.exists(path):
+        return 'missing'
+    return 'ok' if file_sha256(path) == sha256 else 'corrupt'
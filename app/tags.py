@@ -0,0 +1,165 @@
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import Tag, wallpaper_tags
+
+# Tag resolution shared by uploads, the pipeline, the importer and the scripts.
+#
+# Names are turned into ids a batch at a time: ids this process has seen come
+# from a bounded LRU, the rest from one IN query, and whatever is still missing
+# is created with a single INSERT ... ON CONFLICT DO NOTHING RETURNING. A tag
+# created concurrently by another process makes its row conflict instead of
+# failing; those few names are read back with one more SELECT. Tags are never
+# deleted, but the transaction that created one can still roll back, so ids
+# read or created in a transaction are only cached once it commits.
+#
+# Wallpapers get their tags through the association table directly (insert or
+# ignore), so attaching ten tags is one statement instead of loading ten Tag
+# objects.
+#
+# ON CONFLICT DO NOTHING exists on SQLite and PostgreSQL; other databases
+# insert only the rows a SELECT did not find, inside a savepoint, and look
+# again if a concurrent insert wins.
+
+MAX_CACHED_TAGS = 4096
+MAX_NAME_LENGTH = 64  # Tag.name
+
+_ids = OrderedDict()
+_ids_lock = threading.Lock()
+
+
+def normalize(names):
+    """Stripped, lowercased, de-duplicated names in their original order."""
+    seen = {}
+    for name in names:
+        name = (name or '').strip().lower()[:MAX_NAME_LENGTH]
+        if name:
+            seen.setdefault(name, None)
+    return list(seen)
+
+
+def parse_tags(tags_str):
+    """Names from a comma-separated form field."""
+    return normalize((tags_str or '').split(','))
+
+
+def _cached(names):
+    found = {}
+    with _ids_lock:
+        for name in names:
+            tag_id = _ids.get(name)
+            if tag_id is not None:
+                _ids.move_to_end(name)
+                found[name] = tag_id
+    return found
+
+
+def _remember(ids):
+    with _ids_lock:
+        _ids.update(ids)
+        while len(_ids) > MAX_CACHED_TAGS:
+            _ids.popitem(last=False)
+
+
+def _remember_on_commit(ids):
+    db.session.info.setdefault('tag_ids', {}).update(ids)
+
+
+def _commit_ids(session):
+    ids = session.info.pop('tag_ids', None)
+    if ids:
+        _remember(ids)
+
+
+def _drop_ids(session):
+    session.info.pop('tag_ids', None)
+
+
+event.listen(db.session, 'after_commit', _commit_ids)
+event.listen(db.session, 'after_rollback', _drop_ids)
+
+
+def _upsert_dialect():
+    """The dialect module whose insert() has on_conflict_do_nothing, or None."""
+    return {'sqlite': sqlite, 'postgresql': postgresql}.get(db.engine.dialect.name)
+
+
+def _create_tags(names):
+    """Inserts the tags that don't exist yet. Returns {name: id} of those this call created."""
+    dialect = _upsert_dialect()
+    if dialect is not None:
+        stmt = dialect.insert(Tag).values([{'name': name} for name in names]) \
+            .on_conflict_do_nothing(index_elements=['name']).returning(Tag.name, Tag.id)
+        return dict(db.session.execute(stmt).all())
+    created = []
+    for name in names:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(Tag.__table__.insert().values(name=name))
+            created.append(name)
+        except IntegrityError:
+            continue  # Created concurrently; the caller reads it back
+    if not created:
+        return {}
+    return dict(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(created)))
+
+
+def tag_ids(names):
+    """Returns {name: id} for the (normalized) names, creating the missing tags."""
+    names = normalize(names)
+    ids = _cached(names)
+    missing = [name for name in names if name not in ids]
+    if missing:
+        found = dict(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(missing)))
+        to_create = [name for name in missing if name not in found]
+        if to_create:
+            found.update(_create_tags(to_create))
+            raced = [name for name in to_create if name not in found]
+            if raced:
+                found.update(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(raced)))
+        _remember_on_commit(found)
+        ids.update(found)
+    return ids
+
+
+def attach_tags(wallpaper, names):
+    """
+    Adds the named tags to a wallpaper (already attached ones are ignored).
+    Flushes the session first, since the rows go straight into wallpaper_tags.
+    Returns the number of names given.
+    """
+    ids = tag_ids(names)
+    if not ids:
+        return 0
+    db.session.flush()
+    link_tags([(wallpaper.id, tag_id) for tag_id in ids.values()])
+    db.session.expire(wallpaper, ['tags'])
+    return len(ids)
+
+
+def link_tags(pairs):
+    """Inserts (wallpaper_id, tag_id) pairs into wallpaper_tags in one statement, skipping existing ones."""
+    if not pairs:
+        return
+    dialect = _upsert_dialect()
+    if dialect is not None:
+        db.session.execute(dialect.insert(wallpaper_tags).on_conflict_do_nothing(),
+                           [{'wallpaper_id': w, 'tag_id': t} for w, t in pairs])
+        return
+    pairs = set(pairs)
+    columns = tuple_(wallpaper_tags.c.wallpaper_id, wallpaper_tags.c.tag_id)
+    for _ in range(2):  # Once more if a concurrent insert of the same pair wins
+        existing = set(db.session.query(wallpaper_tags.c.wallpaper_id, wallpaper_tags.c.tag_id)
+                       .filter(columns.in_(list(pairs))).all())
+        missing = [{'wallpaper_id': w, 'tag_id': t} for w, t in pairs - existing]
+        if not missing:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.execute(wallpaper_tags.insert(), missing)
+            return
+        except IntegrityError:
+            continue
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process guard on a session
+    fcntl = None
+
+# Resumable chunked uploads.
+#
+# A session is two files in QUARANTINE_FOLDER: upload_<id>.part (the bytes
+# received so far; its size *is* the offset) and upload_<id>.json (who, what
+# file, declared size and hash, title, tags). Chunks are streamed from the
+# request body to the .part file in fixed-size blocks, so a worker's memory
+# does not depend on the file size, and a dropped connection only loses the
+# chunk in flight. The SHA-256 of the content is updated as blocks arrive; the
+# running hash object is kept per process and rebuilt from the partial file if
+# the next chunk lands on another worker. On finalize the .part file becomes a
+# normal pending_<uuid>.<ext> quarantine file and a pending Wallpaper row, under
+# the same lock as a chunk write, so a second finalize gets 409 or 404.
+
+BLOCK_SIZE = 1024 * 1024
+SESSION_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+MAX_CACHED_HASHERS = 64
+
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """A request the session can't accept; carries the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def part_path(quarantine_folder, upload_id):
+    return os.path.join(quarantine_folder, f"upload_{upload_id}.part")
+
+
+def meta_path(quarantine_folder, upload_id):
+    return os.path.join(quarantine_folder, f"upload_{upload_id}.json")
+
+
+def create_session(quarantine_folder, meta):
+    upload_id = uuid.uuid4().hex
+    meta = dict(meta, created_at=time.time())
+    open(part_path(quarantine_folder, upload_id), 'wb').close()
+    tmp = meta_path(quarantine_folder, upload_id) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path(quarantine_folder, upload_id))
+    return upload_id
+
+
+def load_session(quarantine_folder, upload_id):
+    """Returns the session metadata, or None if there is no such session."""
+    if not SESSION_ID_RE.match(upload_id or ''):
+        return None
+    try:
+        with open(meta_path(quarantine_folder, upload_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def open_sessions(quarantine_folder, user_id):
+    """Metadata of the user's sessions that are neither finalized nor expired."""
+    sessions = []
+    for name in os.listdir(quarantine_folder):
+        if name.startswith('upload_') and name.endswith('.json'):
+            meta = load_session(quarantine_folder, name[len('upload_'):-len('.json')])
+            if meta is not None and meta['user_id'] == user_id:
+                sessions.append(meta)
+    return sessions
+
+
+def current_offset(quarantine_folder, upload_id):
+    try:
+        return os.path.getsize(part_path(quarantine_folder, upload_id))
+    except FileNotFoundError:
+        return None
+
+
+def delete_session(quarantine_folder, upload_id):
+    with _hashers_lock:
+        _hashers.pop(upload_id, None)
+    for path in (part_path(quarantine_folder, upload_id), meta_path(quarantine_folder, upload_id)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _take_hasher(upload_id, path, offset):
+    """The running SHA-256 of the first `offset` bytes; rehashes from disk if this process doesn't have it."""
+    with _hashers_lock:
+        cached = _hashers.pop(upload_id, None)
+    if cached is not None and cached[0] == offset:
+        return cached[1]
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        remaining = offset
+        while remaining:
+            block = f.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def _keep_hasher(upload_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, hasher)
+        while len(_hashers) > MAX_CACHED_HASHERS:
+            _hashers.popitem(last=False)
+
+
+class _SessionLock:
+    """Exclusive, non-blocking flock on the .part file: one writer per session."""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __enter__(self):
+        try:
+            self.f = open(self.path, 'r+b')
+        except FileNotFoundError:
+            raise UploadError("Upload not found", status=404)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.f.close()
+                raise UploadError("Another request is writing to this upload", status=409)
+        # A finalize that held the lock before us may have moved the file away
+        try:
+            moved = os.stat(self.path).st_ino != os.fstat(self.f.fileno()).st_ino
+        except FileNotFoundError:
+            moved = True
+        if moved:
+            self.f.close()
+            raise UploadError("Upload not found", status=404)
+        return self.f
+
+    def __exit__(self, *exc):
+        # Closing the file releases the lock
+        self.f.close()
+
+
+def append_chunk(quarantine_folder, upload_id, meta, offset, stream):
+    """
+    Streams one chunk from `stream` to the session's partial file, starting at
+    `offset` (which must be the current size). Returns the new offset.
+    """
+    path = part_path(quarantine_folder, upload_id)
+    if not os.path.exists(path):
+        raise UploadError("Upload not found", status=404)
+
+    with _SessionLock(path) as f:
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise UploadError("Offset mismatch", status=409, offset=current)
+
+        hasher = _take_hasher(upload_id, path, current)
+        remaining = meta['size'] - current
+        written = 0
+        f.seek(current)
+        try:
+            while True:
+                block = stream.read(BLOCK_SIZE)
+                if not block:
+                    break
+                if written + len(block) > remaining:
+                    raise UploadError("Chunk goes past the declared size", status=413)
+                f.write(block)
+                hasher.update(block)
+                written += len(block)
+        finally:
+            # Whatever made it to disk counts, even if the client went away
+            f.flush()
+            f.truncate(current + written)
+            _keep_hasher(upload_id, current + written, hasher)
+
+    return current + written
+
+
+@contextmanager
+def finalizing(quarantine_folder, upload_id):
+    """
+    Locks the session for finalizing and yields (size, sha256) of the partial
+    file (cached hash state when available). The caller moves the file and
+    inserts the row inside the block. Raises UploadError (409 while another
+    request holds the session, 404 once it is gone).
+    """
+    path = part_path(quarantine_folder, upload_id)
+    with _SessionLock(path) as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher = _take_hasher(upload_id, path, size)
+        _keep_hasher(upload_id, size, hasher)
+        yield size, hasher.hexdigest()
+
+
+def save_stream(stream, dest_path):
+    """Copies a file-like object to dest_path block by block. Returns its SHA-256."""
+    hasher = hashlib.sha256()
+    with open(dest_path, 'wb') as f:
+        while True:
+            block = stream.read(BLOCK_SIZE)
+            if not block:
+                break
+            f.write(block)
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def expire_sessions(quarantine_folder, max_age):
+    """Deletes upload sessions not touched for max_age seconds. Returns how many."""
+    now = time.time()
+    expired = 0
+    for name in os.listdir(quarantine_folder):
+        if not (name.startswith('upload_') and name.endswith('.json')):
+            continue
+        upload_id = name[len('upload_'):-len('.json')]
+        paths = [meta_path(quarantine_folder, upload_id), part_path(quarantine_folder, upload_id)]
+        try:
+            last_touched = max(os.path.getmtime(p) for p in paths if os.path.exists(p))
+        except ValueError:
+            continue
+        if now - last_touched > max_age:
+            delete_session(quarantine_folder, upload_id)
+            expired += 1
+    return expired
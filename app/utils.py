@@ -1,10 +1,8 @@
 import os
 import uuid
-import base64
-import requests
-import re
 from PIL import Image
 from flask import current_app
+from app.storage import derived_filename
 
 def generate_random_filename(filename):
     """
@@ -16,12 +14,17 @@ def generate_random_filename(filename):
         return f"{uuid.uuid4().hex}"
     return f"{uuid.uuid4().hex}.{ext}"
 
-def generate_thumbnail(filename, size=(300, 300)):
+def generate_slug():
+    """A new random public slug (stored filenames are content hashes, shared by identical files)."""
+    return uuid.uuid4().hex
+
+def generate_thumbnail(filename, size=(300, 300), upload_folder=None):
     """
     Generates a thumbnail for the given filename.
     Returns the thumbnail filename if successful, None otherwise.
+    Pass upload_folder explicitly when running outside an app context (e.g. in a pool worker).
     """
-    upload_folder = current_app.config['UPLOAD_FOLDER']
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
     file_path = os.path.join(upload_folder, filename)
     
     if not os.path.exists(file_path):
@@ -49,9 +52,8 @@ def generate_thumbnail(filename, size=(300, 300)):
             img = img.crop((left, top, right, bottom))
             img.thumbnail(size, Image.Resampling.LANCZOS)
             
-            # Use .webp extension for better efficiency
-            base_filename = filename.rsplit('.', 1)[0]
-            thumb_filename = f"thumb_{base_filename}.webp"
+            # Use .webp extension for better efficiency (next to the original)
+            thumb_filename = derived_filename(filename, 'thumb_')
             thumb_path = os.path.join(upload_folder, thumb_filename)
             img.save(thumb_path, "WEBP", quality=60)
             
@@ -61,6 +63,38 @@ def generate_thumbnail(filename, size=(300, 300)):
         print(f"Error generating thumbnail for {filename}: {e}")
         return None
 
+def generate_derivatives(filename, widths, upload_folder=None, quality=80):
+    """
+    Generates downscaled WebP copies of the image for responsive <img srcset>.
+    Widths at or above the original width are skipped (no upscaling).
+    Returns a list of (width, height, derivative_filename).
+    """
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+    file_path = os.path.join(upload_folder, filename)
+
+    if not os.path.exists(file_path):
+        return []
+
+    derivatives = []
+    try:
+        with Image.open(file_path) as img:
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGB")
+            # Largest first, each step resized from the previous one (cheaper than from the original)
+            current = img
+            for width in sorted(widths, reverse=True):
+                if width >= img.width:
+                    continue
+                height = round(img.height * width / img.width)
+                current = current.resize((width, height), Image.Resampling.LANCZOS)
+                variant_filename = derived_filename(filename, f"w{width}_")
+                current.save(os.path.join(upload_folder, variant_filename), "WEBP", quality=quality)
+                derivatives.append((width, height, variant_filename))
+    except Exception as e:
+        print(f"Error generating derivatives for {filename}: {e}")
+
+    return sorted(derivatives)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -74,12 +108,12 @@ def get_system_load():
         # Fallback for systems without getloadavg
         return 0.0
 
-def get_image_hash(filename):
+def get_image_hash(filename, upload_folder=None):
     """
     Generates a simple average hash for the image to detect near-duplicates.
-    Returns the hex string of the hash.
+    Returns the hash as a zero-padded 16-char hex string (64 bits).
     """
-    upload_folder = current_app.config['UPLOAD_FOLDER']
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
     file_path = os.path.join(upload_folder, filename)
     
     if not os.path.exists(file_path):
@@ -94,7 +128,7 @@ def get_image_hash(filename):
             # Bitstring: 1 if pixel > avg, else 0
             bits = "".join(['1' if p > avg else '0' for p in pixels])
             # Convert bits to hex
-            return hex(int(bits, 2))[2:]
+            return f"{int(bits, 2):016x}"
     except Exception as e:
         print(f"Error hashing image {filename}: {e}")
         return None
@@ -119,52 +153,10 @@ def get_ai_tags(file_path):
     """
     Uses Ollama + Moondream to generate tags for an image.
     Expects an absolute path to the image file.
+    Goes through the shared pooled client in app.ollama.
     """
     if not os.path.exists(file_path):
         return []
-    
-    try:
-        with open(file_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        # Step 1: Get description from Moondream
-        response = requests.post('http://localhost:11434/api/generate', json={
-            "model": "moondream",
-            "prompt": "Describe this image in detail.",
-            "images": [encoded_string],
-            "stream": False
-        }, timeout=300)
-        
-        if response.status_code != 200:
-            return []
-            
-        description = response.json().get('response', '')
-        if not description:
-            return []
-            
-        # Step 2: Extract tags using Gemma
-        response = requests.post('http://localhost:11434/api/generate', json={
-            "model": "gemma3:1b",
-            "prompt": f"Extract 5-10 descriptive, one-word tags from this description: \"{description}\". Reply ONLY with a comma-separated list of tags. No other text.",
-            "stream": False
-        }, timeout=60)
-        
-        if response.status_code == 200:
-            text = response.json().get('response', '')
-            # Clean up and split
-            tags = [t.strip().lower() for t in text.split(',') if t.strip()]
-            
-            # Final sanitize: alphanumeric, reasonable length, no stop words
-            stop_words = {'a', 'an', 'the', 'and', 'with', 'stands', 'out', 'against', 'its', 'their', 'this', 'that', 'from', 'into', 'for', 'are', 'was', 'were'}
-            final_tags = []
-            for t in tags:
-                # Remove punctuation from tag
-                t = re.sub(r'[^\w\s]', '', t)
-                if len(t) > 2 and len(t) < 30 and not any(c.isdigit() for c in t) and t not in stop_words:
-                    final_tags.append(t)
-            
-            return list(dict.fromkeys(final_tags))[:10]
-    except Exception as e:
-        print(f"Error in two-step AI tagging for {file_path}: {e}")
-    
-    return []
+
+    from app.ollama import get_client
+    return get_client().tag_file(file_path)
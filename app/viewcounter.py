@@ -0,0 +1,79 @@
+import atexit
+import os
+import threading
+import time
+from collections import Counter
+from sqlalchemy import bindparam, func
+
+# Write-behind profile view counter.
+#
+# Page views only bump an in-memory Counter; a daemon thread turns the
+# accumulated increments into one executemany UPDATE every VIEW_FLUSH_INTERVAL
+# seconds. Each gunicorn worker keeps its own buffer and the UPDATE is relative
+# (views = views + n), so workers never overwrite each other's counts.
+
+
+class ViewCounter:
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 10
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('VIEW_FLUSH_INTERVAL', 10)
+        atexit.register(self.flush)
+
+    def increment(self, user_id, amount=1):
+        with self._lock:
+            self._ensure_flusher()
+            self._pending[user_id] += amount
+
+    def pending(self, user_id):
+        """Views counted by this process but not flushed yet."""
+        return self._pending.get(user_id, 0)
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, Counter()
+        if not batch or self.app is None:
+            return 0
+
+        from app.extensions import db
+        from app.models import User
+        users = User.__table__
+        stmt = users.update().where(users.c.id == bindparam('uid')) \
+            .values(views=func.coalesce(users.c.views, 0) + bindparam('n'))
+        try:
+            with self.app.app_context():
+                db.session.execute(stmt, [{'uid': uid, 'n': n} for uid, n in batch.items()])
+                db.session.commit()
+        except Exception as e:
+            # Keep the counts for the next attempt (e.g. "database is locked")
+            with self._lock:
+                self._pending.update(batch)
+            print(f"View counter flush failed: {e}")
+            return 0
+        return sum(batch.values())
+
+    def _ensure_flusher(self):
+        # Called with the lock held. A forked worker inherits the parent's
+        # buffer and a dead thread handle, so start fresh after a fork.
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        if self._pid is not None and self._pid != pid:
+            self._pending = Counter()
+        self._pid = pid
+        self._thread = threading.Thread(target=self._run, daemon=True, name='view-counter')
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
@@ -0,0 +1,118 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+import time
+
+# Event-driven wakeup of the maintenance loops.
+#
+# A loop with nothing to do waits on a Wakeup instead of sleeping, with the
+# old poll interval only as a safety net. notify_quarantine() is called by the
+# upload routes once the pending row is committed: it sets the in-process
+# event (run_maintenance_loop inside the web worker) and touches a marker file
+# in QUARANTINE_FOLDER. A separately running daemon watches that marker with
+# inotify (or, where inotify is unavailable, by checking its mtime every
+# second), so it wakes as soon as the commit is visible, never before.
+
+MARKER = '.wakeup'
+STAT_POLL_INTERVAL = 1.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')  # struct inotify_event: wd, mask, cookie, len
+
+
+class Wakeup:
+    def __init__(self):
+        self.event = threading.Event()
+        self._watched = set()
+        self._lock = threading.Lock()
+
+    def notify(self):
+        self.event.set()
+
+    def wait(self, timeout):
+        """Blocks until notified or timeout. Returns True when woken by a notification."""
+        woken = self.event.wait(timeout)
+        self.event.clear()
+        return woken
+
+    def watch(self, folder):
+        """Also wake on touches of the marker file in folder (from other processes)."""
+        with self._lock:
+            if folder in self._watched:
+                return
+            self._watched.add(folder)
+        target = _watch_inotify if _inotify_available() else _watch_mtime
+        thread = threading.Thread(target=target, args=(folder, self), daemon=True)
+        thread.start()
+
+
+def touch_marker(folder):
+    path = os.path.join(folder, MARKER)
+    try:
+        with open(path, 'a'):
+            pass
+        os.utime(path)
+    except OSError:
+        pass
+
+
+_libc = None
+
+
+def _inotify_available():
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            _libc.inotify_init1
+        except (OSError, AttributeError):
+            _libc = False
+    return bool(_libc)
+
+
+def _watch_inotify(folder, wakeup):
+    fd = _libc.inotify_init1(IN_CLOEXEC)
+    if fd < 0 or _libc.inotify_add_watch(fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_TO) < 0:
+        if fd >= 0:
+            os.close(fd)
+        return _watch_mtime(folder, wakeup)
+    marker = MARKER.encode()
+    while True:
+        data = os.read(fd, 4096)
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name == marker:
+                wakeup.notify()
+
+
+def _watch_mtime(folder, wakeup):
+    path = os.path.join(folder, MARKER)
+    last = first = object()
+    while True:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if last is not first and mtime != last:
+            wakeup.notify()
+        last = mtime
+        time.sleep(STAT_POLL_INTERVAL)
+
+
+quarantine_wakeup = Wakeup()
+tagging_wakeup = Wakeup()
+
+
+def notify_quarantine(quarantine_folder):
+    """New pending wallpapers are committed: wake the quarantine stage here and in other processes."""
+    quarantine_wakeup.notify()
+    touch_marker(quarantine_folder)
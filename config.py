@@ -9,6 +9,92 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'app/static/uploads')
     QUARANTINE_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'app/static/quarantine')
     # MAX_CONTENT_LENGTH = 300 * 1024 * 1024  # Disabled to allow admin bypass in route
+    # Limits for non-admins: bytes and files per multipart upload, which also
+    # bound a user's open resumable sessions (at most UPLOAD_MAX_SESSIONS, and
+    # UPLOAD_MAX_BYTES declared in total), and how long an abandoned session is
+    # kept in quarantine
+    UPLOAD_MAX_BYTES = 300 * 1024 * 1024
+    UPLOAD_MAX_FILES = int(os.environ.get('UPLOAD_MAX_FILES') or 10)
+    UPLOAD_MAX_SESSIONS = int(os.environ.get('UPLOAD_MAX_SESSIONS') or UPLOAD_MAX_FILES)
+    UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL') or 24 * 3600)
+
+    # Quarantine pipeline: pool size (defaults to core count) and rows claimed per batch
+    QUARANTINE_WORKERS = int(os.environ.get('QUARANTINE_WORKERS') or os.cpu_count() or 1)
+    QUARANTINE_BATCH_SIZE = int(os.environ.get('QUARANTINE_BATCH_SIZE') or QUARANTINE_WORKERS * 2)
+    # Load governor (app/governor.py): background concurrency is halved when CPU
+    # pressure (PSI some avg10, percent) or this process's web latency (seconds)
+    # goes above these, and grows back while the cgroup quota has headroom
+    GOVERNOR_PRESSURE_LIMIT = float(os.environ.get('GOVERNOR_PRESSURE_LIMIT') or 10.0)
+    WEB_LATENCY_TARGET = float(os.environ.get('WEB_LATENCY_TARGET') or 0.5)
+    # One maintenance runner per host: whoever holds this lock (the standalone
+    # daemon or one web worker's thread) does the background work; the others
+    # stand by and take over when it exits. A claimed row whose runner died is
+    # claimed again after CLAIM_LEASE seconds.
+    MAINTENANCE_LOCK_FILE = os.environ.get('MAINTENANCE_LOCK_FILE') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache/maintenance.lock')
+    CLAIM_LEASE = int(os.environ.get('CLAIM_LEASE') or 900)
+    # AI tagging stage: concurrent model calls, independent of the quarantine pool
+    TAGGING_WORKERS = int(os.environ.get('TAGGING_WORKERS') or 2)
+    OLLAMA_URL = os.environ.get('OLLAMA_URL') or 'http://localhost:11434'
+    # Responsive derivatives (WebP) generated on activation, for srcset
+    DERIVATIVE_WIDTHS = tuple(int(w) for w in (os.environ.get('DERIVATIVE_WIDTHS') or '480,960,1600,2560').split(','))
+    # Uploaded files are served by /uploads/<filename> with immutable caching.
+    # SENDFILE_BACKEND hands the bytes to the front proxy instead of a worker:
+    # 'nginx' sends X-Accel-Redirect: SENDFILE_PREFIX + filename (an internal
+    # location aliased to UPLOAD_FOLDER), 'apache' sends X-Sendfile with the path.
+    SENDFILE_BACKEND = os.environ.get('SENDFILE_BACKEND') or None
+    SENDFILE_PREFIX = os.environ.get('SENDFILE_PREFIX') or '/_uploads/'
+    UPLOAD_MAX_AGE = 365 * 24 * 3600
+    # On-demand resizes (/img/<slug>/<w>x<h>.<fmt>): LRU disk cache and its size bound
+    RESIZE_CACHE_FOLDER = os.environ.get('RESIZE_CACHE_FOLDER') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache/resized')
+    RESIZE_CACHE_MAX_BYTES = int(os.environ.get('RESIZE_CACHE_MAX_BYTES') or 2 * 1024 ** 3)
+    RESIZE_MAX_DIMENSION = int(os.environ.get('RESIZE_MAX_DIMENSION') or 7680)
+    # Concurrent renders per worker process; cache misses beyond it get a 503 + Retry-After
+    RESIZE_MAX_RENDERS = int(os.environ.get('RESIZE_MAX_RENDERS') or 2)
+    # Rendered feed pages, per process, invalidated by bumping the catalog version file
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES') or 32 * 1024 * 1024)
+    CATALOG_VERSION_FILE = os.environ.get('CATALOG_VERSION_FILE') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache/catalog.version')
+    # Orphan file reconciliation (app/reconcile.py): files younger than the grace
+    # period are never deleted, the state file remembers unchanged directories
+    # (all are read again every RECONCILE_FULL_INTERVAL seconds), and every
+    # deletion is appended to the journal
+    RECONCILE_GRACE = int(os.environ.get('RECONCILE_GRACE') or 3600)
+    RECONCILE_FULL_INTERVAL = int(os.environ.get('RECONCILE_FULL_INTERVAL') or 24 * 3600)
+    RECONCILE_STATE_FILE = os.environ.get('RECONCILE_STATE_FILE') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache/reconcile.state')
+    RECONCILE_JOURNAL = os.environ.get('RECONCILE_JOURNAL') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache/reconcile.journal')
+    # Near-duplicate detection: max Hamming distance between average hashes,
+    # and what to do with an upload that matches ('flag' or 'reject')
+    DUPLICATE_DISTANCE = int(os.environ.get('DUPLICATE_DISTANCE') or 4)
+    DUPLICATE_ACTION = os.environ.get('DUPLICATE_ACTION') or 'flag'
+
+    # Profile views are buffered in memory and written in batches this often (seconds)
+    VIEW_FLUSH_INTERVAL = int(os.environ.get('VIEW_FLUSH_INTERVAL') or 10)
+
+    # Prometheus metrics (/metrics): each process writes its counters to a file
+    # in this folder every METRICS_FLUSH_INTERVAL seconds and a scrape sums them
+    METRICS_FOLDER = os.environ.get('METRICS_FOLDER') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache/metrics')
+    METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL') or 10)
+    # /metrics answers only a scraper sending "Authorization: Bearer METRICS_TOKEN"
+    # or connecting from one of METRICS_ALLOWED_IPS (comma-separated; behind a
+    # reverse proxy every client appears as the proxy's address). Unset: 404.
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+    METRICS_ALLOWED_IPS = tuple(ip.strip() for ip in (os.environ.get('METRICS_ALLOWED_IPS') or '').split(',')
+                                if ip.strip())
+
+    # Maintenance logs (app/logqueue.py): JSON lines written by a background
+    # thread, records below LOG_LEVEL dropped, rotated at LOG_MAX_BYTES (0:
+    # never, for an external logrotate; the file is reopened when moved)
+    LOG_LEVEL = (os.environ.get('LOG_LEVEL') or 'INFO').upper()
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT') or 5)
+
+    # Adds an X-SQL-Queries header to every response (always on in debug)
+    SQL_QUERY_COUNT_HEADER = os.environ.get('SQL_QUERY_COUNT_HEADER', '').lower() in ('1', 'true', 'yes')
 
     SQLALCHEMY_ENGINE_OPTIONS = {
         'connect_args': {
@@ -1,169 +1,125 @@
 import os
 import time
-import datetime
-import uuid
-from PIL import Image
-from app import create_app, db
-from app.models import Wallpaper, User, Tag
-from app.utils import (
-    get_system_load, 
-    get_image_hash, 
-    generate_thumbnail, 
-    generate_random_filename,
-    get_image_dimensions,
-    get_ai_tags
-)
+import threading
+from app import create_app
+from app.pipeline import process_quarantine_batch, process_tagging_batch, process_similar_batch
+from app.uploads import expire_sessions
+from app.reconcile import reconcile
+from app.governor import Governor
+from app.wakeup import quarantine_wakeup, tagging_wakeup
+from app.leader import LeaderLock
+from app.logqueue import config_logger, log_with
 
 LOG_FILE = 'maintainance.log'
-LOAD_THRESHOLD = 5.0  # Adjust based on CPU cores. Lower means more sensitive.
-SLEEP_IDLE = 30       # Seconds to sleep when no work is found
-SLEEP_HIGH_LOAD = 10  # Seconds to sleep when load is too high
+SLEEP_IDLE = 300      # Safety-net poll when idle; new work wakes the loops (app/wakeup.py)
+SLEEP_ERROR = 30      # Seconds to wait after an unexpected error
+SLEEP_HIGH_LOAD = 10  # Seconds to sleep while the governor has paused background work
+LEADER_RETRY = 15     # Seconds between attempts of a standby runner to take over
+SLEEP_TAGGING_BACKOFF = 10       # First back-off when the model backend fails
+SLEEP_TAGGING_BACKOFF_MAX = 300  # Cap for the exponential back-off
 DRY_RUN = False
 
-def log_message(message):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    formatted = f"[{timestamp}] {message}"
-    print(formatted)
-    with open(LOG_FILE, 'a') as f:
-        f.write(formatted + '\n')
+def log_message(message, level='info', **fields):
+    # Queued; written to LOG_FILE (JSON lines) and stdout by a background thread
+    log_with(config_logger('wally.maintenance', LOG_FILE), message, level, **fields)
 
-def process_single_quarantine(app):
-    """Processes exactly ONE pending wallpaper from quarantine."""
-    with app.app_context():
-        wallpaper = Wallpaper.query.filter_by(status='pending').first()
-        if not wallpaper:
-            return False
-            
-        quarantine_folder = app.config['QUARANTINE_FOLDER']
-        upload_folder = app.config['UPLOAD_FOLDER']
-        
-        log_message(f"Atomic Task: Security scanning {wallpaper.original_filename}")
-        quarantine_path = os.path.join(quarantine_folder, wallpaper.filename)
-        
-        if not os.path.exists(quarantine_path):
-            db.session.delete(wallpaper)
-            db.session.commit()
-            return True
+def make_governor(app, web_activity=None):
+    """Background concurrency limit that follows the container's CPU headroom (app/governor.py)."""
+    return Governor(app.config['QUARANTINE_WORKERS'], app.config['GOVERNOR_PRESSURE_LIMIT'],
+                    app.config['WEB_LATENCY_TARGET'], web_activity=web_activity, log=log_message)
 
+def process_quarantine(app, limit=None):
+    """Processes one batch of pending wallpapers from quarantine in the worker pool."""
+    return process_quarantine_batch(app, log=log_message, limit=limit)
+
+def process_similar(app):
+    """Refreshes a batch of stale "similar wallpapers" lists."""
+    return process_similar_batch(app, log=log_message)
+
+def run_tagging_loop(app, governor=None):
+    """
+    AI tagging stage, run in its own thread so a slow or dead model backend
+    never holds up quarantine processing. Backs off while the backend fails
+    and waits while the governor has paused background work.
+    """
+    backoff = SLEEP_TAGGING_BACKOFF
+    while True:
         try:
-            with Image.open(quarantine_path) as img:
-                img.verify()
-            
-            with Image.open(quarantine_path) as img:
-                if img.mode in ("RGBA", "P"):
-                    img = img.convert("RGB")
-                    
-                new_filename = generate_random_filename(wallpaper.original_filename)
-                final_path = os.path.join(upload_folder, new_filename)
-                
-                ext = wallpaper.original_filename.rsplit('.', 1)[1].lower() if '.' in wallpaper.original_filename else 'jpg'
-                format_map = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF'}
-                img.save(final_path, format_map.get(ext, 'JPEG'))
-                
-            wallpaper.filename = new_filename
-            wallpaper.status = 'active'
-            
-            thumb = generate_thumbnail(new_filename)
-            if thumb:
-                wallpaper.thumbnail_filename = thumb
-
-            # AI AUTO-TAGGING
-            ai_tags = get_ai_tags(final_path)
-            if ai_tags:
-                for tag_name in ai_tags:
-                    tag = Tag.query.filter_by(name=tag_name).first()
-                    if not tag:
-                        tag = Tag(name=tag_name)
-                        db.session.add(tag)
-                    if tag not in wallpaper.tags:
-                        wallpaper.tags.append(tag)
-
-            os.remove(quarantine_path)
-            log_message(f"Success: {wallpaper.original_filename} processed and moved.")
-            db.session.commit()
-            return True
-            
+            if governor is not None and governor.limit == 0:
+                time.sleep(SLEEP_HIGH_LOAD)
+                continue
+            handled, tagged = process_tagging_batch(app, log=log_message)
+            if not handled:
+                tagging_wakeup.wait(SLEEP_IDLE)
+            elif not tagged:
+                log_message(f"AI tagging returned nothing for {handled} image(s). Backing off {backoff}s.")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, SLEEP_TAGGING_BACKOFF_MAX)
+            else:
+                backoff = SLEEP_TAGGING_BACKOFF
         except Exception as e:
-            log_message(f"Error processing {wallpaper.original_filename}: {e}")
-            db.session.delete(wallpaper)
-            if os.path.exists(quarantine_path):
-                os.remove(quarantine_path)
-            db.session.commit()
-            return True
-
-def process_single_tagging(app):
-    """Processes exactly ONE untagged wallpaper."""
-    with app.app_context():
-        w = Wallpaper.query.filter(Wallpaper.status == 'active', ~Wallpaper.tags.any()).first()
-        if not w:
-            return False
-            
-        upload_folder = app.config['UPLOAD_FOLDER']
-        file_path = os.path.join(upload_folder, w.filename)
-        
-        if not os.path.exists(file_path):
-            log_message(f"Missing file for tagging: {w.filename}. Skipping.")
-            return False
-
-        log_message(f"Atomic Task: AI tagging existing image {w.filename}")
-        ai_tags = get_ai_tags(file_path)
-        if ai_tags:
-            for tag_name in ai_tags:
-                tag = Tag.query.filter_by(name=tag_name).first()
-                if not tag:
-                    tag = Tag(name=tag_name)
-                    db.session.add(tag)
-                if tag not in w.tags:
-                    w.tags.append(tag)
-            db.session.commit()
-        return True
+            log_message(f"Tagging thread error: {e}", 'error')
+            time.sleep(SLEEP_ERROR)
+
+def start_tagging_thread(app, governor=None):
+    thread = threading.Thread(target=run_tagging_loop, args=(app, governor), daemon=True)
+    thread.start()
+    return thread
 
 def run_cleanup(app):
-    """Occasional cleanup of orphans and duplicates."""
+    """Occasional cleanup of orphans and abandoned uploads."""
     with app.app_context():
-        log_message("Opportunistic Cleanup: Orphans and Duplicates")
-        upload_folder = app.config['UPLOAD_FOLDER']
-        
-        # Orphans
-        db_filenames = set()
-        for w in Wallpaper.query.all():
-            db_filenames.add(w.filename)
-            if w.thumbnail_filename:
-                db_filenames.add(w.thumbnail_filename)
-        
-        for filename in os.listdir(upload_folder):
-            if filename not in db_filenames and not filename.startswith('.'):
-                try:
-                    os.remove(os.path.join(upload_folder, filename))
-                except: pass
-        
-        # Very light version of Duplicates check (could be expanded)
-        # For a daemon, we just do a quick pass
+        log_message("Opportunistic Cleanup: Orphans")
+        config = app.config
+
+        # Orphans: only directories changed since the last pass are read, plus
+        # a full pass every RECONCILE_FULL_INTERVAL (app/reconcile.py)
+        reconcile(config['UPLOAD_FOLDER'], config['QUARANTINE_FOLDER'], config['RECONCILE_GRACE'],
+                  config['RECONCILE_STATE_FILE'], config['RECONCILE_JOURNAL'],
+                  full_interval=config['RECONCILE_FULL_INTERVAL'], log=log_message)
+
+        # Abandoned resumable uploads
+        expired = expire_sessions(config['QUARANTINE_FOLDER'], config['UPLOAD_SESSION_TTL'])
+        if expired:
+            log_message(f"Expired {expired} abandoned upload session(s).")
         return True
 
+def become_runner(app):
+    """Waits until this process holds the maintenance lock (app/leader.py)."""
+    lock = LeaderLock(app.config['MAINTENANCE_LOCK_FILE'])
+    lock.wait(LEADER_RETRY, on_standby=lambda pid: log_message(
+        f"Maintenance is running in process {pid}; standing by (pid {os.getpid()})."))
+    log_message(f"Process {os.getpid()} is the maintenance runner.")
+    return lock
+
 def main():
+    # This process is the runner; don't also start the in-app thread
+    os.environ.setdefault('SKIP_MAINTENANCE', '1')
     app = create_app()
     log_message("=== Maintenance Daemon Started ===")
+    become_runner(app)
+    governor = make_governor(app)
+    quarantine_wakeup.watch(app.config['QUARANTINE_FOLDER'])
+    start_tagging_thread(app, governor)
     
     last_cleanup = 0
     
     while True:
-        # 1. Check Load
-        load = get_system_load()
-        if load > LOAD_THRESHOLD:
-            # log_message(f"High Load ({load:.2f}). Pausing...") # Optional: keep logs lean
+        # 1. Check Load: cgroup quota, CPU pressure (app/governor.py)
+        limit = governor.update()
+        if limit == 0:
             time.sleep(SLEEP_HIGH_LOAD)
             continue
             
         # 2. Try Atomic Work
         work_done = False
         
-        # Priority 1: Quarantine
-        if process_single_quarantine(app):
+        # Priority 1: Quarantine (AI tagging runs on its own thread)
+        if process_quarantine(app, limit):
             work_done = True
             
-        # Priority 2: Tagging (if no quarantine work was done to prevent starvation)
-        elif process_single_tagging(app):
+        # Priority 2: Similar-wallpaper lists of new or retagged images
+        elif process_similar(app):
             work_done = True
             
         # Priority 3: Periodic Cleanup (every 1 hour-ish of active time)
@@ -173,28 +129,41 @@ def main():
             work_done = True
             
         if not work_done:
-            # log_message("No work found. Sleeping...")
-            time.sleep(SLEEP_IDLE)
-        else:
-            # Small yield to prevent 100% single-core thrashing if load average lags
+            # Until an upload commits (or the safety-net interval passes)
+            quarantine_wakeup.wait(SLEEP_IDLE)
+        elif limit < governor.max_workers:
+            # Small yield while the governor is holding back; at full speed go straight on
             time.sleep(0.5)
 
 def run_maintenance_loop(app):
     """
-    Function to be run in a background thread within the Flask app.
+    Function to be run in a background thread within the Flask app. Every
+    worker starts one, but only the process holding the maintenance lock does
+    any work; the rest wait to take over.
     """
+    from app.extensions import web_activity
+
+    become_runner(app)
     log_message("Starting background maintenance thread...")
+    # Runs next to the web workers, so slow requests in this process also hold it back
+    governor = make_governor(app, web_activity)
+    # Uploads handled by this worker notify directly; the marker covers the other workers
+    quarantine_wakeup.watch(app.config['QUARANTINE_FOLDER'])
+    start_tagging_thread(app, governor)
     last_cleanup = 0
     
     while True:
         try:
-            # On Render/Production, load might not be as reliable to check via getloadavg
-            # but we keep it for consistency.
+            limit = governor.update()
+            if limit == 0:
+                time.sleep(SLEEP_HIGH_LOAD)
+                continue
+
             work_done = False
             
-            if process_single_quarantine(app):
+            if process_quarantine(app, limit):
                 work_done = True
-            elif process_single_tagging(app):
+            elif process_similar(app):
                 work_done = True
             elif time.time() - last_cleanup > 3600:
                 run_cleanup(app)
@@ -202,12 +171,12 @@ def run_maintenance_loop(app):
                 work_done = True
                 
             if not work_done:
-                time.sleep(SLEEP_IDLE)
-            else:
-                time.sleep(1) # Small rest between items
+                quarantine_wakeup.wait(SLEEP_IDLE)
+            elif limit < governor.max_workers:
+                time.sleep(1) # Small rest between items while held back
         except Exception as e:
-            log_message(f"Maintenance thread error: {e}")
-            time.sleep(SLEEP_IDLE)
+            log_message(f"Maintenance thread error: {e}", 'error')
+            time.sleep(SLEEP_ERROR)
 
 if __name__ == '__main__':
     main()
@@ -1,92 +1,52 @@
 import os
 import time
-import datetime
-from PIL import Image
-from app import create_app, db
-from app.models import Wallpaper, Tag
-from app.utils import (
-    generate_thumbnail, 
-    generate_random_filename
-)
+from app import create_app
+from app.pipeline import process_quarantine_batch
+from app.governor import Governor
+from app.wakeup import quarantine_wakeup
+from app.leader import LeaderLock
+from app.logqueue import config_logger, log_with
 
 # Simplified maintenance for OnRender/Github
 # ONLY handles moving files from quarantine to active and generating thumbnails.
 # NO AI TAGGING.
 
 LOG_FILE = 'maintainance_render.log'
-SLEEP_IDLE = 30
+SLEEP_IDLE = 300  # Safety-net poll; uploads wake the loop (app/wakeup.py)
+SLEEP_ERROR = 30
+SLEEP_HIGH_LOAD = 10
+LEADER_RETRY = 15
 
-def log_message(message):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    formatted = f"[{timestamp}] {message}"
-    print(formatted)
-    with open(LOG_FILE, 'a') as f:
-        f.write(formatted + '\n')
+def log_message(message, level='info', **fields):
+    # Queued; written to LOG_FILE (JSON lines) and stdout by a background thread
+    log_with(config_logger('wally.maintenance_render', LOG_FILE), message, level, **fields)
 
-def process_single_quarantine(app):
-    with app.app_context():
-        wallpaper = Wallpaper.query.filter_by(status='pending').first()
-        if not wallpaper:
-            return False
-            
-        quarantine_folder = app.config['QUARANTINE_FOLDER']
-        upload_folder = app.config['UPLOAD_FOLDER']
-        
-        quarantine_path = os.path.join(quarantine_folder, wallpaper.filename)
-        
-        if not os.path.exists(quarantine_path):
-            db.session.delete(wallpaper)
-            db.session.commit()
-            return True
-
-        try:
-            with Image.open(quarantine_path) as img:
-                img.verify()
-            
-            with Image.open(quarantine_path) as img:
-                if img.mode in ("RGBA", "P"):
-                    img = img.convert("RGB")
-                    
-                new_filename = generate_random_filename(wallpaper.original_filename)
-                final_path = os.path.join(upload_folder, new_filename)
-                
-                ext = wallpaper.original_filename.rsplit('.', 1)[1].lower() if '.' in wallpaper.original_filename else 'jpg'
-                format_map = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF'}
-                img.save(final_path, format_map.get(ext, 'JPEG'))
-                
-            wallpaper.filename = new_filename
-            wallpaper.status = 'active'
-            
-            thumb = generate_thumbnail(new_filename)
-            if thumb:
-                wallpaper.thumbnail_filename = thumb
-
-            os.remove(quarantine_path)
-            log_message(f"Render Success: {wallpaper.original_filename} processed.")
-            db.session.commit()
-            return True
-            
-        except Exception as e:
-            log_message(f"Render Error: {e}")
-            db.session.delete(wallpaper)
-            if os.path.exists(quarantine_path):
-                os.remove(quarantine_path)
-            db.session.commit()
-            return True
+def process_quarantine(app, limit=None):
+    """Processes one batch of pending wallpapers from quarantine in the worker pool."""
+    return process_quarantine_batch(app, log=log_message, limit=limit)
 
 def main():
+    os.environ.setdefault('SKIP_MAINTENANCE', '1')
     app = create_app()
     log_message("=== Render Maintenance Daemon Started ===")
+    # Only one runner per host (app/leader.py)
+    LeaderLock(app.config['MAINTENANCE_LOCK_FILE']).wait(
+        LEADER_RETRY, on_standby=lambda pid: log_message(f"Maintenance is running in process {pid}; standing by."))
+    governor = Governor(app.config['QUARANTINE_WORKERS'], app.config['GOVERNOR_PRESSURE_LIMIT'],
+                        app.config['WEB_LATENCY_TARGET'], log=log_message)
+    quarantine_wakeup.watch(app.config['QUARANTINE_FOLDER'])
     
     while True:
         try:
-            if not process_single_quarantine(app):
-                time.sleep(SLEEP_IDLE)
-            else:
-                time.sleep(1)
+            limit = governor.update()
+            if limit == 0:
+                time.sleep(SLEEP_HIGH_LOAD)
+                continue
+            if not process_quarantine(app, limit):
+                quarantine_wakeup.wait(SLEEP_IDLE)
         except Exception as e:
-            log_message(f"Render Loop Error: {e}")
-            time.sleep(SLEEP_IDLE)
+            log_message(f"Render Loop Error: {e}", 'error')
+            time.sleep(SLEEP_ERROR)
 
 if __name__ == '__main__':
     main()
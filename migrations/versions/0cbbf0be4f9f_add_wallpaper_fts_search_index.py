@@ -0,0 +1,90 @@
+"""add wallpaper_fts search index
+
+Revision ID: 0cbbf0be4f9f
+Revises: 1c133c41923e
+Create Date: 2026-10-18 11:20:51.093317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0cbbf0be4f9f'
+down_revision = '1c133c41923e'
+branch_labels = None
+depends_on = None
+
+
+# One FTS5 row per *active* wallpaper (rowid = wallpaper.id) holding the title
+# and the space-joined tag names. Triggers keep it in sync with every write
+# path (routes, maintenance daemons, CLI commands and one-off scripts).
+INDEX_ROW = """
+    INSERT INTO wallpaper_fts (rowid, title, tags)
+    SELECT w.id, w.title,
+           (SELECT group_concat(t.name, ' ') FROM tag t
+            JOIN wallpaper_tags wt ON wt.tag_id = t.id
+            WHERE wt.wallpaper_id = w.id)
+    FROM wallpaper w WHERE w.id = {id} AND w.status = 'active';
+"""
+
+TRIGGERS = {
+    'wallpaper_fts_ai': f"""
+        CREATE TRIGGER wallpaper_fts_ai AFTER INSERT ON wallpaper BEGIN
+            {INDEX_ROW.format(id='new.id')}
+        END""",
+    'wallpaper_fts_au': f"""
+        CREATE TRIGGER wallpaper_fts_au AFTER UPDATE OF title, status ON wallpaper BEGIN
+            DELETE FROM wallpaper_fts WHERE rowid = old.id;
+            {INDEX_ROW.format(id='new.id')}
+        END""",
+    'wallpaper_fts_ad': """
+        CREATE TRIGGER wallpaper_fts_ad AFTER DELETE ON wallpaper BEGIN
+            DELETE FROM wallpaper_fts WHERE rowid = old.id;
+        END""",
+    'wallpaper_tags_fts_ai': f"""
+        CREATE TRIGGER wallpaper_tags_fts_ai AFTER INSERT ON wallpaper_tags BEGIN
+            DELETE FROM wallpaper_fts WHERE rowid = new.wallpaper_id;
+            {INDEX_ROW.format(id='new.wallpaper_id')}
+        END""",
+    'wallpaper_tags_fts_ad': f"""
+        CREATE TRIGGER wallpaper_tags_fts_ad AFTER DELETE ON wallpaper_tags BEGIN
+            DELETE FROM wallpaper_fts WHERE rowid = old.wallpaper_id;
+            {INDEX_ROW.format(id='old.wallpaper_id')}
+        END""",
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        # Other backends keep using the ILIKE fallback in app/search.py
+        return
+
+    op.execute("""
+        CREATE VIRTUAL TABLE wallpaper_fts USING fts5(
+            title, tags,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    for sql in TRIGGERS.values():
+        op.execute(sql)
+
+    # Backfill
+    op.execute("""
+        INSERT INTO wallpaper_fts (rowid, title, tags)
+        SELECT w.id, w.title,
+               (SELECT group_concat(t.name, ' ') FROM tag t
+                JOIN wallpaper_tags wt ON wt.tag_id = t.id
+                WHERE wt.wallpaper_id = w.id)
+        FROM wallpaper w WHERE w.status = 'active'
+    """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.execute("DROP TABLE IF EXISTS wallpaper_fts")
@@ -0,0 +1,25 @@
+"""add wallpaper processing_attempts
+
+Revision ID: 4e6a1c9b2d70
+Revises: a9d4e2f17c83
+Create Date: 2026-10-19 09:12:31.508214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e6a1c9b2d70'
+down_revision = 'a9d4e2f17c83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain add_column: batch mode would rebuild wallpaper and break the FTS triggers.
+    op.add_column('wallpaper', sa.Column('processing_attempts', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('wallpaper', 'processing_attempts')
@@ -0,0 +1,27 @@
+"""add feed keyset indexes
+
+Revision ID: 5f0d2c8e91a4
+Revises: 22e2b304aee8
+Create Date: 2026-10-18 15:02:37.418265
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f0d2c8e91a4'
+down_revision = '22e2b304aee8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain create_index: batch mode would rebuild wallpaper and break the FTS triggers
+    op.create_index('ix_wallpaper_status_timestamp_id', 'wallpaper', ['status', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_wallpaper_user_status_timestamp_id', 'wallpaper', ['user_id', 'status', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_wallpaper_user_status_timestamp_id', table_name='wallpaper')
+    op.drop_index('ix_wallpaper_status_timestamp_id', table_name='wallpaper')
@@ -0,0 +1,38 @@
+"""add tagging status to wallpaper
+
+Revision ID: 6d192d85fef8
+Revises: 9551a9bbb96f
+Create Date: 2026-10-18 09:12:40.318022
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d192d85fef8'
+down_revision = '9551a9bbb96f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('wallpaper', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tagging_status', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('tagging_attempts', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_wallpaper_tagging_status'), ['tagging_status'], unique=False)
+
+    # Anything that already has tags was handled by the old inline tagger
+    op.execute("""
+        UPDATE wallpaper SET tagging_attempts = 0,
+            tagging_status = CASE
+                WHEN EXISTS (SELECT 1 FROM wallpaper_tags WHERE wallpaper_tags.wallpaper_id = wallpaper.id)
+                THEN 'done' ELSE 'pending' END
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('wallpaper', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_wallpaper_tagging_status'))
+        batch_op.drop_column('tagging_attempts')
+        batch_op.drop_column('tagging_status')
@@ -0,0 +1,26 @@
+"""add wallpaper claimed_at
+
+Revision ID: 7b3f05e8c1a6
+Revises: e2b71c94d058
+Create Date: 2026-10-18 21:06:44.182730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3f05e8c1a6'
+down_revision = 'e2b71c94d058'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain add_column: batch mode would rebuild wallpaper and break the FTS triggers.
+    # Rows already stuck in processing/tagging have no lease and are claimed again.
+    op.add_column('wallpaper', sa.Column('claimed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('wallpaper', 'claimed_at')
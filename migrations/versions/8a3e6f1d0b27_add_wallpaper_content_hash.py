@@ -0,0 +1,27 @@
+"""add wallpaper content_hash
+
+Revision ID: 8a3e6f1d0b27
+Revises: 5f0d2c8e91a4
+Create Date: 2026-10-18 15:41:09.662810
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a3e6f1d0b27'
+down_revision = '5f0d2c8e91a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain add_column: batch mode would rebuild wallpaper and break the FTS triggers
+    op.add_column('wallpaper', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_wallpaper_content_hash'), 'wallpaper', ['content_hash'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_wallpaper_content_hash'), table_name='wallpaper')
+    op.drop_column('wallpaper', 'content_hash')
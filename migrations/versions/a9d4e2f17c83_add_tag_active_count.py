@@ -0,0 +1,86 @@
+"""add tag active_count
+
+Revision ID: a9d4e2f17c83
+Revises: 7b3f05e8c1a6
+Create Date: 2026-10-18 22:18:05.374921
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4e2f17c83'
+down_revision = '7b3f05e8c1a6'
+branch_labels = None
+depends_on = None
+
+
+# tag.active_count = number of *active* wallpapers carrying the tag. Like the
+# FTS index, it is kept in sync by triggers so every write path (routes,
+# pipeline, importer, scripts, raw wallpaper_tags inserts) is covered.
+ADJUST = """
+    UPDATE tag SET active_count = active_count + {delta}
+    WHERE id IN (SELECT tag_id FROM wallpaper_tags WHERE wallpaper_id = {id});
+"""
+
+TRIGGERS = {
+    'wallpaper_tags_count_ai': """
+        CREATE TRIGGER wallpaper_tags_count_ai AFTER INSERT ON wallpaper_tags
+        WHEN (SELECT status FROM wallpaper WHERE id = new.wallpaper_id) = 'active' BEGIN
+            UPDATE tag SET active_count = active_count + 1 WHERE id = new.tag_id;
+        END""",
+    'wallpaper_tags_count_ad': """
+        CREATE TRIGGER wallpaper_tags_count_ad AFTER DELETE ON wallpaper_tags
+        WHEN (SELECT status FROM wallpaper WHERE id = old.wallpaper_id) = 'active' BEGIN
+            UPDATE tag SET active_count = active_count - 1 WHERE id = old.tag_id;
+        END""",
+    'wallpaper_count_activate': f"""
+        CREATE TRIGGER wallpaper_count_activate AFTER UPDATE OF status ON wallpaper
+        WHEN new.status = 'active' AND old.status IS NOT 'active' BEGIN
+            {ADJUST.format(delta=1, id='new.id')}
+        END""",
+    'wallpaper_count_deactivate': f"""
+        CREATE TRIGGER wallpaper_count_deactivate AFTER UPDATE OF status ON wallpaper
+        WHEN old.status = 'active' AND new.status IS NOT 'active' BEGIN
+            {ADJUST.format(delta=-1, id='old.id')}
+        END""",
+    # Normally the ORM removes the wallpaper_tags rows first (handled above)
+    'wallpaper_count_ad': f"""
+        CREATE TRIGGER wallpaper_count_ad AFTER DELETE ON wallpaper
+        WHEN old.status = 'active' BEGIN
+            {ADJUST.format(delta=-1, id='old.id')}
+        END""",
+}
+
+
+def upgrade():
+    # Posting lists for the faceted browse page: wallpapers by tag, in id order
+    op.create_index('ix_wallpaper_tags_tag_id_wallpaper_id', 'wallpaper_tags', ['tag_id', 'wallpaper_id'], unique=False)
+
+    op.add_column('tag', sa.Column('active_count', sa.Integer(), nullable=False, server_default='0'))
+    op.create_index(op.f('ix_tag_active_count'), 'tag', ['active_count'], unique=False)
+
+    if op.get_bind().dialect.name != 'sqlite':
+        # Other backends count on the fly (app/facets.py)
+        return
+
+    for sql in TRIGGERS.values():
+        op.execute(sql)
+
+    # Backfill
+    op.execute("""
+        UPDATE tag SET active_count = (
+            SELECT count(*) FROM wallpaper_tags wt JOIN wallpaper w ON w.id = wt.wallpaper_id
+            WHERE wt.tag_id = tag.id AND w.status = 'active')
+    """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for name in TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    op.drop_index(op.f('ix_tag_active_count'), table_name='tag')
+    op.drop_column('tag', 'active_count')
+    op.drop_index('ix_wallpaper_tags_tag_id_wallpaper_id', table_name='wallpaper_tags')
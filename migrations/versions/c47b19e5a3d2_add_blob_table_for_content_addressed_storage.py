@@ -0,0 +1,120 @@
+"""add blob table for content-addressed storage
+
+Revision ID: c47b19e5a3d2
+Revises: 8a3e6f1d0b27
+Create Date: 2026-10-18 16:27:44.105938
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47b19e5a3d2'
+down_revision = '8a3e6f1d0b27'
+branch_labels = None
+depends_on = None
+
+
+# Identical uploads now share one stored file, so wallpaper.filename,
+# wallpaper.thumbnail_filename and wallpaper_variant.filename can no longer be
+# unique. SQLite can only drop a UNIQUE constraint by rebuilding the table, and
+# the FTS triggers (migration 0cbbf0be4f9f) reference wallpaper, so they are
+# dropped around the rebuild and recreated from the same SQL.
+INDEX_ROW = """
+    INSERT INTO wallpaper_fts (rowid, title, tags)
+    SELECT w.id, w.title,
+           (SELECT group_concat(t.name, ' ') FROM tag t
+            JOIN wallpaper_tags wt ON wt.tag_id = t.id
+            WHERE wt.wallpaper_id = w.id)
+    FROM wallpaper w WHERE w.id = {id} AND w.status = 'active';
+"""
+
+FTS_TRIGGERS = {
+    'wallpaper_fts_ai': f"""
+        CREATE TRIGGER wallpaper_fts_ai AFTER INSERT ON wallpaper BEGIN
+            {INDEX_ROW.format(id='new.id')}
+        END""",
+    'wallpaper_fts_au': f"""
+        CREATE TRIGGER wallpaper_fts_au AFTER UPDATE OF title, status ON wallpaper BEGIN
+            DELETE FROM wallpaper_fts WHERE rowid = old.id;
+            {INDEX_ROW.format(id='new.id')}
+        END""",
+    'wallpaper_fts_ad': """
+        CREATE TRIGGER wallpaper_fts_ad AFTER DELETE ON wallpaper BEGIN
+            DELETE FROM wallpaper_fts WHERE rowid = old.id;
+        END""",
+    'wallpaper_tags_fts_ai': f"""
+        CREATE TRIGGER wallpaper_tags_fts_ai AFTER INSERT ON wallpaper_tags BEGIN
+            DELETE FROM wallpaper_fts WHERE rowid = new.wallpaper_id;
+            {INDEX_ROW.format(id='new.wallpaper_id')}
+        END""",
+    'wallpaper_tags_fts_ad': f"""
+        CREATE TRIGGER wallpaper_tags_fts_ad AFTER DELETE ON wallpaper_tags BEGIN
+            DELETE FROM wallpaper_fts WHERE rowid = old.wallpaper_id;
+            {INDEX_ROW.format(id='old.wallpaper_id')}
+        END""",
+}
+
+
+def _has_fts():
+    bind = op.get_bind()
+    return bind.dialect.name == 'sqlite' and bind.execute(
+        sa.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'wallpaper_fts'")).first() is not None
+
+
+def _without_unique(table_name):
+    """The reflected table minus its UNIQUE constraints (unique indexes such as the slug's are kept)."""
+    table = sa.Table(table_name, sa.MetaData(), autoload_with=op.get_bind())
+    for constraint in list(table.constraints):
+        if isinstance(constraint, sa.UniqueConstraint):
+            table.constraints.discard(constraint)
+    return table
+
+
+def upgrade():
+    op.create_table('blob',
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=140), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('hash'),
+    sa.UniqueConstraint('filename')
+    )
+
+    fts = _has_fts()
+    if fts:
+        for name in FTS_TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    with op.batch_alter_table('wallpaper', recreate='always', copy_from=_without_unique('wallpaper')) as batch_op:
+        batch_op.create_index(batch_op.f('ix_wallpaper_filename'), ['filename'], unique=False)
+
+    with op.batch_alter_table('wallpaper_variant', recreate='always', copy_from=_without_unique('wallpaper_variant')):
+        pass
+
+    if fts:
+        for sql in FTS_TRIGGERS.values():
+            op.execute(sql)
+
+
+def downgrade():
+    fts = _has_fts()
+    if fts:
+        for name in FTS_TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    with op.batch_alter_table('wallpaper_variant', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_wallpaper_variant_filename', ['filename'])
+
+    with op.batch_alter_table('wallpaper', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_wallpaper_filename'))
+        batch_op.create_unique_constraint('uq_wallpaper_filename', ['filename'])
+        batch_op.create_unique_constraint('uq_wallpaper_thumbnail_filename', ['thumbnail_filename'])
+
+    if fts:
+        for sql in FTS_TRIGGERS.values():
+            op.execute(sql)
+
+    op.drop_table('blob')
@@ -0,0 +1,27 @@
+"""add derived filename indexes
+
+Revision ID: e2b71c94d058
+Revises: c47b19e5a3d2
+Create Date: 2026-10-18 19:41:12.603518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b71c94d058'
+down_revision = 'c47b19e5a3d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Lookups by file name for the orphan reconciler; plain create_index keeps the FTS triggers intact
+    op.create_index(op.f('ix_wallpaper_thumbnail_filename'), 'wallpaper', ['thumbnail_filename'], unique=False)
+    op.create_index(op.f('ix_wallpaper_variant_filename'), 'wallpaper_variant', ['filename'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_wallpaper_variant_filename'), table_name='wallpaper_variant')
+    op.drop_index(op.f('ix_wallpaper_thumbnail_filename'), table_name='wallpaper')
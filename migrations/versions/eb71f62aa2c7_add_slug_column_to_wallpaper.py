@@ -0,0 +1,41 @@
+"""add slug column to wallpaper
+
+Revision ID: eb71f62aa2c7
+Revises: bba4e1723237
+Create Date: 2026-10-18 13:30:44.120958
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'eb71f62aa2c7'
+down_revision = 'bba4e1723237'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain ALTER TABLE (not batch mode) so the wallpaper_fts triggers survive
+    op.add_column('wallpaper', sa.Column('slug', sa.String(length=140), nullable=True))
+
+    # Backfill active rows with the filename stem, which is what the old
+    # Wallpaper.slug property returned. Stems can clash (a.jpg / a.png), in
+    # which case the later row gets its id appended.
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, filename FROM wallpaper WHERE status = 'active' ORDER BY id")).fetchall()
+    seen = set()
+    for wallpaper_id, filename in rows:
+        slug = filename.rsplit('.', 1)[0] if '.' in filename else filename
+        if slug in seen:
+            slug = f"{slug}-{wallpaper_id}"
+        seen.add(slug)
+        conn.execute(sa.text("UPDATE wallpaper SET slug = :slug WHERE id = :id"), {'slug': slug, 'id': wallpaper_id})
+
+    op.create_index(op.f('ix_wallpaper_slug'), 'wallpaper', ['slug'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_wallpaper_slug'), table_name='wallpaper')
+    op.drop_column('wallpaper', 'slug')
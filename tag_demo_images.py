@@ -3,7 +3,9 @@ os.environ['SKIP_MAINTENANCE'] = 'true'
 
 from app import create_app, db
 from app.models import Wallpaper, Tag
-from app.utils import get_ai_tags
+from app.catalog import wallpaper_retagged
+from app.tags import attach_tags
+from app.ollama import get_client
 
 def tag_images():
     app = create_app()
@@ -18,34 +20,39 @@ def tag_images():
             for gt in generic_tags:
                 if gt in w.tags:
                     w.tags.remove(gt)
+                    wallpaper_retagged(w)
         db.session.commit()
         print("Cleared generic tags from wallpapers.")
 
-        # 2. Perform real AI tagging
+        # 2. Perform real AI tagging, keeping the model server busy with
+        # several images in flight at once
         upload_folder = app.config['UPLOAD_FOLDER']
-        count = 0
+        by_id = {}
+        jobs = []
         for w in wallpapers:
-            print(f"[{count+1}/50] Tagging {w.filename}...")
             file_path = os.path.join(upload_folder, w.filename)
-            ai_tags = get_ai_tags(file_path)
+            if os.path.exists(file_path):
+                # Keyed by id: identical images share one stored file
+                by_id[w.id] = w
+                jobs.append((w.id, file_path))
+        count = 0
+        for wallpaper_id, ai_tags in get_client().tag_many(jobs):
+            w = by_id[wallpaper_id]
+            print(f"[{count+1}/{len(jobs)}] Tagged {w.filename}")
             
             if ai_tags:
-                for tag_name in ai_tags:
-                    tag = Tag.query.filter_by(name=tag_name).first()
-                    if not tag:
-                        tag = Tag(name=tag_name)
-                        db.session.add(tag)
-                    if tag not in w.tags:
-                        w.tags.append(tag)
+                attach_tags(w, ai_tags)
+                w.tagging_status = 'done'
+                wallpaper_retagged(w)
                 print(f"  Added: {', '.join(ai_tags)}")
             else:
                 print("  No AI tags generated.")
             
             count += 1
-            if count % 10 == 0:
-                db.session.commit() # Periodic commit
+            # Commit each image: an open write transaction would lock the DB
+            # while the remaining model calls run
+            db.session.commit()
         
-        db.session.commit()
         print(f"Successfully processed {count} images with AI tagging.")
 
 if __name__ == '__main__':
@@ -3,7 +3,10 @@ import re
 os.environ['SKIP_MAINTENANCE'] = 'true'
 
 from app import create_app, db
-from app.models import Wallpaper, Tag
+from app.models import Wallpaper, Blob
+from app.catalog import wallpaper_retagged
+from app.storage import file_sha256
+from app.tags import attach_tags
 from app.utils import get_ai_tags
 
 def get_allowed_files():
@@ -18,6 +21,21 @@ def get_allowed_files():
                     allowed_files.append(match.group(1))
     return allowed_files
 
+def find_wallpapers(upload_folder, filename):
+    """
+    Wallpapers stored under a flat name from .gitignore. After `flask
+    migrate-storage` they live under the sharded name of the same bytes, so
+    the committed file is hashed to find its blob.
+    """
+    wallpapers = Wallpaper.query.filter_by(filename=filename).all()
+    path = os.path.join(upload_folder, filename)
+    if wallpapers or not os.path.exists(path):
+        return wallpapers
+    blob = db.session.get(Blob, file_sha256(path))
+    if blob is None:
+        return []
+    return Wallpaper.query.filter_by(filename=blob.filename).all()
+
 def tag_specific_files():
     app = create_app()
     with app.app_context():
@@ -27,37 +45,39 @@ def tag_specific_files():
         upload_folder = app.config['UPLOAD_FOLDER']
         
         for filename in allowed_filenames:
-            w = Wallpaper.query.filter_by(filename=filename).first()
-            if not w:
-                print(f"File {filename} not in DB. Skipping.")
+            wallpapers = find_wallpapers(upload_folder, filename)
+            if not wallpapers:
+                print(f"File {filename} not in DB (or removed by migrate-storage; git checkout restores it). Skipping.")
                 continue
                 
             print(f"Checking {filename}...")
-            file_path = os.path.join(upload_folder, filename)
+            # Identical files share one stored blob, so every wallpaper on it gets the tags
+            file_path = os.path.join(upload_folder, wallpapers[0].filename)
             
             # If it has generic tags or no tags, we process it
             generic_tag_names = {"wallpaper", "hd", "background", "demo", "nature"}
-            has_real_tags = any(t.name not in generic_tag_names for t in w.tags)
+            wallpapers = [w for w in wallpapers if not any(t.name not in generic_tag_names for t in w.tags)]
             
-            if has_real_tags:
+            if not wallpapers:
                 print(f"  {filename} already has descriptive tags. Skipping AI processing.")
                 continue
 
-            # Clear generic tags if any
-            for tag in list(w.tags):
-                if tag.name in generic_tag_names:
-                    w.tags.remove(tag)
-
+            # Ask the model before changing anything, so no write is pending while it runs
             print(f"  Tagging {filename} with AI...")
             ai_tags = get_ai_tags(file_path)
+
+            # Clear generic tags if any
+            for w in wallpapers:
+                for tag in list(w.tags):
+                    if tag.name in generic_tag_names:
+                        w.tags.remove(tag)
+                        wallpaper_retagged(w)
+
             if ai_tags:
-                for tag_name in ai_tags:
-                    tag = Tag.query.filter_by(name=tag_name).first()
-                    if not tag:
-                        tag = Tag(name=tag_name)
-                        db.session.add(tag)
-                    if tag not in w.tags:
-                        w.tags.append(tag)
+                for w in wallpapers:
+                    attach_tags(w, ai_tags)
+                    w.tagging_status = 'done'
+                    wallpaper_retagged(w)
                 print(f"    Added: {', '.join(ai_tags)}")
             
             db.session.commit()
@@ -0,0 +1,30 @@
+import os
+import pytest
+
+os.environ.setdefault('SKIP_MAINTENANCE', '1')
+
+
+@pytest.fixture
+def app(tmp_path):
+    from config import Config
+    from app import create_app, db
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        QUARANTINE_FOLDER = str(tmp_path / 'quarantine')
+        RESIZE_CACHE_FOLDER = str(tmp_path / 'resized')
+        CATALOG_VERSION_FILE = str(tmp_path / 'catalog.version')
+        RECONCILE_STATE_FILE = str(tmp_path / 'reconcile.json')
+        METRICS_FOLDER = str(tmp_path / 'metrics')
+        MAINTENANCE_LOCK_FILE = str(tmp_path / 'maintenance.lock')
+        SQL_QUERY_COUNT_HEADER = True
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
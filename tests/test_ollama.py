@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app.ollama import OllamaClient
+
+
+class StubOllama(ThreadingHTTPServer):
+    """A local /api/generate that records connections and concurrency, failing the first `failures` calls."""
+
+    daemon_threads = True
+
+    def __init__(self, failures=0, delay=0.0):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.failures = failures
+        self.delay = delay
+        self.requests = 0
+        self.connections = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so connection reuse is visible
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            fail = server.requests <= server.failures
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+
+        if fail:
+            self._reply(503, {'error': 'loading model'})
+        elif payload.get('images'):
+            self._reply(200, {'response': 'A red sunset over a calm sea.'})
+        else:
+            self._reply(200, {'response': 'sunset, sea, red'})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        server = StubOllama(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f"{i}.jpg"
+        path.write_bytes(b'not really a jpeg')
+        paths.append(str(path))
+    return paths
+
+
+def test_tag_many_tags_every_image(stub, images):
+    server = stub()
+    client = OllamaClient(server.url, max_in_flight=2)
+    results = dict(client.tag_many(enumerate(images)))
+    assert set(results) == set(range(len(images)))
+    assert all(tags == ['sunset', 'sea', 'red'] for tags in results.values())
+    assert server.requests == 2 * len(images)
+
+
+def test_tag_many_keeps_entries_that_share_a_file(stub, images):
+    server = stub()
+    client = OllamaClient(server.url, max_in_flight=2)
+    results = dict(client.tag_many([(1, images[0]), (2, images[0]), (3, images[1])]))
+    assert sorted(results) == [1, 2, 3]
+
+
+def test_connections_are_reused(stub, images):
+    server = stub()
+    client = OllamaClient(server.url, max_in_flight=2)
+    list(client.tag_many(enumerate(images)))
+    assert len(server.connections) <= 2
+
+
+def test_in_flight_requests_are_bounded(stub, images):
+    server = stub(delay=0.05)
+    client = OllamaClient(server.url, max_in_flight=3)
+    list(client.tag_many(enumerate(images)))
+    # Pipelined up to the bound, never beyond it
+    assert server.max_in_flight == 3
+
+
+def test_transient_failures_are_retried(stub, images):
+    server = stub(failures=2)
+    client = OllamaClient(server.url, max_in_flight=1, retries=3, backoff=0.01)
+    assert client.tag_file(images[0]) == ['sunset', 'sea', 'red']
+    assert server.requests == 4  # Two 503s, then describe and extract
+
+
+def test_gives_up_after_retries(stub, images):
+    server = stub(failures=100)
+    client = OllamaClient(server.url, max_in_flight=1, retries=2, backoff=0.01)
+    started = time.monotonic()
+    assert client.tag_file(images[0]) == []
+    assert server.requests == 3
+    # Backoff doubles: 0.01 + 0.02 seconds at least
+    assert time.monotonic() - started >= 0.03
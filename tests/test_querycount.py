@@ -0,0 +1,46 @@
+import uuid
+import pytest
+from app.extensions import db
+from app.models import User, Wallpaper
+from app.catalog import wallpaper_activated
+from app.tags import attach_tags
+
+# The grid pages batch-load tags, so the statements behind a page must not
+# depend on how many cards it shows.
+
+
+def add_wallpapers(app, user_id, count):
+    with app.app_context():
+        for _ in range(count):
+            name = uuid.uuid4().hex
+            wallpaper = Wallpaper(title=f"Wallpaper {name[:6]}", filename=f"{name}.jpg",
+                                  thumbnail_filename=f"thumb_{name}.webp", original_filename=f"{name}.jpg",
+                                  slug=name, status='active', user_id=user_id)
+            db.session.add(wallpaper)
+            db.session.flush()
+            attach_tags(wallpaper, [f"tag{name[:6]}", 'shared'])
+            wallpaper_activated(wallpaper)
+        db.session.commit()
+
+
+def statements(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return int(response.headers['X-SQL-Queries'])
+
+
+@pytest.mark.parametrize('url', ['/', '/browse', '/search?q=wallpaper', '/alice'])
+def test_grid_statements_do_not_grow_with_page_size(app, url):
+    with app.app_context():
+        user = User(username='alice', email='alice@example.com')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+
+    add_wallpapers(app, user_id, 2)
+    two_cards = statements(client, url)
+    add_wallpapers(app, user_id, 30)  # More than one page (24 cards)
+    full_page = statements(client, url)
+
+    assert full_page == two_cards